@@ -1,10 +1,22 @@
 from uuid import uuid4 as uuid
 
 import new_bing as nbing
+from config import Config
+from memory import get_memory
+from memory.metadata import MemoryMetadata
+from message_history import MessageHistory
+
+cfg = Config()
 
 agents = {}  # key, (agent, task, full_message_history)
 
 
+def _remember(key, messages):
+    """Adds the messages evicted from the history of an agent to long-term memory"""
+    turns = "\n".join(f"{message['role'].capitalize()}: {message['content']}" for message in messages)
+    get_memory(cfg).add(turns, MemoryMetadata(source="agent_history", agent=key))
+
+
 def create_agent(task, prompt):
     """Create a new agent and return its key"""
     global next_key
@@ -16,10 +28,11 @@ def create_agent(task, prompt):
     agent_reply = nbing.ask_question(prompt, agent)
 
     # Update full message history
-    history = [
+    history = MessageHistory(cfg.history_token_limit, on_evict=lambda messages: _remember(key, messages))
+    history.extend([
         {"role": "user", "content": prompt},
         {"role": "assistant", "content": agent_reply}
-    ]
+    ])
 
     # Update agent dict
     agents[key] = (agent, task, history)
@@ -0,0 +1,67 @@
+"""
+Recall and latency of the IVF index against exact LocalCache search.
+
+Run from the `scripts` directory:
+
+    python -m benchmarks.ann --sizes 10000 100000 --probes 4 8 16 32
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from memory.ann import IVFIndex
+from memory.base import top_k_indices
+from memory.local import EMBED_DIM
+
+
+def clustered_rows(n, topic_size=50, noise=1.0, seed=0):
+    """Unit vectors drawn around random topics, like real memory embeddings."""
+    rng = np.random.default_rng(seed)
+    n_topics = max(1, n // topic_size)
+    topics = rng.standard_normal((n_topics, EMBED_DIM)).astype(np.float32)
+    topics /= np.linalg.norm(topics, axis=1, keepdims=True)
+    rows = topics[rng.integers(n_topics, size=n)]
+    rows += noise * rng.standard_normal((n, EMBED_DIM)).astype(np.float32) / np.sqrt(EMBED_DIM)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--probes", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'probes':>7} {'recall@k':>9} {'exact q':>10} {'ivf q':>10} {'train':>8}")
+    for n in args.sizes:
+        rows = clustered_rows(n + args.queries)
+        matrix, queries = rows[:n], rows[n:]
+
+        start = time.perf_counter()
+        exact = [top_k_indices(np.dot(matrix, q), args.k) for q in queries]
+        exact_time = (time.perf_counter() - start) / len(queries)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            index = IVFIndex(os.path.join(tmp, "bench"))
+            start = time.perf_counter()
+            index.train(matrix)
+            train_time = time.perf_counter() - start
+
+            for n_probe in args.probes:
+                index.n_probe = n_probe
+                start = time.perf_counter()
+                approx = [index.search(matrix, q, args.k) for q in queries]
+                ivf_time = (time.perf_counter() - start) / len(queries)
+                recall = np.mean([
+                    len(np.intersect1d(a, e)) / len(e) for a, e in zip(approx, exact, strict=True)
+                ])
+                print(f"{n:>10} {n_probe:>7} {recall:>9.3f} {exact_time * 1e3:>8.2f}ms "
+                      f"{ivf_time * 1e3:>8.2f}ms {train_time:>7.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Throughput of add_many and get_relevant_many against looping over add and
+get_relevant, on any memory backend.
+
+Run from the `scripts` directory:
+
+    python -m benchmarks.batch_add --backend local --count 512
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from config import Config
+from memory import get_memory
+
+WORDS = (
+    "agent command result file search browse memory summary error python "
+    "shell write read google website task goal plan reasoning criticism"
+).split()
+
+
+def synthetic_texts(count, prefix, seed=0):
+    """Distinct texts so the embedding cache never hits."""
+    rng = random.Random(seed)
+    return [
+        f"{prefix} {i}: " + " ".join(rng.choice(WORDS) for _ in range(40))
+        for i in range(count)
+    ]
+
+
+def rate(count, seconds):
+    return f"{count / seconds:>10.1f}/s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", default="local")
+    parser.add_argument("--count", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    cfg = Config()
+    cfg.memory_backend = args.backend
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.backend == "local":
+            cfg.memory_index = os.path.join(tmp, "bench")
+        memory = get_memory(cfg, init=True)
+        memory.clear()
+
+        texts = synthetic_texts(args.count, "looped")
+        start = time.perf_counter()
+        for text in texts:
+            memory.add(text)
+        looped_add = time.perf_counter() - start
+
+        texts = synthetic_texts(args.count, "batched")
+        start = time.perf_counter()
+        memory.add_many(texts)
+        batched_add = time.perf_counter() - start
+
+        queries = synthetic_texts(args.queries, "looped query", seed=1)
+        start = time.perf_counter()
+        for query in queries:
+            memory.get_relevant(query, args.k)
+        looped_query = time.perf_counter() - start
+
+        queries = synthetic_texts(args.queries, "batched query", seed=1)
+        start = time.perf_counter()
+        memory.get_relevant_many(queries, args.k)
+        batched_query = time.perf_counter() - start
+
+        memory.clear()
+
+    print(f"backend: {memory.__class__.__name__}")
+    print(f"add          loop {rate(args.count, looped_add)}  batch {rate(args.count, batched_add)}")
+    print(f"get_relevant loop {rate(args.queries, looped_query)}  batch {rate(args.queries, batched_query)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Micro-benchmark of the LocalCache embedding buffer and top-k search.
+
+Run from the `scripts` directory:
+
+    python -m benchmarks.local_cache --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+from memory.base import top_k_indices
+from memory.local import EMBED_DIM, CacheContent
+
+
+def random_rows(n, seed=0):
+    rows = np.random.default_rng(seed).standard_normal((n, EMBED_DIM)).astype(np.float32)
+    rows /= np.linalg.norm(rows, axis=1, keepdims=True)
+    return rows
+
+
+def time_buffer_add(rows):
+    """Average seconds per add when growing a CacheContent to len(rows)."""
+    content = CacheContent()
+    start = time.perf_counter()
+    for row in rows:
+        content.append("", row)
+    return (time.perf_counter() - start) / len(rows)
+
+
+def time_concatenate_add(rows, samples):
+    """Average seconds per add of the old np.concatenate path at len(rows)."""
+    start = time.perf_counter()
+    for row in rows[:samples]:
+        np.concatenate([rows, row[np.newaxis, :]], axis=0)
+    return (time.perf_counter() - start) / samples
+
+
+def time_query(matrix, query, k, select, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        select(np.dot(matrix, query), k)
+    return (time.perf_counter() - start) / repeat
+
+
+def argsort_top_k(scores, k):
+    return np.argsort(scores)[-k:][::-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=20,
+                        help="Adds timed on the concatenate path per size")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'buffer add':>12} {'concat add':>12} "
+          f"{'argsort q':>12} {'argpart q':>12}")
+    for n in args.sizes:
+        rows = random_rows(n)
+        query = random_rows(1, seed=1)[0]
+
+        buffer_add = time_buffer_add(rows)
+        concat_add = time_concatenate_add(rows, args.samples)
+        argsort_query = time_query(rows, query, args.k, argsort_top_k, args.repeat)
+        argpart_query = time_query(rows, query, args.k, top_k_indices, args.repeat)
+
+        print(f"{n:>10} {buffer_add * 1e6:>10.2f}us {concat_add * 1e6:>10.2f}us "
+              f"{argsort_query * 1e3:>10.2f}ms {argpart_query * 1e3:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+Benchmark suite comparing the memory backends on the operations of the
+agent loop, emitting JSON to track regressions between releases.
+
+For each backend and corpus size it measures:
+
+    bulk_add_seconds        add_many of the synthetic corpus
+    add_ms                  p50/p99 latency of single adds on top of it
+    get_relevant_ms         p50/p99 latency of get_relevant
+    recall_at_k             overlap with exact search over the embeddings,
+                            lowered by design by a --lexical-weight above 0
+    rss_bytes               resident memory grown while loading the corpus
+    disk_bytes              size of the files the backend wrote
+    cold_start_seconds      time to open the stored corpus in a new provider
+
+Query embeddings are computed up front, so latencies measure the backend
+and not the embedding model. Pinecone runs against an in-process stand-in
+for `pinecone.Index`; Redis needs a Redis Stack server and is reported as
+an error when none is reachable.
+
+Run from the `scripts` directory:
+
+    python -m benchmarks.memory_suite --sizes 1000 10000 --output memory.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+from benchmarks.batch_add import synthetic_texts
+from config import Config, Singleton
+from memory import LocalCache, NoMemory, PineconeMemory, RedisMemory
+from memory.base import get_flax_embedding, get_flax_embeddings, top_k_indices
+
+# The stand-in for `pinecone.Index` is shared with the tests at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir))
+from tests.pinecone_stub import StubIndex  # noqa: E402
+
+BACKENDS = ("local", "redis", "pinecone", "no_memory")
+
+
+def current_rss():
+    """The resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def percentiles(seconds):
+    millis = np.asarray(seconds) * 1e3
+    return {"p50": float(np.percentile(millis, 50)), "p99": float(np.percentile(millis, 99))}
+
+
+def open_backend(backend, cfg, stub_index):
+    """A new provider for the backend, dropping any previous instance."""
+    cls = {"local": LocalCache, "redis": RedisMemory,
+           "pinecone": PineconeMemory, "no_memory": NoMemory}[backend]
+    if cls is None:
+        raise RuntimeError(f"The {backend} backend is not installed")
+    Singleton._instances.pop(cls, None)
+    if backend == "pinecone":
+        return cls(cfg, index=stub_index)
+    return cls(cfg)
+
+
+def close_backend(memory):
+    writer = getattr(memory, "writer", None)
+    if writer is not None:
+        writer.close()
+
+
+def run(backend, size, args, workdir):
+    cfg = Config()
+    cfg.memory_backend = backend
+    cfg.memory_index = os.path.join(workdir, "bench") if backend == "local" else "bench-suite"
+    cfg.wipe_redis_on_start = True
+    cfg.local_memory_lexical_weight = args.lexical_weight
+    stub_index = StubIndex()
+
+    corpus = synthetic_texts(size, f"memory {backend}")
+    extra = synthetic_texts(args.adds, f"extra {backend}", seed=2)
+    queries = synthetic_texts(args.queries, "query", seed=1)
+    corpus_embeddings = get_flax_embeddings(corpus)
+    get_flax_embeddings(extra)
+    query_embeddings = get_flax_embeddings(queries)
+
+    rss_before = current_rss()
+    memory = open_backend(backend, cfg, stub_index)
+    memory.clear()
+    start = time.perf_counter()
+    for offset in range(0, size, args.batch_size):
+        memory.add_many(corpus[offset:offset + args.batch_size])
+    bulk_add = time.perf_counter() - start
+
+    add_times = []
+    for text in extra:
+        start = time.perf_counter()
+        memory.add(text)
+        add_times.append(time.perf_counter() - start)
+
+    query_times = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(memory.get_relevant(query, args.k))
+        query_times.append(time.perf_counter() - start)
+    rss_grown = current_rss() - rss_before
+
+    recall = None
+    if backend != "no_memory":
+        texts = corpus + extra
+        matrix = np.vstack([corpus_embeddings, get_flax_embeddings(extra)])
+        hits = [
+            len({texts[i] for i in top_k_indices(np.dot(matrix, q), args.k)} & set(found or []))
+            for q, found in zip(query_embeddings, results, strict=True)
+        ]
+        recall = float(np.mean(hits)) / args.k
+
+    close_backend(memory)
+    cold_start = None
+    if backend in ("local", "redis"):
+        cfg.wipe_redis_on_start = False
+        start = time.perf_counter()
+        memory = open_backend(backend, cfg, stub_index)
+        memory.get_relevant(queries[0], args.k)
+        cold_start = time.perf_counter() - start
+
+    disk = directory_size(workdir) if backend == "local" else None
+    memory.clear()
+    close_backend(memory)
+    return {
+        "backend": backend,
+        "size": size,
+        "bulk_add_seconds": bulk_add,
+        "add_ms": percentiles(add_times),
+        "get_relevant_ms": percentiles(query_times),
+        "recall_at_k": recall,
+        "rss_bytes": rss_grown,
+        "disk_bytes": disk,
+        "cold_start_seconds": cold_start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000])
+    parser.add_argument("--adds", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--lexical-weight", type=float, default=Config().local_memory_lexical_weight,
+                        help="The BM25 weight of the local backend")
+    parser.add_argument("--output", help="Write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    # Warm the model so the first backend does not pay for loading it
+    get_flax_embedding("warm up")
+    report = {
+        "created_at": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "args": vars(args),
+        "results": [],
+    }
+    for size in args.sizes:
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as workdir:
+                try:
+                    result = run(backend, size, args, workdir)
+                except Exception as e:
+                    result = {"backend": backend, "size": size, "error": str(e)}
+            print(f"{backend} {size}: done", file=sys.stderr)
+            report["results"].append(result)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
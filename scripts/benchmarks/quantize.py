@@ -0,0 +1,67 @@
+"""
+Recall, latency and size of quantized LocalCache embeddings against exact
+float32 search.
+
+Run from the `scripts` directory:
+
+    python -m benchmarks.quantize --sizes 10000 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+from benchmarks.ann import clustered_rows
+from memory.base import top_k_indices
+from memory.local import EMBED_DIM, CacheContent
+from memory.quantize import PRECISIONS, Quantizer
+from memory.storage import AppendOnlyStorage
+
+
+def search(content, storage, query, k, rescore_factor):
+    """The LocalCache exact-path search, without the embedding model."""
+    if content.quantizer.is_exact:
+        return top_k_indices(content.scores(query), k)
+    indices = top_k_indices(content.scores(query), k * rescore_factor)
+    exact_scores = np.dot(storage.rows(indices), query)
+    return indices[top_k_indices(exact_scores, k)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore-factor", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'precision':>9} {'recall@k':>9} {'no rescore':>10} "
+          f"{'query':>9} {'RAM':>9} {'file':>9}")
+    for n in args.sizes:
+        rows = clustered_rows(n + args.queries)
+        matrix, queries = rows[:n], rows[n:]
+        exact = [top_k_indices(np.dot(matrix, q), args.k) for q in queries]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = AppendOnlyStorage(os.path.join(tmp, "bench"), EMBED_DIM)
+            storage.append_many([""] * n, matrix)
+
+            for precision in PRECISIONS:
+                content = CacheContent.from_rows([""] * n, matrix, Quantizer(precision))
+
+                coarse = [top_k_indices(content.scores(q), args.k) for q in queries]
+                start = time.perf_counter()
+                found = [search(content, storage, q, args.k, args.rescore_factor) for q in queries]
+                query_time = (time.perf_counter() - start) / len(queries)
+
+                recall = np.mean([len(np.intersect1d(f, e)) / args.k for f, e in zip(found, exact, strict=True)])
+                coarse_recall = np.mean([len(np.intersect1d(c, e)) / args.k for c, e in zip(coarse, exact, strict=True)])
+                print(f"{n:>10} {precision:>9} {recall:>9.3f} {coarse_recall:>10.3f} "
+                      f"{query_time * 1e3:>7.2f}ms {content.nbytes / 2**20:>7.1f}MB "
+                      f"{storage.size_on_disk() / 2**20:>7.1f}MB")
+            storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Queries per second of the Redis memory backends with concurrent callers:
+threads sharing the blocking `redis` backend against tasks sharing the
+pooled `redis_async` backend.
+
+Needs a Redis Stack server, for example:
+
+    docker run -d -p 6379:6379 redis/redis-stack-server:latest
+
+Run from the `scripts` directory:
+
+    python -m benchmarks.redis_concurrency --count 2000 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from benchmarks.batch_add import synthetic_texts
+from config import Config
+from memory import get_memory
+from memory.base import get_flax_embeddings
+
+
+def run_threads(memory, queries, concurrency, k):
+    """Splits the queries between `concurrency` threads."""
+    def worker(offset):
+        for query in queries[offset::concurrency]:
+            memory.get_relevant(query, k)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+async def run_tasks(memory, queries, concurrency, k):
+    """Splits the queries between `concurrency` tasks on one loop."""
+    async def worker(offset):
+        for query in queries[offset::concurrency]:
+            await memory.aget_relevant(query, k)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=512)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--index", default="bench-concurrency")
+    args = parser.parse_args()
+
+    cfg = Config()
+    cfg.memory_index = args.index
+    cfg.memory_write_behind = False
+    cfg.wipe_redis_on_start = True
+    cfg.redis_max_connections = max(args.concurrency)
+
+    queries = synthetic_texts(args.queries, "query", seed=1)
+    # Embed up front so that both backends hit the embedding cache and
+    # the measurement is the Redis round trips only
+    get_flax_embeddings(queries)
+
+    cfg.memory_backend = "redis"
+    blocking = get_memory(cfg)
+    blocking.add_many(synthetic_texts(args.count, "memory"))
+    cfg.wipe_redis_on_start = False
+    cfg.memory_backend = "redis_async"
+    pooled = get_memory(cfg)
+
+    print(f"{args.count} memories, {args.queries} queries, k={args.k}")
+    print(f"{'callers':>8} {'redis q/s':>12} {'redis_async q/s':>16}")
+    for concurrency in args.concurrency:
+        threaded = run_threads(blocking, queries, concurrency, args.k)
+        tasks = asyncio.run(run_tasks(pooled, queries, concurrency, args.k))
+        print(f"{concurrency:>8} {args.queries / threaded:>12.1f} {args.queries / tasks:>16.1f}")
+
+    blocking.clear()
+
+
+if __name__ == "__main__":
+    main()
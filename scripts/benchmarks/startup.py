@@ -0,0 +1,77 @@
+"""
+Startup cost of the memory package with the lazily loaded embedding model.
+
+Each measurement runs in a fresh interpreter. "eager" loads the model right
+after import, which is what every start used to pay.
+
+Run from the `scripts` directory:
+
+    python -m benchmarks.startup --repeat 3
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+SNIPPETS = {
+    "import memory": "import memory",
+    "no_memory backend": (
+        "from config import Config\n"
+        "from memory import get_memory\n"
+        "cfg = Config()\n"
+        "cfg.memory_backend = 'no_memory'\n"
+        "get_memory(cfg)"
+    ),
+    "eager (import + model)": (
+        "import memory\n"
+        "from memory.base import get_flax_model\n"
+        "get_flax_model()"
+    ),
+    "first embedding": (
+        "from memory.base import get_flax_embedding\n"
+        "get_flax_embedding('hello')"
+    ),
+    "warmed first embedding": (
+        "from memory.base import get_flax_embedding, warm_up_flax_model\n"
+        "warm_up_flax_model()\n"
+        "time.sleep(WARM_UP_SECONDS)\n"
+        "start = time.perf_counter()\n"
+        "get_flax_embedding('hello')"
+    ),
+}
+
+TEMPLATE = (
+    "import time\n"
+    "WARM_UP_SECONDS = {warm_up}\n"
+    "start = time.perf_counter()\n"
+    "{snippet}\n"
+    "print(time.perf_counter() - start)\n"
+)
+
+
+def measure(snippet, warm_up):
+    scripts_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run(
+        [sys.executable, "-c", TEMPLATE.format(snippet=snippet, warm_up=warm_up)],
+        cwd=scripts_dir,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warm-up", type=float, default=15.0,
+                        help="Seconds the warm-up thread gets, like a chat.conn round trip")
+    args = parser.parse_args()
+
+    for name, snippet in SNIPPETS.items():
+        best = min(measure(snippet, args.warm_up) for _ in range(args.repeat))
+        print(f"{name:<24} {best * 1e3:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
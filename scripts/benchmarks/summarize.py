@@ -0,0 +1,96 @@
+"""
+Latency of browse.summarize_text on a recorded page, by chunk parallelism.
+
+A page is recorded once with --record, as the text `scrape_text` returns,
+and replayed from the file afterwards so runs compare on the same chunks.
+Without --live, the EdgeGPT Chatbot is replaced by a stand-in answering
+after --latency seconds (with 20% jitter) with a summary of
+--summary-words words, failing --failure-rate of the requests to exercise
+the retries of the request governor. Pages whose summaries do not fit one
+question take several rounds of reduction, visible in the number of
+requests.
+
+Run from the `scripts` directory:
+
+    python -m benchmarks.summarize --record https://en.wikipedia.org/wiki/Python --page page.txt
+    python -m benchmarks.summarize --page page.txt --parallelism 1 2 4 8
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import browse
+import new_bing as nbing
+from benchmarks.batch_add import synthetic_texts
+from config import Config
+
+
+def simulated_chatbot(latency, failure_rate, summary_words, seed=0):
+    """A stand-in for EdgeGPT.Chatbot and the list of questions asked to it."""
+    rng = random.Random(seed)
+    calls = []
+
+    class SimulatedChatbot:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def ask(self, prompt, conversation_style=None, **kwargs):
+            calls.append(len(prompt))
+            await asyncio.sleep(latency * rng.uniform(0.8, 1.2))
+            if rng.random() < failure_rate:
+                raise RuntimeError("simulated failure")
+            summary = " ".join(rng.choice(("summary", "of", "the", "chunk")) for _ in range(summary_words))
+            return {"item": {"messages": [{}, {"text": summary}]}}
+
+        async def close(self):
+            pass
+
+    return SimulatedChatbot, calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--page", help="The recorded page text, synthetic text if missing")
+    parser.add_argument("--record", metavar="URL", help="Scrape the URL into --page first")
+    parser.add_argument("--parallelism", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--summary-words", type=int, default=300)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--rate", type=float, default=0.0, help="The requests per second, 0 for no limit")
+    parser.add_argument("--live", action="store_true", help="Ask New Bing instead of the stand-in")
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.page:
+            parser.error("--record needs --page to write to")
+        with open(args.page, "w", encoding="utf-8") as f:
+            f.write(browse.scrape_text(args.record))
+    if args.page:
+        with open(args.page, encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = "\n".join(synthetic_texts(2000, "paragraph"))
+
+    cfg = Config()
+    cfg.llm_rate_limit = args.rate
+    cfg.llm_max_concurrency = max(args.parallelism)
+    cfg.llm_retry_base_delay = 0.1
+    cfg.new_bing_pool_size = max(args.parallelism)
+    calls = []
+    if not args.live:
+        nbing.EdgeGPT.Chatbot, calls = simulated_chatbot(args.latency, args.failure_rate, args.summary_words)
+    print(f"page: {len(text)} characters, {len(list(browse.split_text(text)))} chunks")
+    for parallelism in args.parallelism:
+        cfg.summary_parallelism = parallelism
+        asked = len(calls)
+        start = time.perf_counter()
+        browse.summarize_text(text, "What is this page about?")
+        seconds = time.perf_counter() - start
+        requests = f"  {len(calls) - asked} requests" if not args.live else ""
+        print(f"parallelism {parallelism:>3}  {seconds:>8.2f}s{requests}")
+    print(f"governor: {nbing.governor_stats()}")
+
+
+if __name__ == "__main__":
+    main()
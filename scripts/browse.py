@@ -1,3 +1,4 @@
+import asyncio
 import re
 from urllib.parse import urljoin, urlparse
 
@@ -5,9 +6,16 @@ import new_bing as nbing
 import requests
 from bs4 import BeautifulSoup
 from config import Config
+from token_counter import count_tokens
 
 cfg = Config()
 
+# Sentences end at terminal punctuation followed by whitespace
+SENTENCE_END = re.compile(r"(?<=[.!?。！？])\s+")
+# Rounds of summarizing summaries before the final answer, each dividing
+# the text by the number of summaries that fit in a chunk
+MAX_REDUCTION_ROUNDS = 8
+
 
 # Function to check if the URL is valid
 def is_valid_url(url):
@@ -110,23 +118,55 @@ def scrape_links(url):
     return format_hyperlinks(hyperlinks)
 
 
-def split_text(text, max_length=8192):
-    """Split text into chunks of a maximum length"""
-    paragraphs = text.split("\n")
-    current_length = 0
+def chunk_token_limit():
+    """The tokens of a chunk, leaving the rest of the limit to the prompt and the answer"""
+    return cfg.new_bing_token_limit // 2
+
+
+def _split_long(text, max_tokens):
+    """Split a paragraph over max_tokens at sentences, then at words, then anywhere"""
+    for separator, pieces in (" ", SENTENCE_END.split(text)), (" ", text.split()):
+        if len(pieces) > 1:
+            for piece in _pack(pieces, separator, max_tokens):
+                if count_tokens(piece) <= max_tokens:
+                    yield piece
+                else:
+                    yield from _split_long(piece, max_tokens)
+            return
+    # A single word longer than a chunk, such as an encoded blob
+    step = max(max_tokens, 1)
+    for start in range(0, len(text), step):
+        yield text[start:start + step]
+
+
+def _pack(pieces, separator, max_tokens):
+    """Join consecutive pieces into chunks of at most max_tokens, where they fit"""
+    current_tokens = 0
     current_chunk = []
 
-    for paragraph in paragraphs:
-        if current_length + len(paragraph) + 1 <= max_length:
-            current_chunk.append(paragraph)
-            current_length += len(paragraph) + 1
-        else:
-            yield "\n".join(current_chunk)
-            current_chunk = [paragraph]
-            current_length = len(paragraph) + 1
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current_chunk and current_tokens + tokens > max_tokens:
+            yield separator.join(current_chunk)
+            current_chunk = []
+            current_tokens = 0
+        current_chunk.append(piece)
+        current_tokens += tokens
 
     if current_chunk:
-        yield "\n".join(current_chunk)
+        yield separator.join(current_chunk)
+
+
+def split_text(text, max_tokens=None):
+    """Split text into chunks of at most max_tokens estimated tokens, at paragraphs where possible"""
+    max_tokens = max_tokens or chunk_token_limit()
+    paragraphs = []
+    for paragraph in text.split("\n"):
+        if count_tokens(paragraph) <= max_tokens:
+            paragraphs.append(paragraph)
+        else:
+            paragraphs.extend(_split_long(paragraph, max_tokens))
+    yield from _pack(paragraphs, "\n", max_tokens)
 
 
 def create_message(chunk, question):
@@ -134,6 +174,46 @@ def create_message(chunk, question):
     return f"\"\"\"\n{chunk}\n\"\"\"\n\nUsing the above text, answer the following question: \"{question}\". If the question cannot be answered using the text, summarize the text."
 
 
+async def summarize_chunk(chunk, question, index=0, limit=None):
+    """
+    Summarize one chunk. Failed requests are retried by new_bing.
+
+    Args:
+    chunk (str): The text to summarize.
+    question (str): The question the summary should answer.
+    index (int): The position of the chunk, for messages.
+    limit (asyncio.Semaphore): Bounds the chunks summarized at once.
+
+    Returns:
+    str: The summary, or an error message if it could not be made.
+    """
+    limit = limit or asyncio.Semaphore(1)
+    async with limit:
+        try:
+            summary = await nbing.aask_question_once(create_message(chunk, question))
+        except Exception as e:
+            print(f"Error summarizing chunk {index + 1}: {e}")
+            summary = nbing.NO_RESPONSE
+    if summary == nbing.NO_RESPONSE:
+        return f"Error: Could not summarize chunk {index + 1}"
+    return summary
+
+
+async def summarize_chunks(chunks, question):
+    """Summarize chunks concurrently, keeping the summaries in chunk order"""
+    limit = asyncio.Semaphore(max(cfg.summary_parallelism, 1))
+    done = 0
+
+    async def summarize(index, chunk):
+        nonlocal done
+        summary = await summarize_chunk(chunk, question, index, limit)
+        done += 1
+        print(f"Summarized chunk {done} / {len(chunks)}")
+        return summary
+
+    return await asyncio.gather(*(summarize(i, chunk) for i, chunk in enumerate(chunks)))
+
+
 def summarize_text(text, question):
     """Summarize text using New Bing"""
     if not text:
@@ -142,18 +222,19 @@ def summarize_text(text, question):
     text_length = len(text)
     print(f"Text length: {text_length} characters")
 
-    summaries = []
+    # Summarize the chunks, then the chunks of their summaries, until
+    # the summaries fit in one question
     chunks = list(split_text(text))
-
-    for i, chunk in enumerate(chunks):
-        print(f"Summarizing chunk {i + 1} / {len(chunks)}")
-
-        summary = nbing.ask_question_once(create_message(chunk, question))
-        summaries.append(summary)
-
-    print(f"Summarized {len(chunks)} chunks.")
-
-    combined_summary = "\n".join(summaries)
-    final_summary = nbing.ask_question_once(create_message(combined_summary, question))
+    for _ in range(MAX_REDUCTION_ROUNDS):
+        if len(chunks) == 1:
+            break
+        print(f"Summarizing {len(chunks)} chunks, {cfg.summary_parallelism} at a time")
+        summaries = nbing.submit(summarize_chunks(chunks, question)).result()
+        print(f"Summarized {len(chunks)} chunks.")
+        chunks = list(split_text("\n".join(summaries)))
+    if len(chunks) > 1:
+        print(f"Summaries still take {len(chunks)} chunks, answering from the first")
+
+    final_summary = nbing.ask_question_once(create_message(chunks[0], question))
 
     return final_summary
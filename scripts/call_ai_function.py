@@ -1,17 +1,49 @@
 import new_bing as nbing
 from config import Config
+from response_cache import ResponseCache
 
 cfg = Config()
 
+# Responses of AI functions, by function, description and arguments
+AI_FUNCTION_CACHE = None
+if cfg.ai_function_cache:
+    AI_FUNCTION_CACHE = ResponseCache(
+        cfg.ai_function_cache_path,
+        ttl=cfg.ai_function_cache_ttl,
+        max_bytes=cfg.ai_function_cache_max_bytes,
+    )
 
-# This is a magic function that can do anything with no-code. See
-# https://github.com/Torantulino/AI-Functions for more info.
-def call_ai_function(function, args, description):
-    """Call an AI function"""
+
+def _join_args(args):
     # For each arg, if any are None, convert to "None":
     args = [str(arg) if arg is not None else "None" for arg in args]
     # parse args to comma seperated string
-    args = ", ".join(args)
+    return ", ".join(args)
+
+
+def _cache_key(function, args, description):
+    return ResponseCache.key("new_bing", function, description, args)
+
+
+# This is a magic function that can do anything with no-code. See
+# https://github.com/Torantulino/AI-Functions for more info.
+def call_ai_function(function, args, description, cache=True):
+    """
+    Call an AI function
+
+    Responses are cached, so that calling a pure function again with the
+    same arguments does not ask the AI. Pass cache=False to always ask,
+    such as for functions whose result should vary between calls.
+    """
+    args = _join_args(args)
+
+    key = None
+    if cache and AI_FUNCTION_CACHE is not None:
+        key = _cache_key(function, args, description)
+        response = AI_FUNCTION_CACHE.get(key)
+        if response is not None:
+            return response
+
     messages = [
         {
             "role": "system",
@@ -22,4 +54,16 @@ def call_ai_function(function, args, description):
 
     response = nbing.ask_messages(messages)
 
+    if key is not None and response != nbing.NO_RESPONSE:
+        AI_FUNCTION_CACHE.put(key, response)
     return response
+
+
+def forget_ai_function_call(function, args, description):
+    """Drop the cached response of a call, such as one that could not be used"""
+    if AI_FUNCTION_CACHE is not None:
+        AI_FUNCTION_CACHE.discard(_cache_key(function, _join_args(args), description))
+
+
+def ai_function_cache_stats():
+    return AI_FUNCTION_CACHE.stats() if AI_FUNCTION_CACHE is not None else {}
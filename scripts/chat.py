@@ -1,8 +1,24 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import new_bing as nbing
+from config import Config
+from message_history import MESSAGE_OVERHEAD
+from token_counter import count_tokens, truncate_tokens
+
+cfg = Config()
 
 _role_desc = None
 _chatbot = None
 
+# The number of memories retrieved to build the context of each question
+CONTEXT_MEMORIES = 10
+CONTEXT_HEADER = "This reminds you of these events from your past:\n"
+
+# Retrieves the memories for the next question while the reply is handled
+_retriever = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context")
+_prefetched = None
+
 
 def create_chat_message(role, content):
     """
@@ -35,6 +51,94 @@ def conn(role_desc):
     return nbing.ask_question(_role_desc, _chatbot)
 
 
+def build_context(memories, budget, question=""):
+    """
+    Packs retrieved memories into a context of at most `budget` tokens.
+
+    Args:
+    memories (list): The memories, the most relevant first.
+    budget (int): The number of tokens the context may take.
+    question (str): The question the context is for, memories it contains are skipped.
+
+    Returns:
+    str: The context to prepend to the question, empty if no memory fits.
+    """
+    budget -= count_tokens(CONTEXT_HEADER)
+    seen = set()
+    packed = []
+    for memory in memories or []:
+        key = " ".join(str(memory).split())
+        if not key or key in seen or key in question:
+            continue
+        seen.add(key)
+        tokens = count_tokens(key) + 1
+        # A long memory may not fit while a shorter, less relevant one does
+        if tokens > budget:
+            continue
+        packed.append(key)
+        budget -= tokens
+    if not packed:
+        return ""
+    return CONTEXT_HEADER + "\n".join(packed) + "\n\n"
+
+
+def _memory_query(full_message_history):
+    return str(full_message_history[-5:])
+
+
+def prefetch_context(full_message_history, permanent_memory):
+    """
+    Starts retrieving the memories relevant to the message history in the
+    background, for the next call to `chat` to use.
+
+    Args:
+    full_message_history (list): The list of all messages sent between the user and the AI.
+    permanent_memory (Obj): The memory object containing the permanent memory.
+    """
+    global _prefetched
+    query = _memory_query(full_message_history)
+    _prefetched = (permanent_memory, _retriever.submit(permanent_memory.get_relevant, query, CONTEXT_MEMORIES))
+
+
+def _relevant_memories(full_message_history, permanent_memory):
+    global _prefetched
+    prefetched, _prefetched = _prefetched, None
+    if prefetched is not None and prefetched[0] is permanent_memory:
+        try:
+            return prefetched[1].result()
+        except Exception as e:
+            print("Error retrieving relevant memories: ", e)
+    return permanent_memory.get_relevant(_memory_query(full_message_history), CONTEXT_MEMORIES)
+
+
+def _question(user_input, full_message_history, permanent_memory):
+    if len(full_message_history) == 0:
+        return user_input
+    suffix = f"\n\nBased on the above information: {user_input}"
+    # A long command result is cut so the question fits the token limit
+    last = truncate_tokens(full_message_history[-1]['content'],
+                           cfg.new_bing_token_limit - count_tokens(suffix) - MESSAGE_OVERHEAD)
+    question = last + suffix
+    memories = _relevant_memories(full_message_history, permanent_memory)
+    budget = min(int(cfg.new_bing_token_limit * cfg.memory_context_ratio),
+                 cfg.new_bing_token_limit - count_tokens(question))
+    return build_context(memories, budget, question) + question
+
+
+def _record(user_input, assistant_reply, full_message_history, permanent_memory):
+    # Update full message history
+    full_message_history.append(
+        create_chat_message(
+            "user", user_input))
+    full_message_history.append(
+        create_chat_message(
+            "assistant", assistant_reply))
+
+    # Retrieve the context of the next question while this reply is
+    # authorized and its command runs
+    prefetch_context(full_message_history, permanent_memory)
+
+
 def chat(user_input, full_message_history, permanent_memory):
     """
     Interact with the AI, sending user input, message history, and permanent memory.
@@ -47,32 +151,84 @@ def chat(user_input, full_message_history, permanent_memory):
     Returns:
     str: The AI's response.
     """
-    global _chatbot
-
-    if len(full_message_history) > 0:
-        question = f"{full_message_history[-1]['content']}\n\n" \
-                   f"Based on the above information: {user_input}"
-        permanent_memory.get_relevant(str(full_message_history[-5:]), 10)
-    else:
-        question = user_input
-
-    # TODO: leverage relevant memory, construct context
+    question = _question(user_input, full_message_history, permanent_memory)
 
     # Chat with New Bing assistant to get the reply
     assistant_reply = nbing.ask_question(question, _chatbot)
 
-    # Update full message history
-    full_message_history.append(
-        create_chat_message(
-            "user", user_input))
-    full_message_history.append(
-        create_chat_message(
-            "assistant", assistant_reply))
-
+    _record(user_input, assistant_reply, full_message_history, permanent_memory)
     return assistant_reply
 
 
+class StreamedChat:
+    """
+    A reply of the AI being generated. Iterating it yields the whole reply
+    so far on every update. The reply is recorded in the message history,
+    like `chat` does, as soon as it is received; `result` waits for it.
+    """
+
+    def __init__(self, user_input, full_message_history, permanent_memory):
+        self.user_input = user_input
+        self.full_message_history = full_message_history
+        self.permanent_memory = permanent_memory
+        question = _question(user_input, full_message_history, permanent_memory)
+        self._result = None
+        self._recorded = threading.Event()
+        self._reply = nbing.stream_question(question, _chatbot)
+        # Recorded while the caller waits for the authorization or the command
+        self._reply.add_done_callback(self._received)
+
+    def _received(self, future):
+        try:
+            if not future.cancelled() and future.exception() is None:
+                self._result = future.result()
+                _record(self.user_input, self._result, self.full_message_history, self.permanent_memory)
+        finally:
+            self._recorded.set()
+
+    def __iter__(self):
+        return iter(self._reply)
+
+    def result(self, fallback=None):
+        """
+        Args:
+        fallback (str): Recorded and returned instead if the reply failed, such as the part received.
+
+        Returns:
+        str: The AI's response.
+        """
+        try:
+            self._reply.result()
+        except Exception as e:
+            if fallback is None:
+                raise
+            self._recorded.wait()
+            if self._result is None:
+                print("Error receiving the rest of the reply: ", e)
+                self._result = fallback
+                _record(self.user_input, fallback, self.full_message_history, self.permanent_memory)
+        self._recorded.wait()
+        return self._result
+
+
+def chat_stream(user_input, full_message_history, permanent_memory):
+    """
+    Interact with the AI like `chat`, receiving its reply as it is generated.
+
+    Args:
+    user_input (str): The input from the user.
+    full_message_history (list): The list of all messages sent between the user and the AI.
+    permanent_memory (Obj): The memory object containing the permanent memory.
+
+    Returns:
+    StreamedChat: The reply being generated.
+    """
+    return StreamedChat(user_input, full_message_history, permanent_memory)
+
+
 def close():
     global _chatbot
     assert _chatbot is not None, "Chat AI is not yet connected"
+    _retriever.shutdown(wait=False)
     nbing.close_bot(_chatbot)
+    nbing.close_sessions()
@@ -0,0 +1,204 @@
+"""A bounded pool of pre-created chat sessions for one-shot questions."""
+import asyncio
+import collections
+import contextlib
+import time
+from typing import Any, Awaitable, Callable, Deque
+
+
+class _Session:
+    def __init__(self, bot: Any) -> None:
+        self.bot = bot
+        self.uses = 0
+        self.failed = False
+        self.created_at = time.monotonic()
+
+
+class ChatbotPool:
+    """
+    Keeps up to `size` sessions, created ahead of time so that a checkout
+    does not wait for a new session in the common case.
+
+    A session is recycled, closed and replaced in the background, after
+    `max_uses` questions, after an error or a reply marked as failed with
+    `discard`, or when it has been alive for `max_age` seconds.
+
+    The pool must be used from a single event loop.
+    """
+
+    def __init__(self, create: Callable[[], Awaitable[Any]], close: Callable[[Any], Awaitable[None]],
+                 size: int = 4, max_uses: int = 1, max_age: float = 600.0) -> None:
+        """
+        Initializes an empty pool, filled on first use.
+
+        Args:
+            create: Creates a session.
+            close: Closes a session.
+            size: The most sessions alive at once, idle or checked out.
+            max_uses: The questions a session answers before it is replaced.
+            max_age: The seconds a session is used for before it is replaced.
+
+        Returns: None
+        """
+        self._create = create
+        self._close = close
+        self.size = max(size, 1)
+        self.max_uses = max(max_uses, 1)
+        self.max_age = max_age
+        self._idle: Deque[_Session] = collections.deque()
+        self._checked_out = {}
+        # Sessions idle, checked out or being created
+        self._alive = 0
+        self._available = asyncio.Condition()
+        self._tasks = set()
+        self._closed = False
+        self.created = 0
+        self.create_errors = 0
+        self.recycled = 0
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _healthy(self, session: _Session) -> bool:
+        return not session.failed and time.monotonic() - session.created_at < self.max_age
+
+    async def _new_session(self) -> _Session:
+        try:
+            session = _Session(await self._create())
+        except Exception:
+            self.create_errors += 1
+            async with self._available:
+                self._alive -= 1
+                self._available.notify()
+            raise
+        self.created += 1
+        return session
+
+    async def _fill(self) -> None:
+        """Creates sessions until the pool is full."""
+        while not self._closed and self._alive < self.size:
+            self._alive += 1
+            try:
+                session = await self._new_session()
+            except Exception as e:
+                print("Error creating a chat session: ", e)
+                return
+            async with self._available:
+                if self._closed:
+                    # Created while the pool was closing
+                    self._retire(session)
+                    return
+                self._idle.append(session)
+                self._available.notify()
+
+    def _refill(self) -> None:
+        task = asyncio.get_running_loop().create_task(self._fill())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _retire(self, session: _Session) -> None:
+        self._alive -= 1
+        self.recycled += 1
+        task = asyncio.get_running_loop().create_task(self._close_quietly(session))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _close_quietly(self, session: _Session) -> None:
+        try:
+            await self._close(session.bot)
+        except Exception as e:
+            print("Error closing a chat session: ", e)
+
+    async def _checkout(self) -> _Session:
+        async with self._available:
+            while True:
+                while self._idle:
+                    session = self._idle.popleft()
+                    if self._healthy(session):
+                        return session
+                    self._retire(session)
+                if self._alive < self.size:
+                    self._alive += 1
+                    break
+                await self._available.wait()
+        # The pool has room but nothing idle, create one for this checkout
+        return await self._new_session()
+
+    async def _checkin(self, session: _Session, failed: bool) -> None:
+        session.uses += 1
+        async with self._available:
+            if (self._closed or failed or session.uses >= self.max_uses
+                    or not self._healthy(session)):
+                self._retire(session)
+            else:
+                self._idle.append(session)
+            self._available.notify()
+        self._refill()
+
+    @contextlib.asynccontextmanager
+    async def session(self):
+        """
+        Checks out a session for one question, waiting while all sessions
+        are checked out. The session is recycled if the block raises.
+
+        Returns: The session's bot.
+        """
+        start = time.perf_counter()
+        session = await self._checkout()
+        waited = time.perf_counter() - start
+        self.checkouts += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        # Create the other sessions while this one is used
+        self._refill()
+        self._checked_out[id(session.bot)] = session
+        failed = True
+        try:
+            yield session.bot
+            failed = False
+        finally:
+            del self._checked_out[id(session.bot)]
+            await self._checkin(session, failed)
+
+    def discard(self, bot: Any) -> None:
+        """
+        Marks a checked out session as failed, such as one whose reply was
+        empty because it died or was throttled, so that it is replaced
+        when returned instead of being handed out again.
+
+        Args:
+            bot: The bot of the session.
+
+        Returns: None
+        """
+        session = self._checked_out.get(id(bot))
+        if session is not None:
+            session.failed = True
+
+    async def close(self) -> None:
+        """
+        Closes the idle sessions and stops creating new ones. Sessions
+        checked out are closed when they are returned.
+
+        Returns: None
+        """
+        async with self._available:
+            self._closed = True
+            sessions = list(self._idle)
+            self._idle.clear()
+            self._alive -= len(sessions)
+        for session in sessions:
+            await self._close_quietly(session)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": len(self._idle),
+            "alive": self._alive,
+            "created": self.created,
+            "create_errors": self.create_errors,
+            "recycled": self.recycled,
+            "checkouts": self.checkouts,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
@@ -17,6 +17,7 @@ from file_operations import (
 )
 from image_gen import generate_image
 from memory import get_memory
+from memory.metadata import MemoryMetadata
 
 cfg = Config()
 
@@ -43,7 +44,7 @@ def execute_command(command_name, arguments):  # noqa: C901
             else:
                 return google_search(arguments["input"])
         elif command_name == "memory_add":
-            return memory.add(arguments["string"])
+            return memory.add(arguments["string"], MemoryMetadata(source=command_name))
         elif command_name == "start_agent":
             return start_agent(
                 arguments["name"],
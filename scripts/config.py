@@ -39,7 +39,39 @@ class Config(metaclass=Singleton):
         self.speak_mode = False
 
         self.new_bing_token_limit = 4000
+        # Share of the token limit that memories recalled into each question may take
+        self.memory_context_ratio = float(os.getenv("MEMORY_CONTEXT_RATIO", "0.25"))
+        # Tokens the message history is kept within, the oldest messages are dropped beyond it
+        self.history_token_limit = int(os.getenv("HISTORY_TOKEN_LIMIT", str(self.new_bing_token_limit)))
         self.new_bing_cookies_path = os.getenv("NEW_BING_COOKIES_PATH")
+        # Receive replies as they are generated, acting on the command as soon as it is complete
+        self.stream_replies = os.getenv("STREAM_REPLIES", "True") == 'True'
+        # One-shot questions borrow sessions from a pool of this size. A session answers
+        # this many questions, each seeing the ones before, and is replaced after max age seconds
+        self.new_bing_pool_size = int(os.getenv("NEW_BING_POOL_SIZE", "4"))
+        self.new_bing_pool_max_uses = int(os.getenv("NEW_BING_POOL_MAX_USES", "1"))
+        self.new_bing_pool_max_age = float(os.getenv("NEW_BING_POOL_MAX_AGE", "600"))
+        # Chunks of a page are summarized this many at a time
+        self.summary_parallelism = int(os.getenv("SUMMARY_PARALLELISM", "4"))
+        # Questions to the AI are sent at most at the rate per second, in bursts of up to burst,
+        # with at most max concurrency in flight. Failed one-shot questions, not those of the agent's
+        # conversation, are retried after a random delay of up to the base delay doubled on
+        # every retry, capped at the max delay. After
+        # this many failures in a row no question is sent for the circuit reset seconds
+        self.llm_rate_limit = float(os.getenv("LLM_RATE_LIMIT", "1.0"))
+        self.llm_burst = int(os.getenv("LLM_BURST", "5"))
+        self.llm_max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+        self.llm_retries = int(os.getenv("LLM_RETRIES", "3"))
+        self.llm_retry_base_delay = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+        self.llm_retry_max_delay = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+        self.llm_circuit_failures = int(os.getenv("LLM_CIRCUIT_FAILURES", "5"))
+        self.llm_circuit_reset = float(os.getenv("LLM_CIRCUIT_RESET", "60"))
+        # Responses of AI functions are cached in an SQLite file for the TTL in seconds,
+        # evicting the least recently used ones beyond the max bytes
+        self.ai_function_cache = os.getenv("AI_FUNCTION_CACHE", "True") == 'True'
+        self.ai_function_cache_path = os.getenv("AI_FUNCTION_CACHE_PATH", "ai_function_cache.sqlite")
+        self.ai_function_cache_ttl = float(os.getenv("AI_FUNCTION_CACHE_TTL", "604800"))
+        self.ai_function_cache_max_bytes = int(os.getenv("AI_FUNCTION_CACHE_MAX_BYTES", "67108864"))
 
         self.elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
         self.elevenlabs_voice_1_id = os.getenv("ELEVENLABS_VOICE_1_ID")
@@ -53,6 +85,11 @@ class Config(metaclass=Singleton):
 
         self.pinecone_api_key = os.getenv("PINECONE_API_KEY")
         self.pinecone_region = os.getenv("PINECONE_ENV")
+        # Pinecone vectors are upserted in chunks, at the latest after this many seconds,
+        # and the index stats are refreshed at most once per TTL
+        self.pinecone_upsert_chunk_size = int(os.getenv("PINECONE_UPSERT_CHUNK_SIZE", "100"))
+        self.pinecone_flush_interval = float(os.getenv("PINECONE_FLUSH_INTERVAL", "1.0"))
+        self.pinecone_stats_ttl = float(os.getenv("PINECONE_STATS_TTL", "30"))
 
         self.image_provider = os.getenv("IMAGE_PROVIDER")
         self.huggingface_api_token = os.getenv("HUGGINGFACE_API_TOKEN")
@@ -70,10 +107,40 @@ class Config(metaclass=Singleton):
         self.redis_port = os.getenv("REDIS_PORT", "6379")
         self.redis_password = os.getenv("REDIS_PASSWORD", "")
         self.wipe_redis_on_start = os.getenv("WIPE_REDIS_ON_START", "True") == 'True'
+        # Size of the connection pool of the redis_async memory backend
+        self.redis_max_connections = int(os.getenv("REDIS_MAX_CONNECTIONS", "32"))
         self.memory_index = os.getenv("MEMORY_INDEX", 'auto-gpt')
         # Note that indexes must be created on db 0 in redis, this is not configurable.
 
         self.memory_backend = os.getenv("MEMORY_BACKEND", 'local')
+        # Skip memories that repeat a stored one, exactly or with at least this cosine similarity
+        self.memory_dedup = os.getenv("MEMORY_DEDUP", "False") == 'True'
+        self.memory_dedup_threshold = float(os.getenv("MEMORY_DEDUP_THRESHOLD", "0.97"))
+        # Memories are added by a worker thread, in batches of this size or after this many seconds
+        self.memory_write_behind = os.getenv("MEMORY_WRITE_BEHIND", "True") == 'True'
+        self.memory_flush_size = int(os.getenv("MEMORY_FLUSH_SIZE", "16"))
+        self.memory_flush_interval = float(os.getenv("MEMORY_FLUSH_INTERVAL", "2.0"))
+        # Keep at most this many memories per index, 0 for no limit, evicting by policy:
+        # oldest, lru (least recently retrieved) or decay (retrievals decayed by the half-life in seconds)
+        self.memory_capacity = int(os.getenv("MEMORY_CAPACITY", "0"))
+        self.memory_eviction_policy = os.getenv("MEMORY_EVICTION_POLICY", "oldest")
+        self.memory_decay_half_life = float(os.getenv("MEMORY_DECAY_HALF_LIFE", "86400"))
+        # Embeddings of recently seen texts are kept in RAM and, if a path is set, in an SQLite file
+        # holding the disk size newest ones, 0 for no limit
+        self.embedding_cache_size = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+        self.embedding_cache_path = os.getenv("EMBEDDING_CACHE_PATH") or None
+        self.embedding_cache_disk_size = int(os.getenv("EMBEDDING_CACHE_DISK_SIZE", "100000"))
+        # Load the embedding model in the background while connecting to the AI
+        self.embedding_warm_up = os.getenv("EMBEDDING_WARM_UP", "True") == 'True'
+        # Local memory switches from exact to approximate search past this many rows, 0 disables it
+        self.local_ann_threshold = int(os.getenv("LOCAL_ANN_THRESHOLD", "50000"))
+        self.local_ann_probes = int(os.getenv("LOCAL_ANN_PROBES", "16"))
+        # Precision of the local memory embeddings in RAM: float32 or int8
+        self.local_memory_precision = os.getenv("LOCAL_MEMORY_PRECISION", "float32")
+        self.local_memory_rescore_factor = int(os.getenv("LOCAL_MEMORY_RESCORE_FACTOR", "4"))
+        # Weight of BM25 keyword matches against embedding similarity in local memory, 0 disables them.
+        # At 0.3 the memory suite finds 0.56 of the exact vector neighbours, at 0.1 about 0.9
+        self.local_memory_lexical_weight = float(os.getenv("LOCAL_MEMORY_LEXICAL_WEIGHT", "0"))
 
     def set_continuous_mode(self, value: bool):
         """Set the continuous mode value."""
@@ -0,0 +1,52 @@
+"""A persistent asyncio event loop running in a daemon thread."""
+import asyncio
+import concurrent.futures
+import threading
+from typing import Any, Coroutine, Optional
+
+
+class BackgroundLoop:
+    """
+    Runs one event loop for the lifetime of the process, so that clients
+    holding connections or sessions can be reused across calls, and lets
+    synchronous code run coroutines on it.
+    """
+
+    def __init__(self, name: str = "event-loop") -> None:
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """The event loop, started on first use."""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name=self.name, daemon=True)
+                thread.start()
+            return self._loop
+
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """
+        Schedules a coroutine on the loop.
+
+        Args:
+            coro: The coroutine to run.
+
+        Returns: A future for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro: Coroutine, timeout: Optional[float] = None) -> Any:
+        """
+        Runs a coroutine on the loop and waits for it. Must not be called
+        from the loop itself, which would deadlock.
+
+        Args:
+            coro: The coroutine to run.
+            timeout: The seconds to wait for the result, forever by default.
+
+        Returns: The result of the coroutine.
+        """
+        return self.submit(coro).result(timeout)
@@ -3,7 +3,7 @@ from __future__ import annotations
 import json
 from typing import Any, Dict
 
-from call_ai_function import call_ai_function
+from call_ai_function import call_ai_function, forget_ai_function_call
 from config import Config
 from json_utils import correct_json
 from logger import logger
@@ -149,4 +149,6 @@ def fix_json_with_ai(json_str: str, schema: str) -> str:
         json.loads(result_string)  # just check the validity
         return result_string
     except:  # noqa: E722
+        # Ask the AI again next time instead of repeating the broken fix
+        forget_ai_function_call(function_string, args, description_string)
         return None
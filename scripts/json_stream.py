@@ -0,0 +1,116 @@
+"""Incremental parsing of a JSON object whose text arrives in pieces."""
+import json
+from typing import Any, Dict
+
+
+class JsonObjectStream:
+    """
+    Scans the text of a reply as it grows and parses each member of its
+    first JSON object as soon as the member's value is complete, so that
+    callers can act on `command` before the rest of the reply arrives.
+
+    Text before the object, such as prose or a code fence, is skipped.
+    Members are parsed with `json.loads` alone, so a member that is not
+    strict JSON is left out and the caller falls back to parsing the
+    whole reply.
+    """
+
+    def __init__(self) -> None:
+        self.text = ""
+        self._reset()
+
+    def _reset(self) -> None:
+        self.members: Dict[str, Any] = {}
+        self.closed = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # At depth 1: "key", "value" after the colon, "in_value" or "after" the value
+        self._state = "key"
+        self._key = None
+        self._key_start = 0
+        self._value_start = 0
+
+    def feed(self, text: str) -> Dict[str, Any]:
+        """
+        Scans the reply up to its current end.
+
+        Args:
+            text: The whole reply so far. If it does not extend the text
+                fed before, it was revised and is scanned again.
+
+        Returns: The members completed by this text, by name.
+        """
+        if not text.startswith(self.text):
+            self._reset()
+        self.text = text
+        completed = {}
+        while self._pos < len(text) and not self.closed:
+            self._scan(text, self._pos, completed)
+            self._pos += 1
+        return completed
+
+    def _scan(self, text: str, i: int, completed: Dict[str, Any]) -> None:  # noqa: C901
+        c = text[i]
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_string = False
+                if self._depth == 1 and self._state == "key":
+                    self._key = self._load(text[self._key_start:i + 1])
+                elif self._depth == 1 and self._state == "in_value":
+                    self._finish(text, i + 1, completed)
+            return
+        if c.isspace():
+            return
+        if self._depth == 0:
+            # Skip anything before the object
+            if c == "{":
+                self._depth = 1
+            return
+        if self._depth == 1 and self._state == "value":
+            self._state = "in_value"
+            self._value_start = i
+        if c == '"':
+            self._in_string = True
+            if self._depth == 1 and self._state == "key":
+                self._key_start = i
+        elif c in "{[":
+            self._depth += 1
+        elif c in "}]" and self._depth > 1:
+            self._depth -= 1
+            if self._depth == 1:
+                self._finish(text, i + 1, completed)
+        elif self._depth == 1:
+            if c == ":" and self._state == "key":
+                self._state = "value"
+                return
+            if self._state == "in_value" and c in ",}":
+                # The end of a number, true, false or null
+                self._finish(text, i, completed)
+            if c == ",":
+                self._state = "key"
+                self._key = None
+            elif c == "}":
+                self.closed = True
+
+    def _finish(self, text: str, end: int, completed: Dict[str, Any]) -> None:
+        self._state = "after"
+        if not isinstance(self._key, str):
+            return
+        try:
+            value = json.loads(text[self._value_start:end])
+        except json.JSONDecodeError:
+            return
+        self.members[self._key] = completed[self._key] = value
+
+    @staticmethod
+    def _load(text: str) -> Any:
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return None
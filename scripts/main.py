@@ -1,9 +1,13 @@
 import argparse
 import json
 import logging
+import time
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 import chat
+import new_bing as nbing
 import speak
 import utils
 from ai_config import AIConfig
@@ -13,13 +17,21 @@ from config import Config
 from json_parser import (
     fix_and_parse_json,
 )
+from json_stream import JsonObjectStream
 from logger import logger
 from memory import get_memory, get_supported_memory_backends
+from memory.base import warm_up_flax_model
+from memory.metadata import MemoryMetadata
+from message_history import MessageHistory
+from request_governor import CircuitOpenError
 from spinner import Spinner
 
 cfg = Config()
 ai_name = ""
 
+# Runs authorized commands while the rest of the reply is generated
+command_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="command")
+
 
 def print_assistant_thoughts(assistant_thoughts):
     """Prints the assistant's thoughts to the console"""
@@ -219,6 +231,142 @@ def parse_assistant_reply(assistant_reply):
         return thoughts, command["name"], command.get("args", {})
 
 
+def streamed_command(members):
+    """The command name and arguments of a streamed reply, None if malformed"""
+    command = members.get("command")
+    if not isinstance(command, dict) or not isinstance(command.get("name"), str):
+        return None
+    return command["name"], command.get("args", {})
+
+
+def stream_assistant_reply(user_input, full_message_history, long_term_memory, authorized):
+    """
+    Streams the reply of the AI, printing its thoughts as soon as they are
+    complete, and returns once its command and thoughts are known while the
+    rest of the reply is still generated. An authorized command starts to
+    execute as soon as it is complete.
+
+    Returns the function waiting for the whole reply, the thoughts, the
+    command, its arguments and the future of its execution, or None.
+    """
+    reply = chat.chat_stream(user_input, full_message_history, long_term_memory)
+    stream = JsonObjectStream()
+    command = execution = running = None
+    printed = False
+    spinner = Spinner("Thinking... ")
+    with spinner:
+        for partial in reply:
+            completed = stream.feed(partial)
+            if "command" in completed:
+                command = streamed_command(stream.members)
+                # A revised reply completes its command again, it is only run once
+                if command is not None and authorized and execution is None:
+                    running = command
+                    execution = command_executor.submit(execute_command, *command)
+            if isinstance(completed.get("thoughts"), dict):
+                spinner.stop()
+                print_assistant_thoughts(completed["thoughts"])
+                printed = True
+            if stream.closed or (command is not None and printed):
+                break
+
+    if command is not None and printed:
+        execution, dropped = reconcile_execution(execution, running, *command)
+        return lambda: wait_streamed_reply(reply, stream, command, full_message_history, dropped), \
+            stream.members["thoughts"], command[0], command[1], execution
+    # The reply is not strict JSON, parse it whole
+    thoughts, name, arguments = parse_assistant_reply(reply.result())
+    if thoughts is not None and not printed:
+        print_assistant_thoughts(thoughts)
+    if name.startswith("error__") and execution is not None:
+        # Already running the command the reply streamed, which is all there is to execute
+        name, arguments = running
+    execution, dropped = reconcile_execution(execution, running, name, arguments)
+    return lambda: wait_streamed_reply(reply, stream, None, full_message_history, dropped), \
+        thoughts, name, arguments, execution
+
+
+def reconcile_execution(execution, running, name, arguments):
+    """
+    Keeps a started execution only if it runs the command the reply ended
+    up with. Otherwise waits for it to finish, so that the final command
+    runs alone, and returns None.
+
+    Returns the execution kept and, for a dropped one, which already had
+    its effects, a note of its result for the history, or None.
+    """
+    if execution is None or running == (name, arguments):
+        return execution, None
+    print(f"The reply changed its command from {running[0]} to {name} while {running[0]} ran.")
+    try:
+        result = execution.result()
+    except Exception as e:
+        result = f"Error: {e}"
+    return None, f"Your reply dropped the command {running[0]} after it was executed. " \
+                 f"Command \"{running[0]}\" returned: {result}"
+
+
+def wait_streamed_reply(reply, stream, command, full_message_history, dropped=None):
+    """
+    Waits for the rest of a streamed reply, falling back to the text
+    received if it fails. If the whole reply asks for another command than
+    the one taken from it while it streamed, the history notes which one
+    was handled, as the history records the whole reply. The note of a
+    dropped execution follows the reply in the history as well.
+    """
+    assistant_reply = reply.result(fallback=stream.text)
+    if dropped is not None:
+        full_message_history.append(chat.create_chat_message("system", dropped))
+    if command is None:
+        return assistant_reply
+    final = JsonObjectStream()
+    final.feed(assistant_reply)
+    final_command = streamed_command(final.members)
+    if final_command is not None and final_command != command:
+        note = f"Your reply changed its command to {final_command[0]} after {command[0]} was taken from it, " \
+               f"{command[0]} is the command handled."
+        logger.typewriter_log("REPLY CHANGED: ", Fore.YELLOW, note)
+        full_message_history.append(chat.create_chat_message("system", note))
+    return assistant_reply
+
+
+def ask_assistant(user_input, full_message_history, long_term_memory, authorized):
+    if cfg.stream_replies:
+        return stream_assistant_reply(user_input, full_message_history, long_term_memory, authorized)
+
+    with Spinner("Thinking... "):
+        assistant_reply = chat.chat(user_input, full_message_history, long_term_memory)
+
+    thoughts, command, arguments = parse_assistant_reply(assistant_reply)
+
+    if thoughts is not None:
+        print_assistant_thoughts(thoughts)
+    return lambda: assistant_reply, thoughts, command, arguments, None
+
+
+def get_assistant_reply(user_input, full_message_history, long_term_memory, authorized):
+    """
+    Sends the user input to the AI and prints the thoughts of its reply.
+    While the AI is not asked after too many failures in a row, waits for
+    it to be asked again. A question that failed every retry gives an
+    error command, so that the agent carries on.
+
+    Returns the function waiting for the whole reply, the thoughts, the
+    command, its arguments and the future of its execution, if it already
+    started, or None.
+    """
+    while True:
+        try:
+            return ask_assistant(user_input, full_message_history, long_term_memory, authorized)
+        except CircuitOpenError as e:
+            # Another question may be probing the AI already, so wait at least a second
+            wait = max(nbing.retry_after(), 1.0)
+            logger.typewriter_log("AI UNAVAILABLE: ", Fore.RED, f"{e}. Asking again in {wait:.0f} seconds.")
+            time.sleep(wait)
+        except Exception as e:
+            logger.typewriter_log("AI REQUEST FAILED: ", Fore.RED, str(e))
+            return lambda: "", None, "error__ai_request_failed", f"Asking the AI failed: {e}", None
+
 
 def main():  # noqa: C901
     global cfg, ai_name
@@ -230,8 +378,9 @@ def main():  # noqa: C901
     if cfg.debug_mode:
         logger.typewriter_log("SYSTEM: ", Fore.YELLOW, prompt)
 
-    # Initialize variables
-    full_message_history = []
+    # Initialize variables. Every cycle is also added to long-term memory,
+    # so the messages evicted from the history can still be recalled
+    full_message_history = MessageHistory(cfg.history_token_limit)
 
     # Make a constant
 
@@ -239,6 +388,11 @@ def main():  # noqa: C901
     # this is particularly important for indexing and referencing pinecone memory
     long_term_memory = get_memory(cfg, init=True)
     print('Using memory of type: ' + long_term_memory.__class__.__name__)
+    session_id = uuid.uuid4().hex
+
+    # Load the embedding model while we wait for the AI to connect
+    if cfg.embedding_warm_up and cfg.memory_backend != "no_memory":
+        warm_up_flax_model()
 
     # Connect and initialize our AI
     with Spinner("Connecting to AI assistant..."):
@@ -261,13 +415,9 @@ def main():  # noqa: C901
 
     while True:
         # Send message to AI, get response
-        with Spinner("Thinking... "):
-            assistant_reply = chat.chat(user_input, full_message_history, long_term_memory)
-
-        thoughts, command, arguments = parse_assistant_reply(assistant_reply)
-
-        if thoughts is not None:
-            print_assistant_thoughts(thoughts)
+        authorized = cfg.continuous_mode or nr_next_actions > 0
+        wait_reply, thoughts, command, arguments, execution = get_assistant_reply(
+            user_input, full_message_history, long_term_memory, authorized)
 
         if cfg.speak_mode:
             speak.say_text(f"I want to execute {command}")
@@ -327,14 +477,17 @@ def main():  # noqa: C901
         elif command == "human_feedback":
             cmd_result = f"Human feedback received: {user_input}"
         else:
-            cmd_result = f"Command \"{command}\" returned: {execute_command(command, arguments)}"
+            result = execution.result() if execution is not None else execute_command(command, arguments)
+            cmd_result = f"Command \"{command}\" returned: {result}"
             if nr_next_actions > 0:
                 nr_next_actions -= 1
 
         # Add to our long_term memory
+        assistant_reply = wait_reply()
         long_term_memory.add(f"Assistant Reply: {assistant_reply} \n" \
                              f"Command Result: {cmd_result} \n" \
-                             f"Human Feedback: {user_input} ")
+                             f"Human Feedback: {user_input} ",
+                             MemoryMetadata(source=command, session=session_id))
 
         # Append it to the message history
         full_message_history.append(chat.create_chat_message("system", cmd_result))
@@ -1,5 +1,6 @@
 from memory.local import LocalCache
 from memory.no_memory import NoMemory
+from memory.write_behind import WriteBehindMemory
 
 # List of supported memory backends
 # Add a backend to this list if the import attempt is successful
@@ -12,6 +13,12 @@ except ImportError:
     print("Redis not installed. Skipping import.")
     RedisMemory = None
 
+try:
+    from memory.redis_async import AsyncRedisMemory
+    supported_memory.append('redis_async')
+except ImportError:
+    AsyncRedisMemory = None
+
 try:
     from memory.pinecone import PineconeMemory
     supported_memory.append('pinecone')
@@ -29,12 +36,13 @@ def get_memory(cfg, init=False):
             memory = PineconeMemory(cfg)
             if init:
                 memory.clear()
-    elif cfg.memory_backend == "redis":
-        if not RedisMemory:
+    elif cfg.memory_backend in ("redis", "redis_async"):
+        provider = RedisMemory if cfg.memory_backend == "redis" else AsyncRedisMemory
+        if not provider:
             print("Error: Redis is not installed. Please install redis-py to"
                   " use Redis as a memory backend.")
         else:
-            memory = RedisMemory(cfg)
+            memory = provider(cfg)
     elif cfg.memory_backend == "no_memory":
         memory = NoMemory(cfg)
 
@@ -42,6 +50,13 @@ def get_memory(cfg, init=False):
         memory = LocalCache(cfg)
         if init:
             memory.clear()
+
+    if cfg.memory_write_behind and not isinstance(memory, NoMemory):
+        memory = WriteBehindMemory(
+            memory,
+            flush_size=cfg.memory_flush_size,
+            flush_interval=cfg.memory_flush_interval,
+        )
     return memory
 
 def get_supported_memory_backends():
@@ -52,6 +67,8 @@ __all__ = [
     "get_memory",
     "LocalCache",
     "RedisMemory",
+    "AsyncRedisMemory",
     "PineconeMemory",
-    "NoMemory"
+    "NoMemory",
+    "WriteBehindMemory"
 ]
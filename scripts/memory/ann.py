@@ -0,0 +1,234 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index for local memory."""
+import os
+from typing import List, Optional
+
+import numpy as np
+from memory.base import top_k_indices
+
+ASSIGNMENT_DTYPE = np.dtype("<i4")
+ASSIGN_BATCH_ROWS = 65536
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+# Retrain the centroids once the index has grown this much since training
+RETRAIN_GROWTH = 4
+
+
+class IVFIndex:
+    """
+    Clusters the embeddings with spherical k-means and searches only the rows
+    of the `n_probe` clusters closest to the query, rescoring them exactly.
+
+    The index is persisted next to the cache as two files:
+
+        {prefix}.ivf.npz  the centroids and the row count they were trained on
+        {prefix}.ivf      little-endian int32 cluster of each row, append-only
+    """
+
+    def __init__(self, prefix: str, n_probe: int = 8) -> None:
+        """
+        Initializes an untrained index.
+
+        Args:
+            prefix: The path prefix shared by the index files.
+            n_probe: The number of clusters searched per query.
+
+        Returns: None
+        """
+        self.centroids_path = f"{prefix}.ivf.npz"
+        self.assignments_path = f"{prefix}.ivf"
+        self.n_probe = n_probe
+        self.centroids: Optional[np.ndarray] = None
+        self.trained_rows = 0
+        self.lists: List[List[int]] = []
+        self._assignments_file = None
+
+    def __len__(self) -> int:
+        return sum(len(rows) for rows in self.lists)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, matrix: np.ndarray, seed: int = 0) -> None:
+        """
+        Clusters `matrix` and assigns every row of it to a cluster.
+
+        Args:
+            matrix: The embeddings to index, one row per memory.
+            seed: The seed used to pick the initial centroids.
+
+        Returns: None
+        """
+        n_lists = max(1, int(np.sqrt(len(matrix))))
+        rng = np.random.default_rng(seed)
+        n_samples = min(len(matrix), n_lists * KMEANS_SAMPLES_PER_LIST)
+        sample = matrix[np.sort(rng.choice(len(matrix), n_samples, replace=False))].astype(np.float32)
+        # Rows may be quantized with a scale per row, only their direction matters
+        sample /= np.maximum(np.linalg.norm(sample, axis=1, keepdims=True), 1e-12)
+        centroids = sample[rng.choice(n_samples, n_lists, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            labels = np.argmax(np.dot(sample, centroids.T), axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Keep the previous centroid of clusters that lost all their rows
+            filled = norms[:, 0] > 0
+            centroids[filled] = sums[filled] / norms[filled]
+
+        self.centroids = centroids.astype(np.float32)
+        self.trained_rows = len(matrix)
+        assignments = self._assign(matrix)
+        self.lists = [[] for _ in range(n_lists)]
+        for row, label in enumerate(assignments.tolist()):
+            self.lists[label].append(row)
+        self.save(assignments)
+
+    def needs_retrain(self, rows: int) -> bool:
+        return rows >= self.trained_rows * RETRAIN_GROWTH
+
+    def _assign(self, matrix: np.ndarray) -> np.ndarray:
+        labels = np.empty((len(matrix),), dtype=ASSIGNMENT_DTYPE)
+        for start in range(0, len(matrix), ASSIGN_BATCH_ROWS):
+            # A positive scale per row does not change its closest centroid
+            batch = matrix[start:start + ASSIGN_BATCH_ROWS].astype(np.float32, copy=False)
+            labels[start:start + len(batch)] = np.argmax(np.dot(batch, self.centroids.T), axis=1)
+        return labels
+
+    def add(self, row: int, vector: np.ndarray) -> None:
+        """
+        Inserts one row into its closest cluster and persists the assignment.
+
+        Args:
+            row: The row of the vector in the embeddings matrix.
+            vector: The embedding of the row.
+
+        Returns: None
+        """
+        self.add_many(row, np.asarray(vector)[np.newaxis, :])
+
+    def add_many(self, first_row: int, vectors: np.ndarray) -> None:
+        """
+        Inserts consecutive rows into their closest clusters.
+
+        Args:
+            first_row: The row of the first vector in the embeddings matrix.
+            vectors: The embeddings of the rows.
+
+        Returns: None
+        """
+        labels = self._assign(vectors)
+        for row, label in enumerate(labels.tolist(), start=first_row):
+            self.lists[label].append(row)
+        if self._assignments_file is None:
+            self._assignments_file = open(self.assignments_path, "ab")
+        self._assignments_file.write(labels.tobytes())
+        self._assignments_file.flush()
+
+    def candidates(self, query: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            query: The query embedding.
+
+        Returns: The rows of the `n_probe` clusters closest to the query.
+        """
+        probes = top_k_indices(np.dot(self.centroids, query), self.n_probe)
+        return np.fromiter(
+            (row for label in probes.tolist() for row in self.lists[label]),
+            dtype=np.intp,
+        )
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+        """
+        Finds the approximate top-k rows of `matrix` for `query`.
+
+        Args:
+            matrix: The embeddings matrix the index was built over.
+            query: The query embedding.
+            k: The number of rows to return.
+
+        Returns: The indices of the best rows, best first.
+        """
+        candidates = self.candidates(query)
+        scores = np.dot(matrix[candidates], query)
+        return candidates[top_k_indices(scores, k)]
+
+    def labels(self) -> np.ndarray:
+        """
+        Returns: The cluster of every indexed row.
+        """
+        labels = np.empty((len(self),), dtype=ASSIGNMENT_DTYPE)
+        for label, rows in enumerate(self.lists):
+            labels[rows] = label
+        return labels
+
+    def keep_rows(self, rows: np.ndarray) -> None:
+        """
+        Drops every row not in `rows` and renumbers the others by their
+        position in `rows`, as compacting the embeddings matrix does.
+
+        Args:
+            rows: The indexed rows to keep, in their new order.
+
+        Returns: None
+        """
+        assignments = self.labels()[rows]
+        self.lists = [[] for _ in range(len(self.centroids))]
+        for row, label in enumerate(assignments.tolist()):
+            self.lists[label].append(row)
+        self.save(assignments)
+
+    def save(self, assignments: np.ndarray) -> None:
+        """
+        Writes the centroids and all row assignments, replacing old files.
+
+        Args:
+            assignments: The cluster of every indexed row.
+
+        Returns: None
+        """
+        self.close()
+        np.savez(self.centroids_path, centroids=self.centroids, trained_rows=self.trained_rows)
+        assignments.astype(ASSIGNMENT_DTYPE).tofile(self.assignments_path)
+
+    def load(self, rows: int) -> bool:
+        """
+        Loads a persisted index that covers at most `rows` rows.
+
+        Args:
+            rows: The number of rows in the embeddings matrix.
+
+        Returns: Whether a usable index was loaded.
+        """
+        if not (os.path.exists(self.centroids_path) and os.path.exists(self.assignments_path)):
+            return False
+        with np.load(self.centroids_path) as saved:
+            self.centroids = saved["centroids"]
+            self.trained_rows = int(saved["trained_rows"])
+        assignments = np.fromfile(self.assignments_path, dtype=ASSIGNMENT_DTYPE)
+        if len(assignments) > rows:
+            self.centroids = None
+            return False
+        self.lists = [[] for _ in range(len(self.centroids))]
+        for row, label in enumerate(assignments.tolist()):
+            self.lists[label].append(row)
+        return True
+
+    def clear(self) -> None:
+        """
+        Forgets the index and removes its files.
+
+        Returns: None
+        """
+        self.close()
+        for path in (self.centroids_path, self.assignments_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.centroids = None
+        self.trained_rows = 0
+        self.lists = []
+
+    def close(self) -> None:
+        if self._assignments_file is not None:
+            self._assignments_file.close()
+            self._assignments_file = None
@@ -1,21 +1,108 @@
 """Base class for memory providers."""
 import abc
+import threading
 
-import sentence_transformers
-from config import AbstractSingleton
+import numpy as np
+from config import AbstractSingleton, Config
+from memory.embedding_cache import EmbeddingCache
+from memory.metadata import metadata_list
 
-FLAX_EMBED_MODEL = sentence_transformers.SentenceTransformer("flax-sentence-embeddings/all_datasets_v4_MiniLM-L6")
+cfg = Config()
+
+FLAX_EMBED_MODEL_NAME = "flax-sentence-embeddings/all_datasets_v4_MiniLM-L6"
 FLAX_EMBED_DIM = 384
+EMBEDDING_CACHE = EmbeddingCache(
+    FLAX_EMBED_MODEL_NAME,
+    max_entries=cfg.embedding_cache_size,
+    path=cfg.embedding_cache_path,
+    max_disk_entries=cfg.embedding_cache_disk_size,
+)
+
+_flax_embed_model = None
+_flax_embed_model_lock = threading.Lock()
+
+
+def get_flax_model():
+    """
+    Returns the embedding model, loading it on first use. sentence_transformers
+    is imported here as well, since importing it alone takes seconds.
+    """
+    global _flax_embed_model
+    if _flax_embed_model is None:
+        with _flax_embed_model_lock:
+            if _flax_embed_model is None:
+                import sentence_transformers
+                _flax_embed_model = sentence_transformers.SentenceTransformer(FLAX_EMBED_MODEL_NAME)
+    return _flax_embed_model
+
+
+def warm_up_flax_model():
+    """
+    Loads the embedding model in a daemon thread, so that the first
+    embedding request does not wait for it.
+
+    Returns: The started thread.
+    """
+    thread = threading.Thread(target=get_flax_model, name="flax-warm-up", daemon=True)
+    thread.start()
+    return thread
 
 
 def get_flax_embedding(text):
     text = text.replace("\n", " ")
-    return FLAX_EMBED_MODEL.encode(text, show_progress_bar=False)
+    key = EMBEDDING_CACHE.key(text)
+    embedding = EMBEDDING_CACHE.get(key)
+    if embedding is None:
+        embedding = EMBEDDING_CACHE.put(key, get_flax_model().encode(text, show_progress_bar=False))
+    return embedding
+
+
+def get_flax_embeddings(texts, batch_size=64):
+    """
+    Embeds many texts at once. Cached texts are looked up, the rest are
+    encoded together in batches of `batch_size`.
+
+    Returns: A (len(texts), FLAX_EMBED_DIM) float32 matrix.
+    """
+    texts = [text.replace("\n", " ") for text in texts]
+    keys = [EMBEDDING_CACHE.key(text) for text in texts]
+    embeddings = [EMBEDDING_CACHE.get(key) for key in keys]
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if missing:
+        encoded = get_flax_model().encode(
+            [texts[i] for i in missing],
+            batch_size=batch_size,
+            show_progress_bar=False,
+        )
+        stored = EMBEDDING_CACHE.put_many([keys[i] for i in missing], encoded)
+        for i, vector in zip(missing, stored, strict=True):
+            embeddings[i] = vector
+    if not embeddings:
+        return np.zeros((0, FLAX_EMBED_DIM), dtype=np.float32)
+    return np.stack(embeddings).astype(np.float32)
+
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k highest scores, best first. Only the k winners are
+    sorted, the rest are partitioned away in linear time.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros((0,), dtype=np.intp)
+    if k < len(scores):
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(scores[candidates])[::-1]]
 
 
 class MemoryProviderSingleton(AbstractSingleton):
+    # Whether reads may run while another thread writes
+    thread_safe = False
+
     @abc.abstractmethod
-    def add(self, data):
+    def add(self, data, metadata=None):
         pass
 
     @abc.abstractmethod
@@ -27,9 +114,34 @@ class MemoryProviderSingleton(AbstractSingleton):
         pass
 
     @abc.abstractmethod
-    def get_relevant(self, data, num_relevant=5):
+    def get_relevant(self, data, num_relevant=5, filters=None):
         pass
 
     @abc.abstractmethod
     def get_stats(self):
         pass
+
+    def add_many(self, texts, metadata=None):
+        """
+        Adds many data points. Providers override this to embed and write
+        in bulk; the default adds them one by one.
+
+        Args:
+            texts: The data to add.
+            metadata: A MemoryMetadata for every text, or one per text.
+
+        Returns: The result of `add` for each text.
+        """
+        return [
+            self.add(text, item)
+            for text, item in zip(texts, metadata_list(metadata, len(texts)), strict=True)
+        ]
+
+    def get_relevant_many(self, queries, num_relevant=5, filters=None):
+        """
+        Runs `get_relevant` for many queries. Providers override this to
+        embed the queries in one batch.
+
+        Returns: The relevant data of each query.
+        """
+        return [self.get_relevant(query, num_relevant, filters) for query in queries]
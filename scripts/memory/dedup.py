@@ -0,0 +1,100 @@
+"""Exact and near-duplicate suppression for memory providers."""
+import hashlib
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+
+def content_key(text: str) -> bytes:
+    """A hash of the text with whitespace runs collapsed."""
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).digest()
+
+
+class DuplicateFilter:
+    """
+    Drops texts that were already added: exact duplicates through a set of
+    content hashes, near-duplicates when their embedding has a similarity of
+    at least `threshold` to a stored row or to an earlier text of the batch.
+
+    Providers that share the hashes between processes override `_known`,
+    `_remember` and `_forget`.
+    """
+
+    def __init__(self, enabled: bool = False, threshold: float = 0.97) -> None:
+        self.enabled = enabled
+        self.threshold = threshold
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self._keys = set()
+
+    def _known(self, keys: List[bytes]) -> List[bool]:
+        return [key in self._keys for key in keys]
+
+    def _remember(self, keys: List[bytes]) -> None:
+        self._keys.update(keys)
+
+    def _forget(self, keys: List[bytes]) -> None:
+        self._keys.difference_update(keys)
+
+    def load(self, texts: List[str]) -> None:
+        """Remembers texts that are already stored."""
+        if self.enabled:
+            self._remember([content_key(text) for text in texts])
+
+    def forget(self, texts: List[str]) -> None:
+        """Forgets texts that were evicted, so they can be added again."""
+        if self.enabled:
+            self._forget([content_key(text) for text in texts])
+
+    def clear(self) -> None:
+        self._keys.clear()
+
+    def filter(
+        self,
+        texts: List[str],
+        embed: Callable[[List[str]], np.ndarray],
+        nearest: Callable[[np.ndarray], np.ndarray],
+    ) -> Tuple[List[int], np.ndarray]:
+        """
+        Embeds the texts that are not duplicates.
+
+        Args:
+            texts: The texts about to be added.
+            embed: Embeds a list of texts into a matrix.
+            nearest: The best similarity of each row of a matrix to the
+                stored rows, -inf when nothing is stored.
+
+        Returns: The positions of the texts to add and their embeddings.
+        """
+        if not self.enabled:
+            return list(range(len(texts))), embed(texts)
+
+        keys = [content_key(text) for text in texts]
+        candidates = []
+        seen = set()
+        for i, (key, known) in enumerate(zip(keys, self._known(keys), strict=True)):
+            if known or key in seen:
+                self.exact_duplicates += 1
+                continue
+            seen.add(key)
+            candidates.append(i)
+        vectors = embed([texts[i] for i in candidates])
+
+        stored = nearest(vectors) if len(candidates) else np.zeros((0,))
+        kept = []
+        for j in range(len(candidates)):
+            in_batch = np.dot(vectors[kept], vectors[j]) if kept else np.zeros((0,))
+            if stored[j] >= self.threshold or (len(in_batch) and in_batch.max() >= self.threshold):
+                self.near_duplicates += 1
+                continue
+            kept.append(j)
+
+        self._remember([keys[candidates[j]] for j in kept])
+        return [candidates[j] for j in kept], vectors[kept]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+        }
@@ -0,0 +1,188 @@
+"""Content-addressed cache of text embeddings."""
+import atexit
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+# Single puts are committed to the disk tier in batches of this many
+COMMIT_EVERY = 32
+# Share of the disk tier kept when it outgrows its bound, so pruning is batched
+PRUNE_TO = 0.9
+
+
+class EmbeddingCache:
+    """
+    A bounded LRU cache of embeddings keyed by a hash of the embedded text,
+    optionally backed by an SQLite tier that survives restarts. The disk
+    tier drops its oldest embeddings past `max_disk_entries`, and commits
+    its writes in batches, so a crash may lose the last few.
+    """
+
+    def __init__(self, model_name: str, max_entries: int = 4096, path: Optional[str] = None,
+                 max_disk_entries: int = 100_000) -> None:
+        """
+        Initializes the cache.
+
+        Args:
+            model_name: The embedding model, part of every key so that
+                vectors of different models never mix.
+            max_entries: The number of embeddings kept in RAM, 0 disables
+                the RAM tier.
+            path: The SQLite file of the disk tier, None disables it.
+            max_disk_entries: The number of embeddings kept on disk, 0 for
+                no limit.
+
+        Returns: None
+        """
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.path = path
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._uncommitted = 0
+        self._disk_entries = 0
+        self.pruned = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB)"
+            )
+            self._db.commit()
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            atexit.register(self.commit)
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """
+        Looks up an embedding, promoting disk hits into the RAM tier.
+
+        Args:
+            key: The key of the text, see `key`.
+
+        Returns: The embedding, or None on a miss.
+        """
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    vector = _frozen(np.frombuffer(row[0], dtype=np.float32))
+                    self._remember(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, key: bytes, vector: np.ndarray) -> np.ndarray:
+        """
+        Stores an embedding in every enabled tier.
+
+        Args:
+            key: The key of the text, see `key`.
+            vector: The embedding of the text.
+
+        Returns: The read-only cached copy of the embedding.
+        """
+        return self.put_many([key], [vector])[0]
+
+    def put_many(self, keys: List[bytes], vectors) -> List[np.ndarray]:
+        """
+        Stores many embeddings, writing them to disk in one statement.
+
+        Args:
+            keys: The keys of the texts, see `key`.
+            vectors: The embeddings of the texts.
+
+        Returns: The read-only cached copies of the embeddings.
+        """
+        vectors = [_frozen(np.array(vector, dtype=np.float32)) for vector in vectors]
+        with self._lock:
+            for key, vector in zip(keys, vectors, strict=True):
+                self._remember(key, vector)
+            if self._db is not None:
+                # Replaced rows get a new rowid, so rowids order rows by age
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                    [(key, vector.tobytes()) for key, vector in zip(keys, vectors, strict=True)],
+                )
+                self._disk_entries += len(keys)
+                self._uncommitted += len(keys)
+                if 0 < self.max_disk_entries < self._disk_entries:
+                    self._prune()
+                if self._uncommitted >= COMMIT_EVERY or len(keys) > 1:
+                    self._commit()
+        return vectors
+
+    def _prune(self) -> None:
+        # Counts replaced rows twice, so recount before dropping any row
+        self._disk_entries = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._disk_entries <= self.max_disk_entries:
+            return
+        excess = self._disk_entries - int(self.max_disk_entries * PRUNE_TO)
+        self._db.execute(
+            "DELETE FROM embeddings WHERE rowid IN (SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)",
+            (excess,),
+        )
+        self._disk_entries -= excess
+        self.pruned += excess
+
+    def _commit(self) -> None:
+        self._db.commit()
+        self._uncommitted = 0
+
+    def commit(self) -> None:
+        """
+        Writes the pending embeddings of the disk tier to its file.
+
+        Returns: None
+        """
+        with self._lock:
+            if self._db is not None and self._uncommitted:
+                self._commit()
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """
+        Returns: The hit and miss counters of the cache.
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "disk_entries": self._disk_entries,
+            "pruned": self.pruned,
+        }
+
+
+def _frozen(vector: np.ndarray) -> np.ndarray:
+    vector.flags.writeable = False
+    return vector
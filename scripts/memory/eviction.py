@@ -0,0 +1,71 @@
+"""Eviction policies for memory providers with a bounded capacity."""
+import numpy as np
+
+POLICIES = ("oldest", "lru", "decay")
+
+
+class EvictionPolicy:
+    """
+    Gives every row a priority; once a memory is over capacity, the rows
+    with the lowest priority are evicted first.
+
+        oldest  the time the row was added
+        lru     the time the row was last retrieved, or added
+        decay   log2 of a hit count where each hit, and the add itself,
+                halves in weight every `half_life` seconds
+
+    Priorities are plain floats, so providers can keep them in a NumPy
+    column or a Redis sorted set alike. The decayed score is kept in log
+    space relative to the epoch, which ranks rows the same as decaying
+    every score at every tick, without ever rewriting them.
+    """
+
+    def __init__(self, name: str = "oldest", half_life: float = 86400.0) -> None:
+        if name not in POLICIES:
+            raise ValueError(f"Unsupported eviction policy '{name}', use one of {POLICIES}")
+        self.name = name
+        self.half_life = half_life
+
+    def initial(self, added_at: np.ndarray) -> np.ndarray:
+        """
+        Args:
+            added_at: The time each row was added, in seconds since the epoch.
+
+        Returns: The priority of each new row.
+        """
+        added_at = np.asarray(added_at, dtype=np.float64)
+        if self.name == "decay":
+            return added_at / self.half_life
+        return added_at
+
+    def touched(self, priority: np.ndarray, now: float) -> np.ndarray:
+        """
+        Args:
+            priority: The priority of rows that were just retrieved.
+            now: The time of the retrieval.
+
+        Returns: The new priority of the rows.
+        """
+        priority = np.asarray(priority, dtype=np.float64)
+        if self.name == "lru":
+            return np.full_like(priority, now)
+        if self.name == "decay":
+            return np.logaddexp2(priority, now / self.half_life)
+        return priority
+
+    def victims(self, priority: np.ndarray, alive: np.ndarray, count: int) -> np.ndarray:
+        """
+        Args:
+            priority: The priority of every row.
+            alive: Whether each row is still stored.
+            count: The number of rows to evict.
+
+        Returns: The rows to evict, lowest priority first.
+        """
+        candidates = np.flatnonzero(alive)
+        count = min(count, len(candidates))
+        if count <= 0:
+            return np.zeros((0,), dtype=np.intp)
+        # Stable, so rows of equal priority are evicted oldest first
+        order = np.argsort(priority[candidates], kind="stable")[:count]
+        return candidates[order]
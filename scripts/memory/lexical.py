@@ -0,0 +1,214 @@
+"""BM25 inverted index over the texts of the local memory."""
+import os
+import re
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Paths, URLs, file names and error codes are kept whole, and also split
+# into their words, so both "main.py" and "main" find "scripts/main.py"
+TOKEN_PATTERN = re.compile(r"[\w.\-/:@~]+")
+WORD_PATTERN = re.compile(r"\w+")
+TOKEN_PUNCTUATION = ".-/:@~"
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        token = token.strip(TOKEN_PUNCTUATION)
+        if not token:
+            continue
+        tokens.append(token)
+        words = WORD_PATTERN.findall(token)
+        if len(words) > 1:
+            tokens.extend(words)
+    return tokens
+
+
+class BM25Index:
+    """
+    An inverted index from each token to the rows containing it and how
+    often, maintained as rows are appended and scored with Okapi BM25.
+
+    The index is persisted as `{prefix}.bm25.npz`, a snapshot of the
+    postings and row lengths. Rows appended after the snapshot are indexed
+    again on load, so the snapshot only has to be rewritten now and then.
+    """
+
+    def __init__(self, prefix: str, k1: float = 1.2, b: float = 0.75) -> None:
+        """
+        Initializes an empty index.
+
+        Args:
+            prefix: The path prefix shared by the cache files.
+            k1: The BM25 term frequency saturation.
+            b: The BM25 length normalization.
+
+        Returns: None
+        """
+        self.path = f"{prefix}.bm25.npz"
+        self.k1 = k1
+        self.b = b
+        # Each token maps to the rows it occurs in and its count in each
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.lengths = array("I")
+        self.total_length = 0
+        self.saved_rows = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add_many(self, texts: List[str]) -> None:
+        """
+        Indexes texts as the rows following the indexed ones.
+
+        Args:
+            texts: The texts of the new rows.
+
+        Returns: None
+        """
+        for row, text in enumerate(texts, start=len(self.lengths)):
+            tokens = tokenize(text)
+            counts: Dict[str, int] = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                posting = self.postings.get(token)
+                if posting is None:
+                    posting = self.postings[token] = (array("I"), array("I"))
+                posting[0].append(row)
+                posting[1].append(count)
+            self.lengths.append(len(tokens))
+            self.total_length += len(tokens)
+
+    def scores(self, text: str) -> Optional[np.ndarray]:
+        """
+        Scores every row against the tokens of a query.
+
+        Args:
+            text: The query.
+
+        Returns: The BM25 score of each row divided by the best one, or
+            None when no row contains a token of the query.
+        """
+        n = len(self.lengths)
+        if n == 0:
+            return None
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+        norms = self.k1 * (1 - self.b + self.b * lengths / max(self.total_length / n, 1e-9))
+        scores = np.zeros((n,), dtype=np.float32)
+        for token in set(tokenize(text)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            rows = np.frombuffer(posting[0], dtype=np.uint32)
+            tfs = np.frombuffer(posting[1], dtype=np.uint32).astype(np.float32)
+            idf = np.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norms[rows])
+        best = scores.max()
+        if best <= 0:
+            return None
+        return scores / best
+
+    def keep_rows(self, rows: np.ndarray) -> None:
+        """
+        Drops every row not in `rows` and renumbers the others by their
+        position in `rows`, as compacting the cache does.
+
+        Args:
+            rows: The indexed rows to keep, in their new order.
+
+        Returns: None
+        """
+        mapping = np.full((len(self.lengths),), -1, dtype=np.int64)
+        mapping[rows] = np.arange(len(rows))
+        postings = {}
+        for token, (old_rows, tfs) in self.postings.items():
+            new_rows = mapping[np.frombuffer(old_rows, dtype=np.uint32)]
+            kept = new_rows >= 0
+            if not kept.any():
+                continue
+            order = np.argsort(new_rows[kept], kind="stable")
+            postings[token] = (
+                array("I", new_rows[kept][order].astype(np.uint32).tobytes()),
+                array("I", np.frombuffer(tfs, dtype=np.uint32)[kept][order].tobytes()),
+            )
+        self.postings = postings
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)[rows]
+        self.lengths = array("I", lengths.tobytes())
+        self.total_length = int(lengths.sum())
+        self.save()
+
+    def save(self) -> None:
+        """
+        Writes a snapshot of the index, replacing the previous one.
+
+        Returns: None
+        """
+        tokens = list(self.postings)
+        counts = np.array([len(self.postings[token][0]) for token in tokens], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            tokens=np.frombuffer("\n".join(tokens).encode("utf-8"), dtype=np.uint8),
+            offsets=offsets,
+            rows=np.frombuffer(b"".join(self.postings[token][0].tobytes() for token in tokens), dtype=np.uint32),
+            tfs=np.frombuffer(b"".join(self.postings[token][1].tobytes() for token in tokens), dtype=np.uint32),
+            lengths=np.frombuffer(self.lengths, dtype=np.uint32),
+        )
+        os.replace(tmp_path, self.path)
+        self.saved_rows = len(self.lengths)
+
+    def load(self, rows: int) -> bool:
+        """
+        Loads a snapshot that covers at most `rows` rows.
+
+        Args:
+            rows: The number of rows in the cache.
+
+        Returns: Whether a usable snapshot was loaded.
+        """
+        if not os.path.exists(self.path):
+            return False
+        with np.load(self.path) as saved:
+            lengths = saved["lengths"]
+            if len(lengths) > rows:
+                return False
+            raw_tokens = saved["tokens"].tobytes().decode("utf-8")
+            offsets = saved["offsets"]
+            all_rows = saved["rows"]
+            all_tfs = saved["tfs"]
+        tokens = raw_tokens.split("\n") if raw_tokens else []
+        self.postings = {
+            token: (
+                array("I", all_rows[offsets[i]:offsets[i + 1]].tobytes()),
+                array("I", all_tfs[offsets[i]:offsets[i + 1]].tobytes()),
+            )
+            for i, token in enumerate(tokens)
+        }
+        self.lengths = array("I", lengths.tobytes())
+        self.total_length = int(lengths.sum())
+        self.saved_rows = len(self.lengths)
+        return True
+
+    def clear(self) -> None:
+        """
+        Forgets every row and removes the snapshot.
+
+        Returns: None
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.postings = {}
+        self.lengths = array("I")
+        self.total_length = 0
+        self.saved_rows = 0
+
+    def stats(self) -> dict:
+        return {
+            "rows": len(self.lengths),
+            "tokens": len(self.postings),
+            "postings": sum(len(rows) for rows, _ in self.postings.values()),
+        }
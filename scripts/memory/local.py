@@ -1,90 +1,438 @@
 import dataclasses
 import os
+import threading
+import time
 from typing import Any, List, Optional
 
 import numpy as np
 import orjson
-from memory.base import FLAX_EMBED_DIM, MemoryProviderSingleton, get_flax_embedding
+from memory.ann import IVFIndex
+from memory.base import (
+    EMBEDDING_CACHE,
+    FLAX_EMBED_DIM,
+    MemoryProviderSingleton,
+    get_flax_embedding,
+    get_flax_embeddings,
+    top_k_indices,
+)
+from memory.dedup import DuplicateFilter
+from memory.eviction import EvictionPolicy
+from memory.lexical import BM25Index
+from memory.metadata import TAG_FIELDS, MemoryFilter, MemoryMetadata, metadata_list
+from memory.quantize import SCORE_BATCH_ROWS, Quantizer
+from memory.storage import TAG_COUNT, TAG_DTYPE, AppendOnlyStorage, import_json_cache
 
 EMBED_DIM = FLAX_EMBED_DIM
-SAVE_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SERIALIZE_DATACLASS
+MIN_CAPACITY = 64
+# Compact the storage once this share of its rows has been evicted
+COMPACT_EVICTED_RATIO = 0.25
+# Snapshot the lexical index once this many rows, or this share of its
+# rows, were added since the last snapshot
+LEXICAL_SAVE_ROWS = 1024
+LEXICAL_SAVE_RATIO = 0.1
 
 
 def create_default_embeddings():
     return np.zeros((0, EMBED_DIM)).astype(np.float32)
 
 
+def create_default_scales():
+    return np.zeros((0,), dtype=np.float32)
+
+
+def create_default_alive():
+    return np.zeros((0,), dtype=bool)
+
+
+def create_default_priority():
+    return np.zeros((0,), dtype=np.float64)
+
+
+def create_default_timestamp():
+    return np.zeros((0,), dtype=np.float64)
+
+
+def create_default_tags():
+    return np.zeros((0, TAG_COUNT), dtype=TAG_DTYPE)
+
+
+# Columns with one value per row, grown with the embeddings, and the value
+# of the rows that were not filled yet
+ROW_COLUMNS = {"scales": 1.0, "alive": True, "priority": 0.0, "timestamp": 0.0, "tags": 0}
+
+
 @dataclasses.dataclass
 class CacheContent:
+    """
+    Texts and their embeddings. `embeddings` is a preallocated buffer whose
+    first `count` rows are in use; it doubles in capacity when full so that
+    appending a row is amortized O(1). Rows are kept as `quantizer` codes,
+    with the scale of each row in `scales`. Evicted rows stay in the buffer,
+    with `alive` unset, until the cache is compacted; `priority` orders the
+    rows for eviction. `timestamp` and the storage codes of the `tags` of
+    each row hold its metadata, so that filters are vectorized.
+    """
     texts: List[str] = dataclasses.field(default_factory=list)
     embeddings: np.ndarray = dataclasses.field(
         default_factory=create_default_embeddings
     )
+    count: int = 0
+    quantizer: Quantizer = dataclasses.field(default_factory=Quantizer)
+    scales: np.ndarray = dataclasses.field(
+        default_factory=create_default_scales
+    )
+    alive: np.ndarray = dataclasses.field(
+        default_factory=create_default_alive
+    )
+    priority: np.ndarray = dataclasses.field(
+        default_factory=create_default_priority
+    )
+    timestamp: np.ndarray = dataclasses.field(
+        default_factory=create_default_timestamp
+    )
+    tags: np.ndarray = dataclasses.field(
+        default_factory=create_default_tags
+    )
+
+    @classmethod
+    def from_rows(cls, texts: List[str], rows: np.ndarray,
+                  quantizer: Optional[Quantizer] = None,
+                  priority: Optional[np.ndarray] = None,
+                  deleted: Optional[np.ndarray] = None,
+                  timestamp: Optional[np.ndarray] = None,
+                  tags: Optional[np.ndarray] = None) -> "CacheContent":
+        content = cls(texts=texts, quantizer=quantizer or Quantizer())
+        content.reserve(len(rows))
+        # Encode in batches so that a memory-mapped matrix is never fully copied
+        for start in range(0, len(rows), SCORE_BATCH_ROWS):
+            codes, scales = content.quantizer.encode(rows[start:start + SCORE_BATCH_ROWS])
+            content.embeddings[start:start + len(codes)] = codes
+            content.scales[start:start + len(codes)] = scales
+        content.count = len(rows)
+        if priority is not None:
+            content.priority[:content.count] = priority
+        if timestamp is not None:
+            content.timestamp[:content.count] = timestamp
+        if tags is not None:
+            content.tags[:content.count] = tags
+        if deleted is not None:
+            content.alive[deleted] = False
+        return content
+
+    def take(self, rows: np.ndarray) -> "CacheContent":
+        """A new content holding copies of `rows`, in that order."""
+        content = CacheContent(quantizer=self.quantizer)
+        content.extend_from(self, rows)
+        return content
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """The rows of the buffer that are in use."""
+        return self.embeddings[:self.count]
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + self.scales[:self.count].nbytes
+
+    def reserve(self, rows: int) -> None:
+        """Grows the buffer, by doubling, until it holds `rows` rows."""
+        capacity = len(self.embeddings)
+        if rows <= capacity:
+            return
+        capacity = max(capacity, MIN_CAPACITY)
+        while capacity < rows:
+            capacity *= 2
+        buffer = np.zeros((capacity, EMBED_DIM), dtype=self.quantizer.dtype)
+        buffer[:self.count] = self.embeddings[:self.count]
+        self.embeddings = buffer
+        for name, fill in ROW_COLUMNS.items():
+            old = getattr(self, name)
+            column = np.full((capacity,) + old.shape[1:], fill, dtype=old.dtype)
+            column[:self.count] = old[:self.count]
+            setattr(self, name, column)
+
+    @property
+    def live(self) -> int:
+        """The number of rows in use that were not evicted."""
+        return int(np.count_nonzero(self.alive[:self.count]))
+
+    def append(self, text: str, vector: np.ndarray) -> None:
+        self.extend([text], np.asarray(vector)[np.newaxis, :])
+
+    def extend(self, texts: List[str], vectors: np.ndarray,
+               priority: Optional[np.ndarray] = None,
+               timestamp: Optional[np.ndarray] = None,
+               tags: Optional[np.ndarray] = None) -> None:
+        self.reserve(self.count + len(texts))
+        new = slice(self.count, self.count + len(texts))
+        self.embeddings[new], self.scales[new] = self.quantizer.encode(vectors)
+        self.alive[new] = True
+        self.priority[new] = 0 if priority is None else priority
+        self.timestamp[new] = 0 if timestamp is None else timestamp
+        self.tags[new] = 0 if tags is None else tags
+        self.texts.extend(texts)
+        self.count += len(texts)
+
+    def extend_from(self, other: "CacheContent", rows: np.ndarray) -> None:
+        """Appends `rows` of another content as they are, without re-encoding."""
+        self.reserve(self.count + len(rows))
+        new = slice(self.count, self.count + len(rows))
+        self.embeddings[new] = other.embeddings[rows]
+        for name in ROW_COLUMNS:
+            getattr(self, name)[new] = getattr(other, name)[rows]
+        self.texts.extend(other.texts[i] for i in rows)
+        self.count += len(rows)
+
+    def scores(self, queries: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scores of all rows in use, or of `rows` only, against the queries."""
+        if rows is None:
+            return self.quantizer.scores(self.matrix, self.scales[:self.count], queries)
+        return self.quantizer.scores(self.embeddings[rows], self.scales[rows], queries)
 
 
 class LocalCache(MemoryProviderSingleton):
 
-    # on load, load our database
+    # on load, map our database
     def __init__(self, cfg) -> None:
-        self.filename = f"{cfg.memory_index}.json"
-        if os.path.exists(self.filename):
+        self.storage = AppendOnlyStorage(cfg.memory_index, EMBED_DIM)
+        legacy_filename = f"{cfg.memory_index}.json"
+        if len(self.storage) == 0 and os.path.exists(legacy_filename):
             try:
-                with open(self.filename, 'w+b') as f:
-                    file_content = f.read()
-                    if not file_content.strip():
-                        file_content = b'{}'
-                        f.write(file_content)
-
-                    loaded = orjson.loads(file_content)
-                    self.data = CacheContent(**loaded)
-            except orjson.JSONDecodeError:
-                print(f"Error: The file '{self.filename}' is not in JSON format.")
-                self.data = CacheContent()
-        else:
-            print(f"Warning: The file '{self.filename}' does not exist. Local memory would not be saved to a file.")
-            self.data = CacheContent()
-
-    def add(self, text: str):
+                imported = import_json_cache(legacy_filename, self.storage)
+                # Renamed so that it is not imported again once the memory is cleared
+                os.replace(legacy_filename, f"{legacy_filename}.imported")
+                print(f"Imported {imported} memories from '{legacy_filename}'.")
+            except (orjson.JSONDecodeError, ValueError):
+                print(f"Error: The file '{legacy_filename}' is not in JSON format.")
+                self.storage.clear()
+
+        # Rows are searched in RAM at this precision and, unless it is
+        # float32, the best candidates are rescored with the stored rows
+        self.quantizer = Quantizer(cfg.local_memory_precision)
+        self.rescore_factor = cfg.local_memory_rescore_factor
+        self.capacity = cfg.memory_capacity
+        self.policy = EvictionPolicy(cfg.memory_eviction_policy, cfg.memory_decay_half_life)
+        texts, embeddings = self.storage.load()
+        timestamps = self.storage.timestamps()
+        # Retrieval history is not persisted, rows restart from their add time
+        self.data = CacheContent.from_rows(
+            texts,
+            embeddings,
+            self.quantizer,
+            priority=self.policy.initial(timestamps),
+            deleted=self.storage.deleted(),
+            timestamp=timestamps,
+            tags=self.storage.tags(),
+        )
+        self.duplicates = DuplicateFilter(cfg.memory_dedup, cfg.memory_dedup_threshold)
+        self.duplicates.load([
+            text for text, alive in zip(self.data.texts, self.data.alive[:self.data.count], strict=True) if alive
+        ])
+        self.evicted = 0
+        self.compactions = 0
+        # Held by writes, searches and the swap at the end of a compaction
+        self._lock = threading.RLock()
+        self._compaction: Optional[threading.Thread] = None
+        self._generation = 0
+
+        self.ann_threshold = cfg.local_ann_threshold
+        self.index = IVFIndex(cfg.memory_index, n_probe=cfg.local_ann_probes)
+        if self.ann_threshold > 0 and self.index.load(self.data.count):
+            # Index rows appended after the index was last written
+            self.index.add_many(len(self.index), self.data.matrix[len(self.index):])
+        self._update_index()
+
+        # Scores are (1 - weight) * cosine similarity + weight * BM25,
+        # the lexical index is not kept when the weight is 0
+        self.lexical_weight = cfg.local_memory_lexical_weight
+        self.lexicon = BM25Index(cfg.memory_index)
+        if self.lexical_weight > 0:
+            self.lexicon.load(self.data.count)
+            # Index rows appended after the snapshot was written
+            self.lexicon.add_many(self.data.texts[len(self.lexicon):])
+
+    def _update_index(self) -> None:
+        """
+        Trains the approximate index once the cache outgrows the threshold,
+        and retrains it when it has grown too much since the last training.
+        """
+        if self.ann_threshold <= 0 or self.data.count < self.ann_threshold:
+            return
+        if not self.index.is_trained or self.index.needs_retrain(self.data.count):
+            self.index.train(self.data.matrix)
+
+    def add(self, text: str, metadata: Optional[MemoryMetadata] = None):
         """
         Add text to our list of texts, add embedding as row to our
             embeddings-matrix
 
         Args:
             text: str
+            metadata: Optional[MemoryMetadata]
 
         Returns: None
         """
-        if 'Command Error:' in text:
-            return ""
-        self.data.texts.append(text)
+        return self.add_many([text], metadata)[0]
 
-        embedding = get_flax_embedding(text)
+    def add_many(self, texts: List[str], metadata=None) -> List[str]:
+        """
+        Embed texts in batches and append them as one block of rows,
+            skipping errors and duplicates
 
-        vector = np.array(embedding).astype(np.float32)
-        vector = vector[np.newaxis, :]
-        self.data.embeddings = np.concatenate(
-            [
-                self.data.embeddings,
-                vector,
-            ],
-            axis=0,
+        Args:
+            texts: List[str]
+            metadata: MemoryMetadata for every text, or a list with one per text
+
+        Returns: List[str], empty for the texts that were skipped
+        """
+        metadata = metadata_list(metadata, len(texts))
+        candidates = [i for i, text in enumerate(texts) if 'Command Error:' not in text]
+        kept, vectors = self.duplicates.filter(
+            [texts[i] for i in candidates], get_flax_embeddings, self._nearest_scores
         )
+        kept = [candidates[i] for i in kept]
+        if kept:
+            with self._lock:
+                self._append(
+                    [texts[i] for i in kept],
+                    np.asarray(vectors, dtype=np.float32),
+                    [metadata[i] for i in kept],
+                )
+                self._evict()
+        added = [""] * len(texts)
+        for i in kept:
+            added[i] = texts[i]
+        return added
+
+    def _nearest_scores(self, vectors: np.ndarray) -> np.ndarray:
+        """The best similarity of each vector to the live rows."""
+        with self._lock:
+            if self.data.count == 0:
+                return np.full((len(vectors),), -np.inf)
+            if self.index.is_trained:
+                return np.array([
+                    self.data.scores(vector, self._live(self.index.candidates(vector))).max(initial=-np.inf)
+                    for vector in vectors
+                ])
+            scores = self.data.scores(vectors)
+            scores[~self.data.alive[:self.data.count]] = -np.inf
+            return scores.max(axis=0)
+
+    def _append(self, texts: List[str], vectors: np.ndarray,
+                metadata: List[MemoryMetadata]) -> None:
+        first_row = self.data.count
+        timestamps = np.array([item.timestamp for item in metadata], dtype=np.float64)
+        tags = self.storage.encode_tags([item.tags() for item in metadata])
+        self.data.extend(texts, vectors, self.policy.initial(timestamps), timestamps, tags)
+        self.storage.append_many(texts, vectors, timestamps, tags)
+        if self.index.is_trained:
+            self.index.add_many(first_row, vectors)
+        self._update_index()
+        if self.lexical_weight > 0:
+            self.lexicon.add_many(texts)
+            unsaved = len(self.lexicon) - self.lexicon.saved_rows
+            if unsaved >= max(LEXICAL_SAVE_ROWS, LEXICAL_SAVE_RATIO * len(self.lexicon)):
+                self.lexicon.save()
+
+    def _live(self, rows: np.ndarray) -> np.ndarray:
+        return rows[self.data.alive[rows]]
+
+    def _touch(self, rows: np.ndarray) -> None:
+        """Records a retrieval of `rows` for the eviction policy."""
+        self.data.priority[rows] = self.policy.touched(self.data.priority[rows], time.time())
+
+    def _evict(self) -> None:
+        """
+        Evicts the rows of lowest priority while the cache is over capacity,
+        and compacts it in the background once enough rows were evicted.
+        """
+        if self.capacity <= 0:
+            return
+        count = self.data.count
+        overflow = self.data.live - self.capacity
+        if overflow <= 0:
+            return
+        victims = self.policy.victims(
+            self.data.priority[:count], self.data.alive[:count], overflow
+        )
+        self.data.alive[victims] = False
+        self.storage.delete(victims)
+        self.duplicates.forget([self.data.texts[i] for i in victims])
+        self.evicted += len(victims)
+        if count - self.data.live >= count * COMPACT_EVICTED_RATIO:
+            self.compact()
+
+    def compact(self, wait: bool = False) -> None:
+        """
+        Rewrites the storage without the evicted rows. The rows are copied
+        by a background thread; the lock is only held to copy the rows added
+        meanwhile and to swap in the new storage, so searches keep running.
+
+        Args:
+            wait: Whether to wait for the compaction to finish.
 
-        with open(self.filename, 'wb') as f:
-            out = orjson.dumps(
-                self.data,
-                option=SAVE_OPTIONS
-            )
-            f.write(out)
-        return text
+        Returns: None
+        """
+        with self._lock:
+            if self._compaction is None:
+                self._compaction = threading.Thread(target=self._compact, daemon=True)
+                self._compaction.start()
+            compaction = self._compaction
+        if wait:
+            compaction.join()
+
+    def _compact(self) -> None:
+        target = AppendOnlyStorage(f"{self.storage.prefix}.compact", EMBED_DIM)
+        try:
+            with self._lock:
+                data = self.data
+                count = data.count
+                generation = self._generation
+                keep = np.flatnonzero(data.alive[:count])
+            target.clear()
+            self.storage.copy_rows(keep, target)
+            content = data.take(keep)
+
+            with self._lock:
+                if self._generation != generation:
+                    return
+                tail = np.arange(count, self.data.count)
+                self.storage.copy_rows(tail, target)
+                content.extend_from(self.data, tail)
+                # Rows may have been evicted or retrieved while copying
+                rows = np.concatenate([keep, tail])
+                content.alive[:content.count] = self.data.alive[rows]
+                content.priority[:content.count] = self.data.priority[rows]
+
+                self.storage.replace_with(target)
+                self.storage.delete(np.flatnonzero(~content.alive[:content.count]))
+                if self.index.is_trained:
+                    self.index.keep_rows(rows)
+                if self.lexical_weight > 0:
+                    self.lexicon.keep_rows(rows)
+                self.data = content
+                self.compactions += 1
+        except Exception as e:
+            print("Error compacting the local memory: ", e)
+        finally:
+            target.clear()
+            with self._lock:
+                self._compaction = None
 
     def clear(self) -> str:
         """
-        Clears the redis server.
+        Clears the local cache and its storage files.
 
         Returns: A message indicating that the memory has been cleared.
         """
-        self.data = CacheContent()
+        with self._lock:
+            # Abandons a running compaction
+            self._generation += 1
+            self.storage.clear()
+            self.index.clear()
+            self.lexicon.clear()
+            self.duplicates.clear()
+            self.data = CacheContent(quantizer=self.quantizer)
         return "Obliviated"
 
     def get(self, data: str) -> Optional[List[Any]]:
@@ -98,7 +446,8 @@ class LocalCache(MemoryProviderSingleton):
         """
         return self.get_relevant(data, 1)
 
-    def get_relevant(self, text: str, k: int) -> List[Any]:
+    def get_relevant(self, text: str, k: int,
+                     filters: Optional[MemoryFilter] = None) -> List[Any]:
         """"
         matrix-vector mult to find score-for-each-row-of-matrix
          get indices for top-k winning scores
@@ -106,19 +455,130 @@ class LocalCache(MemoryProviderSingleton):
         Args:
             text: str
             k: int
+            filters: Optional[MemoryFilter], rows not matching are never scored
 
         Returns: List[str]
         """
         embedding = get_flax_embedding(text)
 
-        scores = np.dot(self.data.embeddings, embedding)
+        return self._search(embedding, k, text, filters)
+
+    def get_relevant_many(self, texts: List[str], k: int,
+                          filters: Optional[MemoryFilter] = None) -> List[List[Any]]:
+        """
+        Embed all queries in one batch and score them with a single
+            matrix-matrix mult when the exact path is used
+
+        Args:
+            texts: List[str]
+            k: int
+            filters: Optional[MemoryFilter], applied to every query
+
+        Returns: List[List[str]]
+        """
+        embeddings = get_flax_embeddings(texts)
+        if self.index.is_trained or not self.quantizer.is_exact:
+            return [
+                self._search(embedding, k, text, filters)
+                for embedding, text in zip(embeddings, texts, strict=True)
+            ]
+
+        with self._lock:
+            mask = self._mask(filters)
+            scores = self.data.scores(embeddings).T
+            results = []
+            for row, text in zip(scores, texts, strict=True):
+                row = self._hybrid(row, self._lexical_scores(text))
+                indices = top_k_indices(np.where(mask, row, -np.inf), k)
+                indices = indices[mask[indices]]
+                self._touch(indices)
+                results.append([self.data.texts[i] for i in indices])
+            return results
+
+    def _mask(self, filters: Optional[MemoryFilter]) -> np.ndarray:
+        """Which rows are live and match the filters."""
+        count = self.data.count
+        mask = self.data.alive[:count].copy()
+        if filters is None:
+            return mask
+        for column, name in enumerate(TAG_FIELDS):
+            value = getattr(filters, name)
+            if value is None:
+                continue
+            code = self.storage.code(value)
+            if code is None:
+                return np.zeros_like(mask)
+            mask &= self.data.tags[:count, column] == code
+        if filters.since is not None:
+            mask &= self.data.timestamp[:count] >= filters.since
+        if filters.until is not None:
+            mask &= self.data.timestamp[:count] <= filters.until
+        return mask
+
+    def _lexical_scores(self, text: Optional[str]) -> Optional[np.ndarray]:
+        """The normalized BM25 score of every row, None if none matches."""
+        if self.lexical_weight <= 0 or not text:
+            return None
+        return self.lexicon.scores(text)
+
+    def _hybrid(self, dense: np.ndarray, lexical: Optional[np.ndarray],
+                rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Combines the dense scores of all rows, or of `rows`, with BM25."""
+        if lexical is None:
+            return dense
+        if rows is not None:
+            lexical = lexical[rows]
+        return (1 - self.lexical_weight) * dense + self.lexical_weight * lexical
+
+    def _search(self, embedding: np.ndarray, k: int, text: Optional[str] = None,
+                filters: Optional[MemoryFilter] = None) -> List[Any]:
+        n_candidates = k if self.quantizer.is_exact else k * self.rescore_factor
+        with self._lock:
+            lexical = self._lexical_scores(text)
+            mask = self._mask(filters)
+            if self.index.is_trained:
+                if np.count_nonzero(mask) > self.ann_threshold:
+                    rows = self.index.candidates(embedding)
+                    if lexical is not None:
+                        # Exact matches may sit in clusters that were not probed
+                        rows = np.union1d(rows, top_k_indices(lexical, n_candidates))
+                    rows = rows[mask[rows]]
+                else:
+                    # Few rows match the filters, scoring them all is cheaper than probing
+                    rows = np.flatnonzero(mask)
+                scores = self._hybrid(self.data.scores(embedding, rows), lexical, rows)
+                indices = rows[top_k_indices(scores, n_candidates)]
+            else:
+                scores = self._hybrid(self.data.scores(embedding), lexical)
+                scores[~mask] = -np.inf
+                indices = top_k_indices(scores, n_candidates)
+                indices = indices[mask[indices]]
 
-        top_k_indices = np.argsort(scores)[-k:][::-1]
+            if not self.quantizer.is_exact:
+                exact_scores = np.dot(self.storage.rows(indices), embedding)
+                exact_scores = self._hybrid(exact_scores, lexical, indices)
+                indices = indices[top_k_indices(exact_scores, k)]
 
-        return [self.data.texts[i] for i in top_k_indices]
+            self._touch(indices)
+            return [self.data.texts[i] for i in indices]
 
     def get_stats(self):
         """
         Returns: The stats of the local cache.
         """
-        return len(self.data.texts), self.data.embeddings.shape
+        return {
+            "texts": self.data.live,
+            "embeddings": self.data.matrix.shape,
+            "precision": self.quantizer.precision,
+            "embeddings_bytes": self.data.nbytes,
+            "storage_bytes": self.storage.size_on_disk(),
+            "duplicates": self.duplicates.stats(),
+            "lexical": dict(self.lexicon.stats(), weight=self.lexical_weight),
+            "eviction": {
+                "policy": self.policy.name,
+                "capacity": self.capacity,
+                "evicted": self.evicted,
+                "compactions": self.compactions,
+            },
+            "embedding_cache": EMBEDDING_CACHE.stats(),
+        }
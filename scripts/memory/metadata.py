@@ -0,0 +1,90 @@
+"""Typed metadata stored with each memory, and filters over it."""
+import dataclasses
+import time
+from typing import List, Optional, Sequence, Union
+
+# The string fields of MemoryMetadata, stored as tags by the providers
+TAG_FIELDS = ("source", "agent", "session")
+
+
+@dataclasses.dataclass(frozen=True)
+class MemoryMetadata:
+    """
+    Where a memory comes from. Empty strings mean unknown.
+
+    Attributes:
+        timestamp: When the memory was added, in seconds since the epoch,
+            the time of the add when None.
+        source: The command whose result the memory holds.
+        agent: The key of the agent that added the memory.
+        session: The id of the session that added the memory.
+    """
+    timestamp: Optional[float] = None
+    source: str = ""
+    agent: str = ""
+    session: str = ""
+
+    def stamped(self, now: float) -> "MemoryMetadata":
+        """This metadata, with `now` as timestamp unless one is set."""
+        if self.timestamp is not None:
+            return self
+        return dataclasses.replace(self, timestamp=now)
+
+    def tags(self) -> tuple:
+        return tuple(getattr(self, name) for name in TAG_FIELDS)
+
+
+@dataclasses.dataclass(frozen=True)
+class MemoryFilter:
+    """
+    Restricts retrieval to memories matching every field that is set.
+
+    Attributes:
+        source: The command the memory must come from.
+        agent: The agent key the memory must belong to.
+        session: The session id the memory must belong to.
+        since: The earliest timestamp, inclusive.
+        until: The latest timestamp, inclusive.
+    """
+    source: Optional[str] = None
+    agent: Optional[str] = None
+    session: Optional[str] = None
+    since: Optional[float] = None
+    until: Optional[float] = None
+
+    def tags(self) -> dict:
+        """The tag fields that are set, by name."""
+        return {
+            name: getattr(self, name) for name in TAG_FIELDS
+            if getattr(self, name) is not None
+        }
+
+    def matches(self, metadata: MemoryMetadata) -> bool:
+        if any(getattr(metadata, name) != value for name, value in self.tags().items()):
+            return False
+        timestamp = metadata.timestamp if metadata.timestamp is not None else time.time()
+        if self.since is not None and timestamp < self.since:
+            return False
+        if self.until is not None and timestamp > self.until:
+            return False
+        return True
+
+
+def metadata_list(metadata: Union[None, MemoryMetadata, Sequence[Optional[MemoryMetadata]]],
+                  count: int, now: Optional[float] = None) -> List[MemoryMetadata]:
+    """
+    The metadata of each of `count` memories, stamped with the add time.
+
+    Args:
+        metadata: Nothing, the metadata of every memory, or one per memory.
+        count: The number of memories.
+        now: The add time, the current time by default.
+
+    Returns: One metadata per memory.
+    """
+    now = time.time() if now is None else now
+    if metadata is None or isinstance(metadata, MemoryMetadata):
+        metadata = [metadata] * count
+    if len(metadata) != count:
+        raise ValueError(f"Expected metadata for {count} memories, got {len(metadata)}")
+    return [(item or MemoryMetadata()).stamped(now) for item in metadata]
@@ -1,6 +1,7 @@
 from typing import Any, List, Optional
 
 from memory.base import MemoryProviderSingleton
+from memory.metadata import MemoryFilter, MemoryMetadata
 
 
 class NoMemory(MemoryProviderSingleton):
@@ -15,12 +16,13 @@ class NoMemory(MemoryProviderSingleton):
         """
         pass
 
-    def add(self, data: str) -> str:
+    def add(self, data: str, metadata: Optional[MemoryMetadata] = None) -> str:
         """
         Adds a data point to the memory. No action is taken in NoMemory.
 
         Args:
             data: The data to add.
+            metadata: Where the data comes from.
 
         Returns: An empty string.
         """
@@ -46,7 +48,8 @@ class NoMemory(MemoryProviderSingleton):
         """
         return ""
 
-    def get_relevant(self, data: str, num_relevant: int = 5) -> Optional[List[Any]]:
+    def get_relevant(self, data: str, num_relevant: int = 5,
+                     filters: Optional[MemoryFilter] = None) -> Optional[List[Any]]:
         """
         Returns all the data in the memory that is relevant to the given data.
         NoMemory always returns None.
@@ -54,6 +57,7 @@ class NoMemory(MemoryProviderSingleton):
         Args:
             data: The data to compare to.
             num_relevant: The number of relevant data to return.
+            filters: The metadata the data must match.
 
         Returns: None
         """
@@ -1,50 +1,155 @@
 
+import time
+
+import numpy as np
 import pinecone
-from memory.base import FLAX_EMBED_DIM, MemoryProviderSingleton, get_flax_embedding
+from memory.base import (
+    EMBEDDING_CACHE,
+    FLAX_EMBED_DIM,
+    MemoryProviderSingleton,
+    get_flax_embedding,
+    get_flax_embeddings,
+)
+from memory.dedup import DuplicateFilter
+from memory.metadata import TAG_FIELDS, metadata_list
+from memory.upsert_buffer import UpsertBuffer
+
+
+def pinecone_filter(filters):
+    """
+    The Pinecone metadata filter of a MemoryFilter, None when it sets nothing.
+    """
+    if filters is None:
+        return None
+    query = {name: {"$eq": value} for name, value in filters.tags().items()}
+    timestamp = {}
+    if filters.since is not None:
+        timestamp["$gte"] = filters.since
+    if filters.until is not None:
+        timestamp["$lte"] = filters.until
+    if timestamp:
+        query["timestamp"] = timestamp
+    return query or None
 
 
 class PineconeMemory(MemoryProviderSingleton):
-    def __init__(self, cfg):
-        pinecone_api_key = cfg.pinecone_api_key
-        pinecone_region = cfg.pinecone_region
-        pinecone.init(api_key=pinecone_api_key, environment=pinecone_region)
-        dimension = FLAX_EMBED_DIM
-        metric = "cosine"
-        pod_type = "p1"
-        table_name = "auto-gpt"
+    def __init__(self, cfg, index=None):
+        """
+        :param cfg: The config object.
+        :param index: An object with the `pinecone.Index` methods to use
+            instead of connecting to Pinecone, such as an in-process stand-in.
+        """
         # this assumes we don't start with memory.
         # for now this works.
         # we'll need a more complicated and robust system if we want to start with memory.
         self.vec_num = 0
-        if table_name not in pinecone.list_indexes():
-            pinecone.create_index(table_name, dimension=dimension, metric=metric, pod_type=pod_type)
-        self.index = pinecone.Index(table_name)
-
-    def add(self, data):
-        vector = get_flax_embedding(data)
-        # no metadata here. We may wish to change that long term.
-        self.index.upsert([(str(self.vec_num), vector, {"raw_text": data})])
-        _text = f"Inserting data into memory at index: {self.vec_num}:\n data: {data}"
-        self.vec_num += 1
-        return _text
+        if index is None:
+            pinecone_api_key = cfg.pinecone_api_key
+            pinecone_region = cfg.pinecone_region
+            pinecone.init(api_key=pinecone_api_key, environment=pinecone_region)
+            dimension = FLAX_EMBED_DIM
+            metric = "cosine"
+            pod_type = "p1"
+            table_name = "auto-gpt"
+            if table_name not in pinecone.list_indexes():
+                pinecone.create_index(table_name, dimension=dimension, metric=metric, pod_type=pod_type)
+            index = pinecone.Index(table_name)
+        self.index = index
+        self.writer = UpsertBuffer(
+            self.index,
+            chunk_size=cfg.pinecone_upsert_chunk_size,
+            flush_interval=cfg.pinecone_flush_interval,
+        )
+        self.duplicates = DuplicateFilter(cfg.memory_dedup, cfg.memory_dedup_threshold)
+        self.stats_ttl = cfg.pinecone_stats_ttl
+        self._stats = None
+        self._stats_at = 0.0
+
+    def add(self, data, metadata=None):
+        return self.add_many([data], metadata)[0]
+
+    def add_many(self, texts, metadata=None):
+        """
+        Adds many data points, embedding them in batches and buffering them
+        to be upserted in chunks. Duplicates are skipped.
+        :param texts: The data to add.
+        :param metadata: A MemoryMetadata for every text, or one per text.
+        """
+        metadata = metadata_list(metadata, len(texts))
+        kept, vectors = self.duplicates.filter(texts, get_flax_embeddings, self._nearest_scores)
+        items = []
+        messages = [""] * len(texts)
+        for i, vector in zip(kept, vectors, strict=True):
+            fields = {"raw_text": texts[i], "timestamp": metadata[i].timestamp}
+            fields.update((name, tag) for name, tag in zip(TAG_FIELDS, metadata[i].tags(), strict=True) if tag)
+            items.append((str(self.vec_num), vector.tolist(), fields))
+            messages[i] = f"Inserting data into memory at index: {self.vec_num}:\n data: {texts[i]}"
+            self.vec_num += 1
+        self.writer.add(items)
+        return messages
+
+    def _nearest_scores(self, vectors):
+        """
+        The best cosine similarity of each vector to the stored vectors.
+        """
+        self.writer.flush()
+        scores = []
+        for vector in vectors:
+            matches = self.index.query(vector.tolist(), top_k=1).matches
+            scores.append(matches[0].score if matches else -np.inf)
+        return np.array(scores)
 
     def get(self, data):
         return self.get_relevant(data, 1)
 
     def clear(self):
+        self.writer.clear()
         self.index.delete(deleteAll=True)
+        self.duplicates.clear()
+        self._stats = None
         return "Obliviated"
 
-    def get_relevant(self, data, num_relevant=5):
+    def get_relevant(self, data, num_relevant=5, filters=None):
         """
         Returns all the data in the memory that is relevant to the given data.
         :param data: The data to compare to.
         :param num_relevant: The number of relevant data to return. Defaults to 5
+        :param filters: The MemoryFilter the data must match.
         """
         query_embedding = get_flax_embedding(data)
-        results = self.index.query(query_embedding, top_k=num_relevant, include_metadata=True)
-        sorted_results = sorted(results.matches, key=lambda x: x.score)
+        return self._search(query_embedding, num_relevant, filters)
+
+    def get_relevant_many(self, queries, num_relevant=5, filters=None):
+        """
+        Returns the relevant data of many queries, embedding them in batches.
+        :param queries: The data to compare to.
+        :param num_relevant: The number of relevant data to return per query. Defaults to 5
+        :param filters: The MemoryFilter the data must match.
+        """
+        query_embeddings = get_flax_embeddings(queries)
+        return [self._search(query_embedding, num_relevant, filters) for query_embedding in query_embeddings]
+
+    def _search(self, query_embedding, num_relevant, filters=None):
+        # Buffered vectors must be searchable by the queries that follow them
+        self.writer.flush()
+        query = {"top_k": num_relevant, "include_metadata": True}
+        # Pinecone applies the filter before ranking, so top_k counts matches only
+        metadata_filter = pinecone_filter(filters)
+        if metadata_filter is not None:
+            query["filter"] = metadata_filter
+        results = self.index.query(query_embedding.tolist(), **query)
+        sorted_results = sorted(results.matches, key=lambda x: x.score, reverse=True)
         return [str(item['metadata']["raw_text"]) for item in sorted_results]
 
     def get_stats(self):
-        return self.index.describe_index_stats()
+        """
+        The index stats are fetched at most once every `stats_ttl` seconds.
+        """
+        if self._stats is None or time.monotonic() - self._stats_at >= self.stats_ttl:
+            self._stats = self.index.describe_index_stats().to_dict()
+            self._stats_at = time.monotonic()
+        stats = dict(self._stats)
+        stats["embedding_cache"] = EMBEDDING_CACHE.stats()
+        stats["duplicates"] = self.duplicates.stats()
+        stats["upsert_buffer"] = self.writer.stats()
+        return stats
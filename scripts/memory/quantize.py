@@ -0,0 +1,66 @@
+"""Compact encodings of embedding rows for the local memory."""
+from typing import Tuple
+
+import numpy as np
+
+# float16 is left out: numpy upcasts it to float32 on every query, so it
+# searched about 7x slower than float32 while int8 takes half its RAM
+PRECISIONS = ("float32", "int8")
+# Rows upcast to float32 at a time while scoring. Batches that stay in the
+# CPU cache score int8 rows about 3x faster than batches of 65536 rows
+SCORE_BATCH_ROWS = 4096
+INT8_MAX = 127
+
+
+class Quantizer:
+    """
+    Encodes float32 rows as `precision` codes plus a float32 scale per row,
+    so that a row is approximately `codes[i] * scales[i]`. Only int8 uses
+    the scales, they are 1 for float32.
+    """
+
+    def __init__(self, precision: str = "float32") -> None:
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported precision '{precision}', use one of {PRECISIONS}")
+        self.precision = precision
+        self.dtype = np.dtype(precision)
+
+    @property
+    def is_exact(self) -> bool:
+        return self.precision == "float32"
+
+    def encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Args:
+            vectors: The float rows to encode.
+
+        Returns: The codes and the scale of each row.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.precision != "int8":
+            return vectors.astype(self.dtype), np.ones((len(vectors),), dtype=np.float32)
+
+        scales = np.abs(vectors).max(axis=1) / INT8_MAX
+        scales[scales == 0] = 1
+        codes = np.rint(vectors / scales[:, np.newaxis]).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def decode(self, codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+        return codes.astype(np.float32) * scales[:, np.newaxis]
+
+    def scores(self, codes: np.ndarray, scales: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        """
+        Dot products of the encoded rows with one query, or a matrix of
+        queries, computed in batches of SCORE_BATCH_ROWS rows.
+
+        Returns: An array with one row of scores per encoded row.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        out = np.empty((len(codes),) + queries.shape[:-1], dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BATCH_ROWS):
+            batch = codes[start:start + SCORE_BATCH_ROWS].astype(np.float32, copy=False)
+            batch_scores = np.dot(batch, queries.T)
+            if self.precision == "int8":
+                batch_scores *= scales[start:start + len(batch)].reshape((-1,) + (1,) * (queries.ndim - 1))
+            out[start:start + len(batch)] = batch_scores
+        return out
@@ -0,0 +1,165 @@
+"""Asyncio Redis memory provider."""
+import asyncio
+import weakref
+from typing import Any, List, Optional
+
+import numpy as np
+import redis.asyncio as aioredis
+from event_loop import BackgroundLoop
+from memory.base import get_flax_embedding, get_flax_embeddings
+from memory.metadata import MemoryFilter, MemoryMetadata, metadata_list
+from memory.redismem import RedisMemory, knn_params, knn_query
+
+
+class AsyncRedisMemory(RedisMemory):
+    """
+    Redis memory whose searches and writes go through `redis.asyncio` with
+    a pool of up to `cfg.redis_max_connections` connections, so concurrent
+    callers run their KNN queries in parallel instead of queueing on one
+    blocking client.
+
+    The coroutines `aadd`, `aadd_many`, `aget_relevant` and
+    `aget_relevant_many` can be awaited from any event loop; the
+    synchronous methods run them on a background loop. Creating the index,
+    clearing it, duplicate filtering and eviction use the synchronous
+    client of RedisMemory.
+    """
+
+    def __init__(self, cfg):
+        """
+        Initializes the Redis memory provider.
+
+        Args:
+            cfg: The config object.
+
+        Returns: None
+        """
+        super().__init__(cfg)
+        self.max_connections = cfg.redis_max_connections
+        # Async connections belong to the loop that opened them, so each
+        # loop gets its own pool
+        self._clients = weakref.WeakKeyDictionary()
+        self.background = BackgroundLoop("redis-memory")
+
+    def _client(self) -> aioredis.Redis:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            pool = aioredis.BlockingConnectionPool(
+                host=self.cfg.redis_host,
+                port=self.cfg.redis_port,
+                password=self.cfg.redis_password,
+                db=0,  # Cannot be changed
+                max_connections=self.max_connections,
+            )
+            client = self._clients[loop] = aioredis.Redis(connection_pool=pool)
+        return client
+
+    def add_many(self, texts: List[str], metadata=None) -> List[str]:
+        return self.background.run(self.aadd_many(texts, metadata))
+
+    def get_relevant(self, data: str, num_relevant: int = 5,
+                     filters: Optional[MemoryFilter] = None) -> Optional[List[Any]]:
+        return self.background.run(self.aget_relevant(data, num_relevant, filters))
+
+    def get_relevant_many(self, queries: List[str], num_relevant: int = 5,
+                          filters: Optional[MemoryFilter] = None) -> List[Optional[List[Any]]]:
+        return self.background.run(self.aget_relevant_many(queries, num_relevant, filters))
+
+    async def aadd(self, data: str, metadata: Optional[MemoryMetadata] = None) -> str:
+        """
+        Adds a data point to the memory.
+
+        Args:
+            data: The data to add.
+            metadata: Where the data comes from.
+
+        Returns: Message indicating that the data has been added.
+        """
+        return (await self.aadd_many([data], metadata))[0]
+
+    async def aadd_many(self, texts: List[str], metadata=None) -> List[str]:
+        """
+        Adds many data points, embedding them in batches and writing them
+        in a single pipeline. Errors and duplicates are skipped.
+
+        Args:
+            texts: The data to add.
+            metadata: A MemoryMetadata for every text, or one per text.
+
+        Returns: A message for each text, empty for skipped texts.
+        """
+        metadata = metadata_list(metadata, len(texts))
+        loop = asyncio.get_running_loop()
+        # Embedding and the duplicate checks block, keep them off the loop
+        kept, vectors = await loop.run_in_executor(None, self._filter, texts)
+        messages = [""] * len(texts)
+        if not kept:
+            return messages
+        client = self._client()
+        vec_num = await client.incrby(self.vec_num_key, len(kept)) - len(kept)
+        pipe = client.pipeline()
+        self._queue_writes(pipe, texts, metadata, kept, vectors, vec_num, messages)
+        await pipe.execute()
+        if self.capacity > 0:
+            await loop.run_in_executor(None, self._evict)
+        return messages
+
+    async def aget_relevant(self, data: str, num_relevant: int = 5,
+                            filters: Optional[MemoryFilter] = None) -> Optional[List[Any]]:
+        """
+        Returns all the data in the memory that is relevant to the given data.
+        Args:
+            data: The data to compare to.
+            num_relevant: The number of relevant data to return.
+            filters: The metadata the data must match.
+
+        Returns: A list of the most relevant data.
+        """
+        loop = asyncio.get_running_loop()
+        query_embedding = await loop.run_in_executor(None, get_flax_embedding, data)
+        return await self._asearch(query_embedding, num_relevant, filters)
+
+    async def aget_relevant_many(self, queries: List[str], num_relevant: int = 5,
+                                 filters: Optional[MemoryFilter] = None) -> List[Optional[List[Any]]]:
+        """
+        Returns the relevant data of many queries, embedding them in one
+        batch and running their searches concurrently.
+        Args:
+            queries: The data to compare to.
+            num_relevant: The number of relevant data to return per query.
+            filters: The metadata the data must match.
+
+        Returns: A list of the most relevant data for each query.
+        """
+        loop = asyncio.get_running_loop()
+        query_embeddings = await loop.run_in_executor(None, get_flax_embeddings, queries)
+        return list(await asyncio.gather(*(
+            self._asearch(query_embedding, num_relevant, filters)
+            for query_embedding in query_embeddings
+        )))
+
+    async def _asearch(
+        self,
+        query_embedding: np.ndarray,
+        num_relevant: int,
+        filters: Optional[MemoryFilter] = None
+    ) -> Optional[List[Any]]:
+        client = self._client()
+        try:
+            results = await client.ft(f"{self.cfg.memory_index}").search(
+                knn_query(num_relevant, filters), query_params=knn_params(query_embedding)
+            )
+        except Exception as e:
+            print("Error calling Redis search: ", e)
+            return None
+        await self._atouch(client, results.docs)
+        return [doc.data for doc in results.docs]
+
+    async def _atouch(self, client: aioredis.Redis, docs) -> None:
+        if not self._tracks_retrievals(docs):
+            return
+        keys = [doc.id for doc in docs]
+        priorities = self._touched(keys, await client.zmscore(self.eviction_key, keys))
+        if priorities:
+            await client.zadd(self.eviction_key, priorities, xx=True)
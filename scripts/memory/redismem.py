@@ -1,10 +1,21 @@
 """Redis memory provider."""
-from typing import Any, List, Optional
+import re
+import time
+from typing import Any, List, Optional, Tuple
 
 import numpy as np
 import redis
-from memory.base import FLAX_EMBED_DIM, MemoryProviderSingleton, get_flax_embedding
-from redis.commands.search.field import TextField, VectorField
+from memory.base import (
+    EMBEDDING_CACHE,
+    FLAX_EMBED_DIM,
+    MemoryProviderSingleton,
+    get_flax_embedding,
+    get_flax_embeddings,
+)
+from memory.dedup import DuplicateFilter
+from memory.eviction import EvictionPolicy
+from memory.metadata import TAG_FIELDS, MemoryFilter, MemoryMetadata, metadata_list
+from redis.commands.search.field import NumericField, TagField, TextField, VectorField
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.query import Query
 
@@ -20,9 +31,68 @@ SCHEMA = [
         }
     ),
 ]
+# Fields of the memory metadata, added to indexes created without them
+METADATA_FIELDS = [TagField(name) for name in TAG_FIELDS] + [NumericField("timestamp")]
+SCHEMA += METADATA_FIELDS
+# Keys scanned, and unlinked in one pipeline, per batch when wiping an index
+SCAN_BATCH_SIZE = 1000
+
+
+def escape_tag(value: str) -> str:
+    return re.sub(r"([^A-Za-z0-9_])", r"\\\1", value)
+
+
+def filter_expression(filters: Optional[MemoryFilter]) -> str:
+    """The query selecting the documents that match the filters."""
+    if filters is None:
+        return "*"
+    clauses = [f"@{name}:{{{escape_tag(value)}}}" for name, value in filters.tags().items()]
+    if filters.since is not None or filters.until is not None:
+        low = "-inf" if filters.since is None else repr(float(filters.since))
+        high = "+inf" if filters.until is None else repr(float(filters.until))
+        clauses.append(f"@timestamp:[{low} {high}]")
+    return f"({' '.join(clauses)})" if clauses else "*"
+
+
+def knn_query(num_relevant: int, filters: Optional[MemoryFilter] = None) -> Query:
+    # The filter runs before the KNN, which ranks the matching documents only
+    base_query = f"{filter_expression(filters)}=>[KNN {num_relevant} @embedding $vector AS vector_score]"
+    return Query(base_query).return_fields(
+        "data",
+        "vector_score"
+    ).sort_by("vector_score").dialect(2)
+
+
+def knn_params(query_embedding: np.ndarray) -> dict:
+    return {"vector": np.array(query_embedding).astype(np.float32).tobytes()}
+
+
+class RedisDuplicateFilter(DuplicateFilter):
+    """Keeps the content hashes in a Redis set shared by every process."""
+
+    def __init__(self, client, key, enabled=False, threshold=0.97):
+        super().__init__(enabled, threshold)
+        self.client = client
+        self.key = key
+
+    def _known(self, keys):
+        if not keys:
+            return []
+        return [bool(known) for known in self.client.smismember(self.key, keys)]
+
+    def _remember(self, keys):
+        if keys:
+            self.client.sadd(self.key, *keys)
+
+    def _forget(self, keys):
+        if keys:
+            self.client.srem(self.key, *keys)
 
 
 class RedisMemory(MemoryProviderSingleton):
+    # Its state lives in Redis, which serializes the commands of every client
+    thread_safe = True
+
     def __init__(self, cfg):
         """
         Initializes the Redis memory provider.
@@ -43,47 +113,227 @@ class RedisMemory(MemoryProviderSingleton):
             db=0  # Cannot be changed
         )
         self.cfg = cfg
+        # Incremented atomically, so that processes sharing the index
+        # never write the same vector number
+        self.vec_num_key = f'{cfg.memory_index}-vec_num'
+        self.duplicates = RedisDuplicateFilter(
+            self.redis,
+            f'{cfg.memory_index}-hashes',
+            enabled=cfg.memory_dedup,
+            threshold=cfg.memory_dedup_threshold,
+        )
+        # Hash keys scored by their eviction priority
+        self.capacity = cfg.memory_capacity
+        self.policy = EvictionPolicy(cfg.memory_eviction_policy, cfg.memory_decay_half_life)
+        self.eviction_key = f'{cfg.memory_index}-eviction'
+        self.evicted = 0
         if cfg.wipe_redis_on_start:
-            self.redis.flushall()
+            self._wipe()
+        self._create_index()
+        if self.capacity > 0:
+            self._backfill_eviction()
+
+    def _create_index(self) -> None:
         try:
-            self.redis.ft(f"{cfg.memory_index}").create_index(
+            self.redis.ft(f"{self.cfg.memory_index}").create_index(
                 fields=SCHEMA,
                 definition=IndexDefinition(
-                    prefix=[f"{cfg.memory_index}:"],
+                    prefix=[f"{self.cfg.memory_index}:"],
                     index_type=IndexType.HASH
                     )
                 )
         except Exception as e:
             print("Error creating Redis search index: ", e)
-        existing_vec_num = self.redis.get(f'{cfg.memory_index}-vec_num')
-        self.vec_num = int(existing_vec_num.decode('utf-8')) if\
-            existing_vec_num else 0
+            for field in METADATA_FIELDS:
+                try:
+                    self.redis.ft(f"{self.cfg.memory_index}").alter_schema_add([field])
+                except redis.ResponseError:
+                    # The index already has the field
+                    pass
+
+    def _wipe(self) -> None:
+        """
+        Deletes the search index and every key of this memory index, leaving
+        the rest of the server alone. Keys are found with an incremental
+        SCAN and unlinked in pipelined batches, so Redis frees them in the
+        background and keeps serving other clients meanwhile.
+        """
+        try:
+            self.redis.ft(f"{self.cfg.memory_index}").dropindex(delete_documents=False)
+        except redis.ResponseError:
+            # The index does not exist yet
+            pass
+        pipe = self.redis.pipeline(transaction=False)
+        batch = []
+        for key in self.redis.scan_iter(match=f"{self.cfg.memory_index}:*", count=SCAN_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) == SCAN_BATCH_SIZE:
+                pipe.unlink(*batch)
+                pipe.execute()
+                batch = []
+        pipe.unlink(self.vec_num_key, self.duplicates.key, self.eviction_key, *batch)
+        pipe.execute()
 
-    def add(self, data: str) -> str:
+    def add(self, data: str, metadata: Optional[MemoryMetadata] = None) -> str:
         """
         Adds a data point to the memory.
 
         Args:
             data: The data to add.
+            metadata: Where the data comes from.
 
         Returns: Message indicating that the data has been added.
         """
-        if 'Command Error:' in data:
-            return ""
-        vector = get_flax_embedding(data)
-        vector = np.array(vector).astype(np.float32).tobytes()
-        data_dict = {
-            b"data": data,
-            "embedding": vector
-        }
+        return self.add_many([data], metadata)[0]
+
+    def add_many(self, texts: List[str], metadata=None) -> List[str]:
+        """
+        Adds many data points, embedding them in batches and writing them
+        in a single pipeline. Errors and duplicates are skipped.
+
+        Args:
+            texts: The data to add.
+            metadata: A MemoryMetadata for every text, or one per text.
+
+        Returns: A message for each text, empty for skipped texts.
+        """
+        metadata = metadata_list(metadata, len(texts))
+        kept, vectors = self._filter(texts)
+        messages = [""] * len(texts)
+        if not kept:
+            return messages
+        vec_num = self.redis.incrby(self.vec_num_key, len(kept)) - len(kept)
         pipe = self.redis.pipeline()
-        pipe.hset(f"{self.cfg.memory_index}:{self.vec_num}", mapping=data_dict)
-        _text = f"Inserting data into memory at index: {self.vec_num}:\n"\
-            f"data: {data}"
-        self.vec_num += 1
-        pipe.set(f'{self.cfg.memory_index}-vec_num', self.vec_num)
+        self._queue_writes(pipe, texts, metadata, kept, vectors, vec_num, messages)
         pipe.execute()
-        return _text
+        self._evict()
+        return messages
+
+    def _filter(self, texts: List[str]) -> Tuple[List[int], np.ndarray]:
+        """
+        Embeds the texts to add, skipping errors and duplicates.
+
+        Returns: The positions of the texts to add and their embeddings.
+        """
+        candidates = [i for i, text in enumerate(texts) if 'Command Error:' not in text]
+        kept, vectors = self.duplicates.filter(
+            [texts[i] for i in candidates], get_flax_embeddings, self._nearest_scores
+        )
+        return [candidates[i] for i in kept], vectors
+
+    def _queue_writes(self, pipe, texts: List[str], metadata: List[MemoryMetadata],
+                      kept: List[int], vectors: np.ndarray, vec_num: int,
+                      messages: List[str]) -> None:
+        """
+        Queues the writes of the kept texts, numbered from `vec_num`, on a
+        pipeline, and fills in their messages.
+        """
+        for i, vector in zip(kept, vectors, strict=True):
+            data_dict = {
+                b"data": texts[i],
+                "embedding": np.asarray(vector, dtype=np.float32).tobytes(),
+                "timestamp": metadata[i].timestamp,
+            }
+            # Empty tags are left out, Redis does not index them
+            data_dict.update({
+                name: value for name, value in zip(TAG_FIELDS, metadata[i].tags(), strict=True) if value
+            })
+            key = f"{self.cfg.memory_index}:{vec_num}"
+            pipe.hset(key, mapping=data_dict)
+            # Tracked even without a capacity, so that one can be set later
+            pipe.zadd(self.eviction_key, {key: float(self.policy.initial(metadata[i].timestamp))})
+            messages[i] = f"Inserting data into memory at index: {vec_num}:\n"\
+                f"data: {texts[i]}"
+            vec_num += 1
+
+    def _backfill_eviction(self) -> None:
+        """
+        Adds the keys that are not in the eviction set, such as keys written
+        by older versions, prioritized by the time they were added. Skipped
+        when the set already holds as many keys as the search index.
+        """
+        try:
+            indexed = int(self.redis.ft(f"{self.cfg.memory_index}").info()["num_docs"])
+        except Exception:
+            indexed = None
+        if indexed is not None and self.redis.zcard(self.eviction_key) >= indexed:
+            return
+        batch = []
+        for key in self.redis.scan_iter(match=f"{self.cfg.memory_index}:*", count=SCAN_BATCH_SIZE):
+            batch.append(key)
+            if len(batch) == SCAN_BATCH_SIZE:
+                self._track(batch)
+                batch = []
+        self._track(batch)
+
+    def _track(self, keys) -> None:
+        if not keys:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.hget(key, "timestamp")
+        # Keys without a timestamp predate it and are evicted first
+        priorities = {
+            key: float(self.policy.initial(float(timestamp or 0)))
+            for key, timestamp in zip(keys, pipe.execute(), strict=True)
+        }
+        # NX keeps the priority of keys already tracked
+        self.redis.zadd(self.eviction_key, priorities, nx=True)
+
+    def _evict(self) -> None:
+        """
+        Pops the keys of lowest priority while the index is over capacity
+        and unlinks their hashes, which Redis frees in the background.
+        """
+        if self.capacity <= 0:
+            return
+        overflow = self.redis.zcard(self.eviction_key) - self.capacity
+        if overflow <= 0:
+            return
+        victims = [key for key, _ in self.redis.zpopmin(self.eviction_key, overflow)]
+        texts = self.redis.pipeline()
+        for key in victims:
+            texts.hget(key, "data")
+        texts = [text.decode("utf-8") for text in texts.execute() if text is not None]
+        self.duplicates.forget(texts)
+        self.redis.unlink(*victims)
+        self.evicted += len(victims)
+
+    def _tracks_retrievals(self, docs) -> bool:
+        return self.capacity > 0 and self.policy.name != "oldest" and len(docs) > 0
+
+    def _touched(self, keys, current) -> dict:
+        """The new priority of the retrieved keys that were not evicted."""
+        now = time.time()
+        return {
+            key: float(self.policy.touched(score, now))
+            for key, score in zip(keys, current, strict=True) if score is not None
+        }
+
+    def _touch(self, docs) -> None:
+        """Records a retrieval of `docs` for the eviction policy."""
+        if not self._tracks_retrievals(docs):
+            return
+        keys = [doc.id for doc in docs]
+        priorities = self._touched(keys, self.redis.zmscore(self.eviction_key, keys))
+        if priorities:
+            # XX only updates keys that were not evicted meanwhile
+            self.redis.zadd(self.eviction_key, priorities, xx=True)
+
+    def _nearest_scores(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        The best cosine similarity of each vector to the stored vectors.
+        """
+        scores = []
+        for vector in vectors:
+            try:
+                docs = self._knn(vector, 1)
+            except Exception as e:
+                print("Error calling Redis search: ", e)
+                docs = []
+            # The index returns cosine distances
+            scores.append(1 - float(docs[0].vector_score) if docs else -np.inf)
+        return np.array(scores)
 
     def get(self, data: str) -> Optional[List[Any]]:
         """
@@ -98,45 +348,85 @@ class RedisMemory(MemoryProviderSingleton):
 
     def clear(self) -> str:
         """
-        Clears the redis server.
+        Clears the keys of this memory index and recreates its search index.
 
         Returns: A message indicating that the memory has been cleared.
         """
-        self.redis.flushall()
+        self._wipe()
+        self._create_index()
+        self.duplicates.clear()
         return "Obliviated"
 
     def get_relevant(
         self,
         data: str,
-        num_relevant: int = 5
+        num_relevant: int = 5,
+        filters: Optional[MemoryFilter] = None
     ) -> Optional[List[Any]]:
         """
         Returns all the data in the memory that is relevant to the given data.
         Args:
             data: The data to compare to.
             num_relevant: The number of relevant data to return.
+            filters: The metadata the data must match.
 
         Returns: A list of the most relevant data.
         """
         query_embedding = get_flax_embedding(data)
-        base_query = f"*=>[KNN {num_relevant} @embedding $vector AS vector_score]"
-        query = Query(base_query).return_fields(
-            "data",
-            "vector_score"
-        ).sort_by("vector_score").dialect(2)
-        query_vector = np.array(query_embedding).astype(np.float32).tobytes()
+        return self._search(query_embedding, num_relevant, filters)
+
+    def get_relevant_many(
+        self,
+        queries: List[str],
+        num_relevant: int = 5,
+        filters: Optional[MemoryFilter] = None
+    ) -> List[Optional[List[Any]]]:
+        """
+        Returns the relevant data of many queries, embedding them in batches.
+        Args:
+            queries: The data to compare to.
+            num_relevant: The number of relevant data to return per query.
+            filters: The metadata the data must match.
+
+        Returns: A list of the most relevant data for each query.
+        """
+        query_embeddings = get_flax_embeddings(queries)
+        return [
+            self._search(query_embedding, num_relevant, filters)
+            for query_embedding in query_embeddings
+        ]
 
+    def _search(
+        self,
+        query_embedding: np.ndarray,
+        num_relevant: int,
+        filters: Optional[MemoryFilter] = None
+    ) -> Optional[List[Any]]:
         try:
-            results = self.redis.ft(f"{self.cfg.memory_index}").search(
-                query, query_params={"vector": query_vector}
-            )
+            docs = self._knn(query_embedding, num_relevant, filters)
         except Exception as e:
             print("Error calling Redis search: ", e)
             return None
-        return [result.data for result in results.docs]
+        self._touch(docs)
+        return [doc.data for doc in docs]
+
+    def _knn(self, query_embedding: np.ndarray, num_relevant: int,
+             filters: Optional[MemoryFilter] = None):
+        results = self.redis.ft(f"{self.cfg.memory_index}").search(
+            knn_query(num_relevant, filters), query_params=knn_params(query_embedding)
+        )
+        return results.docs
 
     def get_stats(self):
         """
-        Returns: The stats of the memory index.
+        Returns: The stats of the memory index and the embedding cache.
         """
-        return self.redis.ft(f"{self.cfg.memory_index}").info()
+        stats = dict(self.redis.ft(f"{self.cfg.memory_index}").info())
+        stats["embedding_cache"] = EMBEDDING_CACHE.stats()
+        stats["duplicates"] = self.duplicates.stats()
+        stats["eviction"] = {
+            "policy": self.policy.name,
+            "capacity": self.capacity,
+            "evicted": self.evicted,
+        }
+        return stats
@@ -0,0 +1,434 @@
+"""Append-only on-disk storage for the local memory provider."""
+import os
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+OFFSET_DTYPE = np.dtype("<u8")
+TIMESTAMP_DTYPE = np.dtype("<f8")
+ROW_DTYPE = np.dtype("<u8")
+TAG_DTYPE = np.dtype("<u4")
+# Tags stored per row, see memory.metadata.TAG_FIELDS
+TAG_COUNT = 3
+# Rows copied at a time while compacting
+COPY_BATCH_ROWS = 65536
+
+
+class AppendOnlyStorage:
+    """
+    Stores memories as append-only files sharing one prefix:
+
+        {prefix}.vec  raw rows of the embeddings matrix
+        {prefix}.txt  utf-8 encoded texts, back to back
+        {prefix}.ts   little-endian float64 time each row was added
+        {prefix}.tag  little-endian uint32 codes of the tags of each row
+        {prefix}.voc  the tag of each code from 1, one JSON string per line;
+                      code 0 is the empty tag
+        {prefix}.off  little-endian uint64 end offset of each text
+        {prefix}.del  little-endian uint64 rows that have been deleted
+
+    A row only counts once its offset has been written, so a crash in the
+    middle of an append leaves a dangling tail that is dropped on load.
+    Deleted rows keep their space until the storage is compacted.
+    """
+
+    def __init__(self, prefix: str, dim: int, dtype=np.float32) -> None:
+        """
+        Initializes the storage, repairing a partially written tail.
+
+        Args:
+            prefix: The path prefix shared by the storage files.
+            dim: The dimension of each embedding row.
+            dtype: The dtype rows are stored with.
+
+        Returns: None
+        """
+        self.prefix = prefix
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.vec_path = f"{prefix}.vec"
+        self.txt_path = f"{prefix}.txt"
+        self.ts_path = f"{prefix}.ts"
+        self.off_path = f"{prefix}.off"
+        self.del_path = f"{prefix}.del"
+        self.tag_path = f"{prefix}.tag"
+        self.voc_path = f"{prefix}.voc"
+        self._row_bytes = self.dim * self.dtype.itemsize
+        self._tag_bytes = TAG_COUNT * TAG_DTYPE.itemsize
+        self._files = None
+        self._del_file = None
+        self._voc_file = None
+        self._map = None
+        self._repair()
+
+    @property
+    def paths(self) -> Tuple[str, ...]:
+        return (self.txt_path, self.vec_path, self.ts_path, self.tag_path, self.voc_path,
+                self.off_path, self.del_path)
+
+    def exists(self) -> bool:
+        """
+        Returns: Whether any storage file exists on disk.
+        """
+        return any(os.path.exists(path) for path in self.paths)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _repair(self) -> None:
+        """
+        Truncates all files to the number of rows that were fully written.
+        """
+        offsets = self._read_offsets()
+        vec_size = _file_size(self.vec_path)
+        txt_size = _file_size(self.txt_path)
+        ts_size = _file_size(self.ts_path)
+        tag_size = _file_size(self.tag_path)
+
+        count = min(len(offsets), vec_size // self._row_bytes)
+        # Offsets are monotonic, drop every row whose text was not flushed
+        while count > 0 and offsets[count - 1] > txt_size:
+            count -= 1
+        text_end = int(offsets[count - 1]) if count else 0
+
+        if len(offsets) != count:
+            _truncate(self.off_path, count * OFFSET_DTYPE.itemsize)
+        if vec_size != count * self._row_bytes:
+            _truncate(self.vec_path, count * self._row_bytes)
+        if txt_size != text_end:
+            _truncate(self.txt_path, text_end)
+        # Rows written before timestamps and tags were kept get zeros, an
+        # unknown age and empty tags
+        _resize(self.ts_path, ts_size, count * TIMESTAMP_DTYPE.itemsize)
+        _resize(self.tag_path, tag_size, count * self._tag_bytes)
+        self._load_vocabulary()
+
+        self._count = count
+        self._text_end = text_end
+
+    def _load_vocabulary(self) -> None:
+        self.vocabulary = [""]
+        if os.path.exists(self.voc_path):
+            with open(self.voc_path, "rb") as f:
+                raw = f.read()
+            # Drop a tag whose line was not fully written
+            complete = raw.rfind(b"\n") + 1
+            if complete != len(raw):
+                _truncate(self.voc_path, complete)
+            self.vocabulary.extend(orjson.loads(line) for line in raw[:complete].splitlines())
+        self._codes = {tag: code for code, tag in enumerate(self.vocabulary)}
+
+    def _read_offsets(self) -> np.ndarray:
+        if not os.path.exists(self.off_path):
+            return np.zeros((0,), dtype=OFFSET_DTYPE)
+        return np.fromfile(self.off_path, dtype=OFFSET_DTYPE)
+
+    def load(self) -> Tuple[List[str], np.ndarray]:
+        """
+        Maps the stored rows into memory.
+
+        Returns: The stored texts and a read-only memory map of the
+            embeddings matrix. Deleted rows are included.
+        """
+        if self._count == 0:
+            return [], np.zeros((0, self.dim), dtype=self.dtype)
+        return self.texts(np.arange(self._count)), self._mapped()
+
+    def texts(self, rows: np.ndarray) -> List[str]:
+        """
+        Reads the texts of some rows from disk.
+
+        Args:
+            rows: The rows to read, in any order.
+
+        Returns: The texts of the rows.
+        """
+        if len(rows) == 0:
+            return []
+        ends = self._read_offsets()[:self._count]
+        with open(self.txt_path, "rb") as f:
+            raw = f.read(self._text_end)
+        rows = np.asarray(rows)
+        starts = np.zeros((len(rows),), dtype=OFFSET_DTYPE)
+        starts[rows > 0] = ends[rows[rows > 0] - 1]
+        return [
+            raw[start:end].decode("utf-8")
+            for start, end in zip(starts.tolist(), ends[rows].tolist(), strict=True)
+        ]
+
+    def timestamps(self) -> np.ndarray:
+        """
+        Returns: The time each row was added, in seconds since the epoch.
+        """
+        if not os.path.exists(self.ts_path):
+            return np.zeros((0,), dtype=TIMESTAMP_DTYPE)
+        return np.fromfile(self.ts_path, dtype=TIMESTAMP_DTYPE, count=self._count)
+
+    def tags(self) -> np.ndarray:
+        """
+        Returns: The tag codes of each row, one column per tag.
+        """
+        if not os.path.exists(self.tag_path):
+            return np.zeros((0, TAG_COUNT), dtype=TAG_DTYPE)
+        codes = np.fromfile(self.tag_path, dtype=TAG_DTYPE, count=self._count * TAG_COUNT)
+        return codes.reshape(-1, TAG_COUNT)
+
+    def code(self, tag: str) -> Optional[int]:
+        """
+        Returns: The code of a tag, None if no row was stored with it.
+        """
+        return self._codes.get(tag)
+
+    def encode_tags(self, tags: List[Tuple[str, ...]]) -> np.ndarray:
+        """
+        Gives a code to every tag, writing the tags that are new.
+
+        Args:
+            tags: The tags of each row.
+
+        Returns: The codes of the tags, one row per row of tags.
+        """
+        self._learn([tag for row in tags for tag in row])
+        return np.array(
+            [[self._codes[tag] for tag in row] for row in tags], dtype=TAG_DTYPE
+        ).reshape(-1, TAG_COUNT)
+
+    def _learn(self, tags: List[str]) -> None:
+        new = []
+        for tag in tags:
+            if tag not in self._codes:
+                self._codes[tag] = len(self.vocabulary)
+                self.vocabulary.append(tag)
+                new.append(tag)
+        if not new:
+            return
+        # Tags are written before the rows that use them
+        if self._voc_file is None:
+            self._voc_file = open(self.voc_path, "ab")
+        self._voc_file.write(b"".join(orjson.dumps(tag) + b"\n" for tag in new))
+        self._voc_file.flush()
+
+    def deleted(self) -> np.ndarray:
+        """
+        Returns: The rows that have been deleted.
+        """
+        if not os.path.exists(self.del_path):
+            return np.zeros((0,), dtype=ROW_DTYPE)
+        rows = np.fromfile(self.del_path, dtype=ROW_DTYPE)
+        return rows[rows < self._count]
+
+    def _mapped(self) -> np.ndarray:
+        if self._map is None or len(self._map) < self._count:
+            self._map = np.memmap(
+                self.vec_path,
+                dtype=self.dtype,
+                mode="r",
+                shape=(self._count, self.dim),
+            )
+        return self._map
+
+    def rows(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Reads rows of the embeddings matrix from disk.
+
+        Args:
+            indices: The rows to read.
+
+        Returns: A copy of the rows.
+        """
+        if len(indices) == 0:
+            return np.zeros((0, self.dim), dtype=self.dtype)
+        return np.array(self._mapped()[indices])
+
+    def _open(self):
+        if self._files is None:
+            self._files = tuple(
+                open(path, "ab")
+                for path in (self.txt_path, self.vec_path, self.ts_path, self.tag_path, self.off_path)
+            )
+        return self._files
+
+    def append(self, text: str, vector: np.ndarray) -> None:
+        """
+        Appends one row to the end of the storage.
+
+        Args:
+            text: The text of the row.
+            vector: The embedding of the row.
+
+        Returns: None
+        """
+        self.append_many([text], np.asarray(vector)[np.newaxis, :])
+
+    def append_many(self, texts: List[str], vectors: np.ndarray,
+                    timestamps: Optional[np.ndarray] = None,
+                    tags: Optional[np.ndarray] = None) -> None:
+        """
+        Appends rows to the end of the storage with one write per file.
+
+        Args:
+            texts: The texts of the rows.
+            vectors: The embeddings of the rows, one per text.
+            timestamps: The time each row was added, now by default.
+            tags: The tag codes of each row from `encode_tags`, empty by default.
+
+        Returns: None
+        """
+        if timestamps is None:
+            timestamps = np.full((len(texts),), time.time())
+        if tags is None:
+            tags = np.zeros((len(texts), TAG_COUNT), dtype=TAG_DTYPE)
+        txt_file, vec_file, ts_file, tag_file, off_file = self._open()
+        encoded = [text.encode("utf-8") for text in texts]
+        ends = self._text_end + np.cumsum([len(e) for e in encoded], dtype=OFFSET_DTYPE)
+
+        txt_file.write(b"".join(encoded))
+        txt_file.flush()
+        vec_file.write(np.asarray(vectors, dtype=self.dtype).reshape(len(texts), self.dim).tobytes())
+        vec_file.flush()
+        ts_file.write(np.asarray(timestamps, dtype=TIMESTAMP_DTYPE).tobytes())
+        ts_file.flush()
+        tag_file.write(np.asarray(tags, dtype=TAG_DTYPE).tobytes())
+        tag_file.flush()
+        # The offsets are written last and commit the rows
+        off_file.write(ends.astype(OFFSET_DTYPE).tobytes())
+        off_file.flush()
+        if len(texts):
+            self._text_end = int(ends[-1])
+        self._count += len(texts)
+
+    def delete(self, rows: np.ndarray) -> None:
+        """
+        Marks rows as deleted. Their space is reclaimed by compaction.
+
+        Args:
+            rows: The rows to delete.
+
+        Returns: None
+        """
+        if self._del_file is None:
+            self._del_file = open(self.del_path, "ab")
+        self._del_file.write(np.asarray(rows, dtype=ROW_DTYPE).tobytes())
+        self._del_file.flush()
+
+    def copy_rows(self, rows: np.ndarray, target: "AppendOnlyStorage") -> None:
+        """
+        Appends some rows of this storage to another one, in batches. The
+        target must be empty or a copy, so that tags keep their codes.
+
+        Args:
+            rows: The rows to copy, in the order they are appended.
+            target: The storage the rows are appended to.
+
+        Returns: None
+        """
+        target._learn(self.vocabulary[len(target.vocabulary):])
+        timestamps = self.timestamps()
+        tags = self.tags()
+        for start in range(0, len(rows), COPY_BATCH_ROWS):
+            batch = rows[start:start + COPY_BATCH_ROWS]
+            target.append_many(self.texts(batch), self.rows(batch), timestamps[batch], tags[batch])
+
+    def replace_with(self, other: "AppendOnlyStorage") -> None:
+        """
+        Moves the files of another storage over the files of this one.
+
+        Args:
+            other: The storage whose files replace ours. It is empty after.
+
+        Returns: None
+        """
+        self.close()
+        other.close()
+        self._map = None
+        for ours, theirs in zip(self.paths, other.paths, strict=True):
+            if os.path.exists(theirs):
+                os.replace(theirs, ours)
+            elif os.path.exists(ours):
+                os.remove(ours)
+        self._repair()
+        other._repair()
+
+    def clear(self) -> None:
+        """
+        Removes every row from the storage.
+
+        Returns: None
+        """
+        self.close()
+        self._map = None
+        for path in self.paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self._count = 0
+        self._text_end = 0
+        self.vocabulary = [""]
+        self._codes = {"": 0}
+
+    def close(self) -> None:
+        """
+        Closes the open file handles, if any.
+
+        Returns: None
+        """
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+            self._files = None
+        if self._del_file is not None:
+            self._del_file.close()
+            self._del_file = None
+        if self._voc_file is not None:
+            self._voc_file.close()
+            self._voc_file = None
+
+    def size_on_disk(self) -> int:
+        """
+        Returns: The total size of the storage files in bytes.
+        """
+        return sum(_file_size(path) for path in self.paths)
+
+
+def import_json_cache(json_path: str, storage: AppendOnlyStorage) -> int:
+    """
+    Imports a cache written by the old JSON format of the local memory.
+
+    Args:
+        json_path: The path of the `{memory_index}.json` file.
+        storage: The storage to append the imported rows to.
+
+    Returns: The number of imported rows.
+    """
+    with open(json_path, "rb") as f:
+        content = f.read()
+    if not content.strip():
+        return 0
+
+    loaded = orjson.loads(content)
+    texts = loaded.get("texts", [])
+    embeddings = np.asarray(loaded.get("embeddings", []), dtype=storage.dtype)
+    embeddings = embeddings.reshape(-1, storage.dim)
+    count = min(len(texts), len(embeddings))
+    storage.append_many(texts[:count], embeddings[:count])
+    return count
+
+
+def _file_size(path: str) -> int:
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def _truncate(path: str, size: int) -> None:
+    if os.path.exists(path):
+        with open(path, "r+b") as f:
+            f.truncate(size)
+
+
+def _resize(path: str, current: int, size: int) -> None:
+    """Truncates a file, or pads it with zero bytes, to `size` bytes."""
+    if current > size:
+        _truncate(path, size)
+    elif current < size:
+        with open(path, "ab") as f:
+            f.write(bytes(size - current))
@@ -0,0 +1,141 @@
+"""Buffered, chunked upserts to a vector index."""
+import atexit
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+# An upsert item: the vector id, its values and its metadata
+Item = Tuple[str, List[float], dict]
+
+
+class UpsertBuffer:
+    """
+    Collects vectors for an index exposing `upsert(items)`, such as a
+    `pinecone.Index`, and upserts them in chunks of `chunk_size` items.
+
+    A flusher thread writes the buffer once a full chunk is waiting or
+    once its oldest item has waited `flush_interval` seconds. `flush`
+    writes it right away; providers call it before every query so that
+    reads see every earlier write.
+    """
+
+    def __init__(self, index: Any, chunk_size: int = 100, flush_interval: float = 1.0) -> None:
+        """
+        Initializes the buffer and starts the flusher thread.
+
+        Args:
+            index: The index the vectors are upserted to.
+            chunk_size: The number of items sent per upsert request.
+            flush_interval: The seconds an item may wait before a flush.
+
+        Returns: None
+        """
+        self.index = index
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.upserts = 0
+        self.upserted = 0
+        self._pending: List[Item] = []
+        self._queued_at: Optional[float] = None
+        self._closed = False
+        self._condition = threading.Condition()
+        # Keeps the chunks of concurrent flushes in order
+        self._write_lock = threading.Lock()
+        self._flusher = threading.Thread(target=self._run, name="upsert-buffer", daemon=True)
+        self._flusher.start()
+        atexit.register(self.close)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, items: List[Item]) -> None:
+        """
+        Buffers items to upsert.
+
+        Args:
+            items: The (id, values, metadata) of each vector.
+
+        Returns: None
+        """
+        if not items:
+            return
+        with self._condition:
+            if not self._pending:
+                self._queued_at = time.monotonic()
+            self._pending.extend(items)
+            self._condition.notify()
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        return (len(self._pending) >= self.chunk_size
+                or time.monotonic() - self._queued_at >= self.flush_interval)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and not self._due():
+                    timeout = None
+                    if self._pending:
+                        timeout = self._queued_at + self.flush_interval - time.monotonic()
+                    self._condition.wait(timeout)
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception as e:
+                print("Error upserting buffered vectors: ", e)
+                if not closed:
+                    time.sleep(self.flush_interval)
+            if closed:
+                return
+
+    def flush(self) -> None:
+        """
+        Upserts every buffered item before returning. Items of a failed
+        request are buffered again and the error is raised.
+
+        Returns: None
+        """
+        with self._write_lock:
+            with self._condition:
+                batch = self._pending
+                self._pending = []
+                self._queued_at = None
+            for start in range(0, len(batch), self.chunk_size):
+                try:
+                    self.index.upsert(batch[start:start + self.chunk_size])
+                except Exception:
+                    with self._condition:
+                        self._pending[:0] = batch[start:]
+                        self._queued_at = time.monotonic()
+                    raise
+                self.upserts += 1
+                self.upserted += len(batch[start:start + self.chunk_size])
+
+    def clear(self) -> None:
+        """
+        Drops the buffered items.
+
+        Returns: None
+        """
+        with self._write_lock, self._condition:
+            self._pending = []
+            self._queued_at = None
+
+    def close(self) -> None:
+        """
+        Flushes the buffer and stops the flusher thread.
+
+        Returns: None
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._flusher.join()
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._pending),
+            "upserts": self.upserts,
+            "upserted": self.upserted,
+        }
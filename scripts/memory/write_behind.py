@@ -0,0 +1,221 @@
+"""Write-behind ingestion in front of a memory provider."""
+import atexit
+import contextlib
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+from memory.base import MemoryProviderSingleton, get_flax_embeddings
+from memory.metadata import MemoryFilter, MemoryMetadata, metadata_list
+
+
+class WriteBehindMemory(MemoryProviderSingleton):
+    """
+    Queues added data and writes it to the wrapped provider from a worker
+    thread, in batches through `add_many`. A batch is flushed once it holds
+    `flush_size` items, once its oldest item has waited `flush_interval`
+    seconds, and at shutdown.
+
+    Queued items stay visible to reads: a read that may match queued items
+    first waits for them to be written, so that every result is ranked by
+    the wrapped provider, with its own scoring and filters.
+    """
+
+    def __init__(self, memory: MemoryProviderSingleton, flush_size: int = 16,
+                 flush_interval: float = 2.0) -> None:
+        """
+        Initializes the queue and starts the worker thread.
+
+        Args:
+            memory: The provider the data is written to.
+            flush_size: The number of queued items that triggers a flush.
+            flush_interval: The seconds an item may wait before a flush.
+
+        Returns: None
+        """
+        self.memory = memory
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.flushed = 0
+        self.batches = 0
+        # Items ever queued, and items written or dropped by `clear`
+        self._queued = 0
+        self._done = 0
+        # Items are only dropped from `_pending` once they have been written
+        self._pending: List[Tuple[str, MemoryMetadata]] = []
+        self._queued_at: Optional[float] = None
+        self._in_flight = 0
+        self._flush_requested = False
+        self._closed = False
+        self._condition = threading.Condition()
+        # Serializes writes and reads of providers that are not thread-safe
+        if getattr(memory, "thread_safe", False):
+            self._memory_lock = contextlib.nullcontext()
+        else:
+            self._memory_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="memory-write-behind", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def add(self, data: str, metadata: Optional[MemoryMetadata] = None) -> str:
+        """
+        Queues a data point to be added to the memory.
+
+        Args:
+            data: The data to add.
+            metadata: Where the data comes from, stamped with the time it
+                was queued.
+
+        Returns: The queued data, or an empty string for skipped data.
+        """
+        return self.add_many([data], metadata)[0]
+
+    def add_many(self, texts: List[str], metadata=None) -> List[str]:
+        items = [
+            (text, item)
+            for text, item in zip(texts, metadata_list(metadata, len(texts)), strict=True)
+            if 'Command Error:' not in text
+        ]
+        if items:
+            with self._condition:
+                if not self._pending:
+                    self._queued_at = time.monotonic()
+                self._pending.extend(items)
+                self._queued += len(items)
+                self._condition.notify()
+        return [text if 'Command Error:' not in text else "" for text in texts]
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed and not self._should_flush():
+                    timeout = None
+                    if self._pending:
+                        timeout = self._queued_at + self.flush_interval - time.monotonic()
+                    self._condition.wait(timeout)
+                if self._closed and not self._pending:
+                    return
+                batch = self._pending[:]
+                self._in_flight = len(batch)
+            self._write(batch)
+
+    def _should_flush(self) -> bool:
+        if not self._pending:
+            return False
+        return (self._flush_requested
+                or len(self._pending) >= self.flush_size
+                or time.monotonic() - self._queued_at >= self.flush_interval)
+
+    def _write(self, batch: List[Tuple[str, MemoryMetadata]]) -> None:
+        texts = [text for text, _ in batch]
+        try:
+            # Embed outside the lock, the provider then hits the embedding cache
+            get_flax_embeddings(texts)
+            with self._memory_lock:
+                self.memory.add_many(texts, [metadata for _, metadata in batch])
+        except Exception as e:
+            print("Error writing queued memories: ", e)
+        with self._condition:
+            del self._pending[:len(batch)]
+            self._queued_at = time.monotonic() if self._pending else None
+            self._in_flight = 0
+            self.flushed += len(batch)
+            self._done += len(batch)
+            self.batches += 1
+            self._condition.notify_all()
+
+    def flush(self) -> None:
+        """
+        Blocks until every item queued so far has been written.
+
+        Returns: None
+        """
+        with self._condition:
+            # Items queued while waiting are left to the next flush
+            target = self._queued
+            self._flush_requested = True
+            self._condition.notify_all()
+            while self._done < target and self._worker.is_alive():
+                self._condition.wait()
+            self._flush_requested = False
+
+    def close(self) -> None:
+        """
+        Flushes the queue and stops the worker thread.
+
+        Returns: None
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join()
+
+    def get(self, data: str) -> Optional[List[Any]]:
+        """
+        Gets the data from the memory that is most relevant to the given data.
+
+        Args:
+            data: The data to compare to.
+
+        Returns: The most relevant data.
+        """
+        return self.get_relevant(data, 1)
+
+    def get_relevant(self, data: str, num_relevant: int = 5,
+                     filters: Optional[MemoryFilter] = None) -> Optional[List[Any]]:
+        """
+        Returns the data most relevant to the given data, including queued
+        data that has not been written yet.
+
+        Args:
+            data: The data to compare to.
+            num_relevant: The number of relevant data to return.
+            filters: The metadata the data must match.
+
+        Returns: A list of the most relevant data.
+        """
+        self._flush_matching(filters)
+        with self._memory_lock:
+            return self.memory.get_relevant(data, num_relevant, filters)
+
+    def get_relevant_many(self, queries: List[str], num_relevant: int = 5,
+                          filters: Optional[MemoryFilter] = None) -> List[Optional[List[Any]]]:
+        self._flush_matching(filters)
+        with self._memory_lock:
+            return self.memory.get_relevant_many(queries, num_relevant, filters)
+
+    def _flush_matching(self, filters: Optional[MemoryFilter]) -> None:
+        with self._condition:
+            matching = any(filters is None or filters.matches(metadata) for _, metadata in self._pending)
+        if matching:
+            self.flush()
+
+    def clear(self) -> str:
+        """
+        Drops the queued data and clears the wrapped memory.
+
+        Returns: A message indicating that the memory has been cleared.
+        """
+        with self._condition:
+            while self._in_flight:
+                self._condition.wait()
+            self._done += len(self._pending)
+            self._pending.clear()
+            self._queued_at = None
+        with self._memory_lock:
+            return self.memory.clear()
+
+    def get_stats(self):
+        """
+        Returns: The stats of the wrapped memory and of the queue.
+        """
+        with self._memory_lock:
+            stats = self.memory.get_stats()
+        stats = dict(stats) if stats else {}
+        with self._condition:
+            stats["write_behind"] = {
+                "pending": len(self._pending),
+                "flushed": self.flushed,
+                "batches": self.batches,
+            }
+        return stats
@@ -0,0 +1,102 @@
+"""A message history bounded by the tokens its messages take."""
+from typing import Callable, Dict, Iterator, List, Optional
+
+from token_counter import count_tokens
+
+# Tokens a message takes besides its content, such as its role and separators
+MESSAGE_OVERHEAD = 4
+
+
+def message_tokens(message: Dict[str, str]) -> int:
+    """
+    Returns: The estimated tokens of a chat message.
+    """
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+class MessageHistory:
+    """
+    The messages exchanged with the AI, used like a list.
+
+    Once the messages take more than `token_limit` tokens, the oldest ones
+    are evicted until they take at most `low_water` of the limit, so that
+    evictions happen in batches rather than on every message. The newest
+    message is always kept. Evicted messages are handed to `on_evict`,
+    which may store them elsewhere, such as in long-term memory.
+    """
+
+    def __init__(self, token_limit: int,
+                 on_evict: Optional[Callable[[List[Dict[str, str]]], None]] = None,
+                 low_water: float = 0.75) -> None:
+        """
+        Initializes an empty history.
+
+        Args:
+            token_limit: The tokens the messages may take, 0 for no limit.
+            on_evict: Called with the messages evicted, oldest first.
+            low_water: The share of the limit kept after an eviction.
+
+        Returns: None
+        """
+        self.token_limit = token_limit
+        self.on_evict = on_evict
+        self.low_water = low_water
+        self._messages: List[Dict[str, str]] = []
+        self._tokens: List[int] = []
+        self.tokens = 0
+        self.evicted = 0
+
+    def append(self, message: Dict[str, str]) -> None:
+        self._messages.append(message)
+        self._tokens.append(message_tokens(message))
+        self.tokens += self._tokens[-1]
+        if 0 < self.token_limit < self.tokens:
+            self._evict()
+
+    def extend(self, messages) -> None:
+        for message in messages:
+            self.append(message)
+
+    def _evict(self) -> None:
+        target = int(self.token_limit * self.low_water)
+        count = 0
+        while count < len(self._messages) - 1 and self.tokens > target:
+            self.tokens -= self._tokens[count]
+            count += 1
+        evicted = self._messages[:count]
+        del self._messages[:count]
+        del self._tokens[:count]
+        self.evicted += count
+        if evicted and self.on_evict is not None:
+            try:
+                self.on_evict(evicted)
+            except Exception as e:
+                print("Error storing evicted messages: ", e)
+
+    def clear(self) -> None:
+        self._messages.clear()
+        self._tokens.clear()
+        self.tokens = 0
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        return iter(self._messages)
+
+    def __repr__(self) -> str:
+        return repr(self._messages)
+
+    def stats(self) -> dict:
+        """
+        Returns: The size of the history and the messages evicted from it.
+        """
+        return {
+            "messages": len(self._messages),
+            "tokens": self.tokens,
+            "token_limit": self.token_limit,
+            "evicted": self.evicted,
+        }
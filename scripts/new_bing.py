@@ -1,43 +1,270 @@
+"""
+Client of the New Bing chat AI.
+
+Every request runs on one event loop living in a background thread, so
+the websockets of a Chatbot stay usable across calls and requests from
+several threads can be in flight at once. Coroutines (`anew_bot`,
+`aask_question`, ...) can be awaited on that loop, through `submit`; the
+functions without the `a` prefix are thread-safe wrappers that block
+until the reply arrives.
+"""
 import asyncio
+import concurrent.futures
+import queue
+import weakref
 
 import EdgeGPT
+from chatbot_pool import ChatbotPool
 from config import Config
+from event_loop import BackgroundLoop
+from request_governor import RequestGovernor
 
+_background = BackgroundLoop("new-bing")
 
-def new_bot():
-    cfg = Config()
-    return EdgeGPT.Chatbot(cfg.new_bing_cookies_path, proxy=cfg.proxy_url)
+# Sessions for one-shot questions, created on the event loop on first use
+_pool = None
+# Paces and retries every question, created on the event loop on first use
+_governor = None
 
+NO_RESPONSE = "No response"
 
-def ask_question(question, chatbot, conversation_style=EdgeGPT.ConversationStyle.creative) -> str:
-    response = asyncio.run(chatbot.ask(question, conversation_style=conversation_style))
+# A Chatbot holds one conversation, so its questions are asked one at a time
+_bot_locks = weakref.WeakKeyDictionary()
+
+
+def submit(coro) -> concurrent.futures.Future:
+    """
+    Schedules a coroutine of this module on the New Bing event loop, to
+    start requests from synchronous code without waiting for them.
+
+    Args:
+    coro: The coroutine, such as `aask_question_once(question)`.
+
+    Returns:
+    Future: The future of its result.
+    """
+    return _background.submit(coro)
+
+
+def _bot_lock(chatbot) -> asyncio.Lock:
+    lock = _bot_locks.get(chatbot)
+    if lock is None:
+        lock = _bot_locks[chatbot] = asyncio.Lock()
+    return lock
+
+
+def _session_pool() -> ChatbotPool:
+    global _pool
+    if _pool is None:
+        cfg = Config()
+        _pool = ChatbotPool(
+            anew_bot, aclose_bot,
+            size=cfg.new_bing_pool_size,
+            max_uses=cfg.new_bing_pool_max_uses,
+            max_age=cfg.new_bing_pool_max_age,
+        )
+    return _pool
+
+
+def pool_stats() -> dict:
+    """The checkouts, waits and session creations of the one-shot pool."""
+    return _pool.stats() if _pool is not None else {}
+
+
+def _request_governor() -> RequestGovernor:
+    global _governor
+    if _governor is None:
+        cfg = Config()
+        _governor = RequestGovernor(
+            rate=cfg.llm_rate_limit,
+            burst=cfg.llm_burst,
+            max_concurrency=cfg.llm_max_concurrency,
+            retries=cfg.llm_retries,
+            base_delay=cfg.llm_retry_base_delay,
+            max_delay=cfg.llm_retry_max_delay,
+            failure_threshold=cfg.llm_circuit_failures,
+            reset_timeout=cfg.llm_circuit_reset,
+        )
+    return _governor
+
+
+def governor_stats() -> dict:
+    """The waits, retries and open-circuit periods of the questions asked."""
+    return _governor.stats() if _governor is not None else {}
+
+
+def retry_after() -> float:
+    """The seconds until questions are sent again after too many failures, 0 if they are."""
+    return _governor.retry_after if _governor is not None else 0.0
+
+
+def _governed(attempt):
+    """Asks through the governor, retrying empty replies like errors."""
+    return _request_governor().call(attempt, failed=lambda reply: reply == NO_RESPONSE)
+
+
+async def _governed_conversation(attempt, chatbot) -> str:
+    """
+    Asks through the governor in the conversation of a chatbot. The question
+    is not retried, as every attempt would add it to the conversation again.
+    An empty reply, such as once the conversation reached its turn limit,
+    starts a new conversation for the next question instead.
+    """
+    reply = await _request_governor().call(attempt, retries=0)
+    if reply == NO_RESPONSE:
+        print("No reply in the conversation, starting a new one. The AI loses what it was told so far.")
+        async with _bot_lock(chatbot):
+            await chatbot.reset()
+    return reply
+
+
+def _reply_text(response) -> str:
     try:
         return response["item"]["messages"][1]["text"]  # TODO: Check "firstNewMessageIndex"
     except KeyError:
         try:
             return response["item"]["messages"][1]["hiddenText"]
         except KeyError:
-            return "No response"
-    except IndexError:
-        return "No response"
+            return NO_RESPONSE
+    except (IndexError, TypeError):
+        return NO_RESPONSE
+
+
+def _messages_question(messages) -> str:
+    question = ""
+    for msg in messages:
+        question += f"<|start|>{msg['role']}\n{msg['content']}<|end|>\n"
+    return question
+
+
+async def anew_bot():
+    cfg = Config()
+    loop = asyncio.get_running_loop()
+    # Creating the conversation is a blocking HTTP request
+    return await loop.run_in_executor(
+        None, lambda: EdgeGPT.Chatbot(cfg.new_bing_cookies_path, proxy=cfg.proxy_url))
+
+
+async def _ask(question, chatbot, conversation_style) -> str:
+    async with _bot_lock(chatbot):
+        response = await chatbot.ask(question, conversation_style=conversation_style)
+    return _reply_text(response)
+
+
+async def aask_question(question, chatbot, conversation_style=EdgeGPT.ConversationStyle.creative) -> str:
+    return await _governed_conversation(lambda: _ask(question, chatbot, conversation_style), chatbot)
+
+
+async def aask_question_stream(question, chatbot, updates,
+                               conversation_style=EdgeGPT.ConversationStyle.creative) -> str:
+    """
+    Asks a question, passing the reply to `updates` as it is generated.
+
+    Args:
+    question (str): The question.
+    chatbot: The bot to ask.
+    updates (callable): Called with the whole reply so far on every update.
+    conversation_style: The EdgeGPT conversation style.
+
+    Returns:
+    str: The reply.
+    """
+    async def attempt():
+        async with _bot_lock(chatbot):
+            response = None
+            async for final, update in chatbot.ask_stream(question, conversation_style=conversation_style):
+                if final:
+                    response = update
+                elif update:
+                    updates(update)
+        return _reply_text(response)
+
+    return await _governed_conversation(attempt, chatbot)
+
+
+async def aask_question_once(question, conversation_style=EdgeGPT.ConversationStyle.creative) -> str:
+    async def attempt():
+        # A session whose question raised is recycled, so retries get a new one
+        async with _session_pool().session() as chatbot:
+            reply = await _ask(question, chatbot, conversation_style)
+            if reply == NO_RESPONSE:
+                # Likely dead or throttled, do not hand it out again
+                _session_pool().discard(chatbot)
+            return reply
+
+    return await _governed(attempt)
+
+
+async def aask_messages(messages, conversation_style=EdgeGPT.ConversationStyle.creative) -> str:
+    return await aask_question_once(_messages_question(messages), conversation_style=conversation_style)
+
+
+async def aclose_bot(chatbot):
+    await chatbot.close()
+
+
+def new_bot():
+    return _background.run(anew_bot())
+
+
+def ask_question(question, chatbot, conversation_style=EdgeGPT.ConversationStyle.creative) -> str:
+    return _background.run(aask_question(question, chatbot, conversation_style=conversation_style))
+
+
+class StreamedReply:
+    """
+    A reply being generated. Iterating it yields the whole reply so far on
+    every update, and `result` waits for the final reply. The reply keeps
+    being received when the iteration stops early.
+    """
+
+    _END = object()
+
+    def __init__(self, question, chatbot, conversation_style) -> None:
+        self._updates = queue.Queue()
+        self._future = submit(self._receive(question, chatbot, conversation_style))
+
+    async def _receive(self, question, chatbot, conversation_style) -> str:
+        try:
+            return await aask_question_stream(question, chatbot, self._updates.put,
+                                              conversation_style=conversation_style)
+        finally:
+            self._updates.put(self._END)
+
+    def __iter__(self):
+        while True:
+            update = self._updates.get()
+            if update is self._END:
+                # Let a later iteration see the end as well
+                self._updates.put(self._END)
+                return
+            yield update
+
+    def result(self, timeout=None) -> str:
+        return self._future.result(timeout)
+
+    def add_done_callback(self, callback) -> None:
+        """Calls `callback` with the future of the reply once it is received or failed."""
+        self._future.add_done_callback(callback)
+
+
+def stream_question(question, chatbot, conversation_style=EdgeGPT.ConversationStyle.creative) -> StreamedReply:
+    return StreamedReply(question, chatbot, conversation_style)
 
 
 def ask_question_once(question, conversation_style=EdgeGPT.ConversationStyle.creative) -> str:
-    chatbot = new_bot()
-    response = ask_question(question, chatbot, conversation_style=conversation_style)
-    close_bot(chatbot)
-    return response
+    return _background.run(aask_question_once(question, conversation_style=conversation_style))
 
 
 def ask_messages(messages, conversation_style=EdgeGPT.ConversationStyle.creative) -> str:
-    question = ""
-    for msg in messages:
-        question += f"<|start|>{msg['role']}\n{msg['content']}<|end|>\n"
-    chatbot = new_bot()
-    response = ask_question(question, chatbot, conversation_style=conversation_style)
-    close_bot(chatbot)
-    return response
+    return _background.run(aask_messages(messages, conversation_style=conversation_style))
 
 
 def close_bot(chatbot):
-    asyncio.run(chatbot.close())
+    _background.run(aclose_bot(chatbot))
+
+
+def close_sessions():
+    """Closes the idle sessions of the one-shot pool."""
+    if _pool is not None:
+        _background.run(_pool.close())
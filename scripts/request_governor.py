@@ -0,0 +1,225 @@
+"""Rate limiting, retries and circuit breaking for requests to the AI."""
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while the circuit is open."""
+
+
+class TokenBucket:
+    """
+    Lets through `rate` requests per second on average, and bursts of up
+    to `burst` requests after a quiet period.
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> float:
+        """
+        Waits for a token.
+
+        Returns: The seconds waited.
+        """
+        if self.rate <= 0:
+            return 0.0
+        # Requests take their tokens in arrival order
+        async with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                self._updated = time.monotonic()
+                self._tokens = 1.0
+            self._tokens -= 1
+        return wait
+
+
+class RequestGovernor:
+    """
+    Sends every request through a token bucket and a concurrency cap,
+    retries failed attempts after a jittered exponential backoff, and
+    stops sending requests for `reset_timeout` seconds once
+    `failure_threshold` attempts failed in a row. After that pause one
+    request probes the AI; the circuit closes again if it succeeds.
+
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, rate: float = 1.0, burst: int = 5, max_concurrency: int = 4,
+                 retries: int = 3, base_delay: float = 1.0, max_delay: float = 30.0,
+                 failure_threshold: int = 5, reset_timeout: float = 60.0) -> None:
+        """
+        Initializes the governor.
+
+        Args:
+            rate: The requests per second, 0 for no limit.
+            burst: The requests that may be sent at once after a pause.
+            max_concurrency: The most requests in flight.
+            retries: The retries of a failed request.
+            base_delay: The seconds before the first retry, doubled on
+                every retry.
+            max_delay: The most seconds between retries.
+            failure_threshold: The failed attempts in a row that open the
+                circuit, 0 to never open it.
+            reset_timeout: The seconds the circuit stays open.
+
+        Returns: None
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max(max_concurrency, 1)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self.requests = 0
+        self.attempts = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.circuit_opened = 0
+        self.open_seconds = 0.0
+        self.rate_wait_seconds = 0.0
+        self.concurrency_wait_seconds = 0.0
+        self.backoff_seconds = 0.0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.reset_timeout:
+            return "open"
+        return "half-open"
+
+    @property
+    def retry_after(self) -> float:
+        """The seconds until an open circuit lets a probe through, 0 if it is not open."""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def _admit(self) -> Optional[bool]:
+        """
+        Returns: None if the attempt may not be sent, else whether it is
+            the probe of a half-open circuit.
+        """
+        state = self.state
+        if state == "closed":
+            return False
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return None
+
+    def _record(self, success: bool, probe: bool) -> None:
+        if probe:
+            self._probing = False
+        if success:
+            self._failures = 0
+            if self._opened_at is not None:
+                self.open_seconds += time.monotonic() - self._opened_at
+                self._opened_at = None
+            return
+        self._failures += 1
+        if probe or (self.failure_threshold > 0 and self._opened_at is None
+                     and self._failures >= self.failure_threshold):
+            if self._opened_at is not None:
+                self.open_seconds += time.monotonic() - self._opened_at
+            else:
+                self.circuit_opened += 1
+            self._opened_at = time.monotonic()
+
+    def _backoff(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+    async def _attempt(self, request: Callable[[], Awaitable[Any]]) -> Any:
+        self.rate_wait_seconds += await self.bucket.acquire()
+        start = time.perf_counter()
+        async with self._slots:
+            self.concurrency_wait_seconds += time.perf_counter() - start
+            self.attempts += 1
+            return await request()
+
+    async def call(self, request: Callable[[], Awaitable[Any]],
+                   failed: Callable[[Any], bool] = lambda result: False,
+                   retries: Optional[int] = None) -> Any:
+        """
+        Sends a request, retrying it on failure.
+
+        Args:
+            request: Starts an attempt of the request, called once per
+                attempt.
+            failed: Whether the result of an attempt is a failure, such
+                as an empty reply from a throttled AI.
+            retries: The retries of this request, `self.retries` if None.
+
+        Returns: The result of the first successful attempt, or of the
+            last attempt if it failed without raising.
+        """
+        retries = self.retries if retries is None else retries
+        self.requests += 1
+        for retry in range(retries + 1):
+            if retry > 0:
+                self.retried += 1
+                delay = self._backoff(retry - 1)
+                self.backoff_seconds += delay
+                await asyncio.sleep(delay)
+            probe = self._admit()
+            if probe is None:
+                self.rejected += 1
+                raise CircuitOpenError(
+                    f"The AI failed {self._failures} times in a row, not asking it "
+                    f"for {self.reset_timeout:.0f} seconds")
+            try:
+                result = await self._attempt(request)
+            except Exception as e:
+                self._record(False, probe)
+                error = e
+                print(f"Error asking the AI, attempt {retry + 1} of {retries + 1}: {e}")
+                continue
+            except BaseException:
+                # Cancelled, let another request probe
+                if probe:
+                    self._probing = False
+                raise
+            if not failed(result):
+                self._record(True, probe)
+                return result
+            self._record(False, probe)
+            error = None
+        self.failed += 1
+        if error is not None:
+            raise error
+        return result
+
+    def stats(self) -> dict:
+        open_seconds = self.open_seconds
+        if self._opened_at is not None:
+            open_seconds += time.monotonic() - self._opened_at
+        return {
+            "state": self.state,
+            "requests": self.requests,
+            "attempts": self.attempts,
+            "retries": self.retried,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "circuit_opened": self.circuit_opened,
+            "open_seconds": open_seconds,
+            "rate_wait_seconds": self.rate_wait_seconds,
+            "concurrency_wait_seconds": self.concurrency_wait_seconds,
+            "backoff_seconds": self.backoff_seconds,
+        }
@@ -0,0 +1,161 @@
+"""Content-addressed cache of AI responses, stored in an SQLite file."""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Optional
+
+
+class ResponseCache:
+    """
+    A cache of responses keyed by a hash of the request, kept in an SQLite
+    file so that it survives restarts.
+
+    Responses expire `ttl` seconds after they were stored. Once the stored
+    responses take more than `max_bytes`, the least recently used ones are
+    evicted. Responses are stored compressed, and the file gives the space
+    of evicted rows back.
+    """
+
+    def __init__(self, path: str, ttl: float = 7 * 24 * 3600, max_bytes: int = 64 * 1024 * 1024) -> None:
+        """
+        Opens the cache, creating its file if needed.
+
+        Args:
+            path: The SQLite file.
+            ttl: The seconds a response is served for, 0 for no limit.
+            max_bytes: The compressed size the responses are bounded to.
+
+        Returns: None
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # Must be set before the first table is created to take effect
+        self._db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key BLOB PRIMARY KEY, response BLOB, size INTEGER, created_at REAL, used_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        self._db.commit()
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(*parts: Any) -> bytes:
+        """
+        Returns: The key of a request made of JSON serializable parts.
+        """
+        return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[str]:
+        """
+        Looks up a response, dropping it if it expired.
+
+        Args:
+            key: The key of the request, see `key`.
+
+        Returns: The response, or None on a miss.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response, size, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl > 0 and now - row[2] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                self._bytes -= row[1]
+                self.expired += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, key: bytes, response: str) -> None:
+        """
+        Stores a response, evicting the least recently used ones beyond
+        the size bound.
+
+        Args:
+            key: The key of the request, see `key`.
+            response: The response.
+
+        Returns: None
+        """
+        data = zlib.compress(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._forget(key)
+            self._db.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?)", (key, data, len(data), now, now)
+            )
+            self._bytes += len(data)
+            if self._bytes > self.max_bytes:
+                self._evict()
+            self._db.commit()
+
+    def discard(self, key: bytes) -> None:
+        """
+        Drops a response, such as one found to be unusable.
+
+        Args:
+            key: The key of the request, see `key`.
+
+        Returns: None
+        """
+        with self._lock:
+            self._forget(key)
+            self._db.commit()
+
+    def _forget(self, key: bytes) -> None:
+        row = self._db.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._bytes -= row[0]
+
+    def _evict(self) -> None:
+        freed = 0
+        keys = []
+        # Expired responses go first, then the least recently used ones
+        for key, size in self._db.execute(
+            "SELECT key, size FROM responses ORDER BY created_at >= ? OR ? <= 0, used_at",
+            (time.time() - self.ttl, self.ttl),
+        ):
+            if self._bytes - freed <= self.max_bytes:
+                break
+            keys.append((key,))
+            freed += size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", keys)
+        self._db.execute("PRAGMA incremental_vacuum")
+        self._bytes -= freed
+        self.evicted += len(keys)
+
+    def stats(self) -> dict:
+        """
+        Returns: The hit and miss counters and the size of the cache.
+        """
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "entries": entries,
+            "bytes": self._bytes,
+        }
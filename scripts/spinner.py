@@ -30,6 +30,12 @@ class Spinner:
 
     def __exit__(self, exc_type, exc_value, exc_traceback):
         """Stop the spinner"""
+        self.stop()
+
+    def stop(self):
+        """Stop the spinner before the end of the block, such as to print"""
+        if not self.running:
+            return
         self.running = False
         self.spinner_thread.join()
         sys.stdout.write('\r' + ' ' * (len(self.message) + 2) + '\r')
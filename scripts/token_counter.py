@@ -0,0 +1,49 @@
+"""Estimates of how many tokens a text takes in the AI's context."""
+import re
+
+# Runs of ASCII letters, runs of digits, and any other single character
+# that is not whitespace, such as punctuation or a CJK character
+_PIECES = re.compile(r"[A-Za-z]+|[0-9]+|[^\sA-Za-z0-9]")
+
+# Byte pair encodings take about four letters or three digits per token
+_LETTERS_PER_TOKEN = 4
+_DIGITS_PER_TOKEN = 3
+
+
+def count_tokens(text: str) -> int:
+    """
+    Estimates the number of tokens of a text, erring on the high side for
+    English so that budgets built on it are not exceeded.
+
+    Args:
+        text: The text to count.
+
+    Returns: The estimated number of tokens.
+    """
+    tokens = 0
+    for piece in _PIECES.findall(text):
+        per_token = _DIGITS_PER_TOKEN if piece.isdigit() else _LETTERS_PER_TOKEN
+        # Rounded up, so single characters count as a token
+        tokens += -(-len(piece) // per_token)
+    return tokens
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cuts a text to at most `max_tokens` estimated tokens.
+
+    Args:
+        text: The text to cut.
+        max_tokens: The tokens the text may take.
+
+    Returns: The longest prefix of the text within the budget, ending at
+        a whole piece.
+    """
+    tokens = 0
+    for match in _PIECES.finditer(text):
+        piece = match.group()
+        per_token = _DIGITS_PER_TOKEN if piece.isdigit() else _LETTERS_PER_TOKEN
+        tokens += -(-len(piece) // per_token)
+        if tokens > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
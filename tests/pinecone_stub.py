@@ -0,0 +1,51 @@
+"""An in-process stand-in for a Pinecone index, for tests and benchmarks."""
+import numpy as np
+from memory.base import top_k_indices
+
+
+class StubIndex:
+    """An in-process stand-in for `pinecone.Index` with exact cosine search."""
+
+    def __init__(self):
+        self.ids = {}
+        self.vectors = []
+        self.metadata = []
+
+    def upsert(self, items):
+        for vector_id, values, metadata in items:
+            if vector_id in self.ids:
+                row = self.ids[vector_id]
+                self.vectors[row], self.metadata[row] = values, metadata
+            else:
+                self.ids[vector_id] = len(self.vectors)
+                self.vectors.append(values)
+                self.metadata.append(metadata)
+
+    def query(self, vector, top_k, include_metadata=False):
+        if not self.vectors:
+            return StubResult([])
+        scores = np.dot(np.asarray(self.vectors, dtype=np.float32), np.asarray(vector, dtype=np.float32))
+        return StubResult([
+            StubMatch(score=float(scores[i]), metadata=self.metadata[i])
+            for i in top_k_indices(scores, top_k)
+        ])
+
+    def delete(self, deleteAll=False):
+        self.ids, self.vectors, self.metadata = {}, [], []
+
+    def describe_index_stats(self):
+        return StubResult([], total_vector_count=len(self.vectors))
+
+
+class StubMatch(dict):
+    """A query match, readable as attributes like Pinecone's."""
+    __getattr__ = dict.__getitem__
+
+
+class StubResult:
+    def __init__(self, matches, **stats):
+        self.matches = matches
+        self.stats = stats
+
+    def to_dict(self):
+        return dict(self.stats)
@@ -0,0 +1,119 @@
+import asyncio
+import unittest
+
+from chatbot_pool import ChatbotPool
+
+
+class FakeBots:
+    """Creates numbered bots, optionally slowly, and records the closed ones."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.created = 0
+        self.closed = []
+
+    async def create(self):
+        await asyncio.sleep(self.delay)
+        self.created += 1
+        return self.created
+
+    async def close(self, bot):
+        self.closed.append(bot)
+
+
+async def settle():
+    """Lets the refills and closes scheduled by the pool run."""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestChatbotPool(unittest.TestCase):
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_session_is_reused_until_max_uses(self):
+        async def scenario():
+            bots = FakeBots()
+            pool = ChatbotPool(bots.create, bots.close, size=1, max_uses=2)
+            used = []
+            for _ in range(3):
+                async with pool.session() as bot:
+                    used.append(bot)
+                await settle()
+            return used, bots.closed
+
+        used, closed = self.run_async(scenario())
+        self.assertEqual(used, [1, 1, 2])
+        self.assertEqual(closed, [1])
+
+    def test_error_recycles_the_session(self):
+        async def scenario():
+            bots = FakeBots()
+            pool = ChatbotPool(bots.create, bots.close, size=1, max_uses=5)
+            with self.assertRaises(RuntimeError):
+                async with pool.session():
+                    raise RuntimeError("throttled")
+            await settle()
+            async with pool.session() as bot:
+                return bot, bots.closed
+
+        bot, closed = self.run_async(scenario())
+        self.assertEqual(bot, 2)
+        self.assertEqual(closed, [1])
+
+    def test_discarded_session_is_not_handed_out_again(self):
+        async def scenario():
+            bots = FakeBots()
+            pool = ChatbotPool(bots.create, bots.close, size=1, max_uses=5)
+            async with pool.session() as bot:
+                pool.discard(bot)
+            await settle()
+            async with pool.session() as bot:
+                return bot, bots.closed
+
+        bot, closed = self.run_async(scenario())
+        self.assertEqual(bot, 2)
+        self.assertEqual(closed, [1])
+
+    def test_checkouts_wait_beyond_size(self):
+        async def scenario():
+            bots = FakeBots()
+            pool = ChatbotPool(bots.create, bots.close, size=2, max_uses=5)
+            in_use = peak = 0
+
+            async def ask():
+                nonlocal in_use, peak
+                async with pool.session():
+                    in_use += 1
+                    peak = max(peak, in_use)
+                    await asyncio.sleep(0.01)
+                    in_use -= 1
+
+            await asyncio.gather(*(ask() for _ in range(6)))
+            return peak, pool.stats()
+
+        peak, stats = self.run_async(scenario())
+        self.assertEqual(peak, 2)
+        self.assertLessEqual(stats["created"], 2)
+        self.assertEqual(stats["checkouts"], 6)
+
+    def test_close_closes_sessions_created_meanwhile(self):
+        async def scenario():
+            bots = FakeBots(delay=0.01)
+            pool = ChatbotPool(bots.create, bots.close, size=3)
+            pool._refill()
+            await asyncio.sleep(0)
+            # The first session is still being created
+            await pool.close()
+            await asyncio.sleep(0.05)
+            await settle()
+            return bots.created, bots.closed, pool.stats()
+
+        created, closed, stats = self.run_async(scenario())
+        self.assertEqual(sorted(closed), list(range(1, created + 1)))
+        self.assertEqual(stats["alive"], 0)
+        self.assertEqual(stats["idle"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
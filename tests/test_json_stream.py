@@ -0,0 +1,84 @@
+import unittest
+
+from json_stream import JsonObjectStream
+
+REPLY = (
+    '{"command": {"name": "browse_website", "args": {"url": "https://a.b/?q={x}"}}, '
+    '"thoughts": {"text": "say \\"hi\\" {not json}", "plan": "- a\\n- b"}, '
+    '"count": 3, "done": true}'
+)
+
+
+def feed_in_pieces(stream, text, size):
+    """Feeds growing prefixes of the text, returning the members completed by each."""
+    return [stream.feed(text[:end]) for end in range(size, len(text) + size, size)]
+
+
+class TestJsonObjectStream(unittest.TestCase):
+    def test_whole_reply(self):
+        stream = JsonObjectStream()
+        completed = stream.feed(REPLY)
+        self.assertEqual(completed, stream.members)
+        self.assertEqual(stream.members["command"]["args"]["url"], "https://a.b/?q={x}")
+        self.assertEqual(stream.members["thoughts"]["text"], 'say "hi" {not json}')
+        self.assertEqual(stream.members["count"], 3)
+        self.assertIs(stream.members["done"], True)
+        self.assertTrue(stream.closed)
+
+    def test_members_complete_as_the_reply_grows(self):
+        for size in (1, 7, 50):
+            stream = JsonObjectStream()
+            updates = feed_in_pieces(stream, REPLY, size)
+            names = [name for update in updates for name in update]
+            self.assertEqual(names, ["command", "thoughts", "count", "done"], size)
+            self.assertTrue(stream.closed)
+
+    def test_command_is_parsed_before_the_rest(self):
+        stream = JsonObjectStream()
+        end = REPLY.index('"thoughts"')
+        completed = stream.feed(REPLY[:end])
+        self.assertEqual(completed["command"]["name"], "browse_website")
+        self.assertFalse(stream.closed)
+
+    def test_partial_values_are_not_reported(self):
+        stream = JsonObjectStream()
+        self.assertEqual(stream.feed('{"count": 12'), {})
+        self.assertEqual(stream.feed('{"text": "unfinished \\"'), {})
+        self.assertEqual(stream.members, {})
+
+    def test_number_completes_at_the_next_member(self):
+        stream = JsonObjectStream()
+        self.assertEqual(stream.feed('{"count": 12'), {})
+        self.assertEqual(stream.feed('{"count": 12,'), {"count": 12})
+
+    def test_code_fence_and_prose_are_skipped(self):
+        stream = JsonObjectStream()
+        stream.feed('Here is my reply:\n```json\n' + REPLY + '\n```')
+        self.assertEqual(stream.members["command"]["name"], "browse_website")
+        self.assertTrue(stream.closed)
+
+    def test_escaped_backslash_before_quote(self):
+        stream = JsonObjectStream()
+        stream.feed('{"path": "C:\\\\", "next": 1}')
+        self.assertEqual(stream.members, {"path": "C:\\", "next": 1})
+
+    def test_text_after_the_object_is_ignored(self):
+        stream = JsonObjectStream()
+        stream.feed('{"a": 1} {"b": 2}')
+        self.assertEqual(stream.members, {"a": 1})
+
+    def test_revised_reply_is_scanned_again(self):
+        stream = JsonObjectStream()
+        stream.feed('{"command": {"name": "a"}, ')
+        completed = stream.feed('{"command": {"name": "b"}, ')
+        self.assertEqual(completed, {"command": {"name": "b"}})
+        self.assertEqual(stream.members, {"command": {"name": "b"}})
+
+    def test_non_strict_member_is_left_out(self):
+        stream = JsonObjectStream()
+        stream.feed("{'single': 1, \"ok\": [1, 2]}")
+        self.assertEqual(stream.members, {"ok": [1, 2]})
+
+
+if __name__ == "__main__":
+    unittest.main()
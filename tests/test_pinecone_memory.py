@@ -0,0 +1,150 @@
+import time
+import unittest
+import zlib
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from config import Singleton
+from memory import pinecone as pinecone_memory
+from memory.pinecone import PineconeMemory
+from memory.upsert_buffer import UpsertBuffer
+
+from tests.pinecone_stub import StubIndex
+
+DIM = 8
+
+
+def embed(text):
+    """A unit vector seeded by the text, so that a text is nearest to itself."""
+    vector = np.random.default_rng(zlib.crc32(text.encode())).standard_normal(DIM)
+    return (vector / np.linalg.norm(vector)).astype(np.float32)
+
+
+def embed_many(texts):
+    return np.stack([embed(text) for text in texts]) if texts else np.zeros((0, DIM), dtype=np.float32)
+
+
+def items(count, start=0):
+    return [(str(i), embed(str(i)).tolist(), {"raw_text": str(i)}) for i in range(start, start + count)]
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestUpsertBuffer(unittest.TestCase):
+    def buffer(self, **kwargs):
+        self.index = StubIndex()
+        buffer = UpsertBuffer(self.index, **kwargs)
+        self.addCleanup(buffer.close)
+        return buffer
+
+    def test_full_chunk_is_flushed(self):
+        buffer = self.buffer(chunk_size=3, flush_interval=60)
+        buffer.add(items(2))
+        buffer.add(items(2, start=2))
+        self.assertTrue(wait_until(lambda: len(self.index.vectors) == 4))
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.stats()["upserts"], 2)
+
+    def test_partial_chunk_waits_for_the_timer(self):
+        buffer = self.buffer(chunk_size=100, flush_interval=0.2)
+        buffer.add(items(2))
+        time.sleep(0.05)
+        self.assertEqual(self.index.vectors, [])
+        self.assertTrue(wait_until(lambda: len(self.index.vectors) == 2))
+        self.assertEqual(buffer.stats(), {"buffered": 0, "upserts": 1, "upserted": 2})
+
+    def test_flush_upserts_in_chunks(self):
+        buffer = self.buffer(chunk_size=4, flush_interval=60)
+        with mock.patch.object(self.index, "upsert", wraps=self.index.upsert) as upsert:
+            buffer.add(items(3))
+            buffer.flush()
+            buffer.add(items(7, start=3))
+            buffer.flush()
+        self.assertEqual(len(self.index.vectors), 10)
+        self.assertLessEqual(max(len(call.args[0]) for call in upsert.call_args_list), 4)
+
+    def test_failed_upsert_is_buffered_again(self):
+        buffer = self.buffer(chunk_size=100, flush_interval=60)
+        buffer.add(items(2))
+        with mock.patch.object(self.index, "upsert", side_effect=RuntimeError("unavailable")), \
+                self.assertRaises(RuntimeError):
+            buffer.flush()
+        self.assertEqual(len(buffer), 2)
+        buffer.flush()
+        self.assertEqual(len(self.index.vectors), 2)
+
+    def test_close_flushes(self):
+        buffer = self.buffer(chunk_size=100, flush_interval=60)
+        buffer.add(items(2))
+        buffer.close()
+        self.assertEqual(len(self.index.vectors), 2)
+
+
+class TestPineconeMemory(unittest.TestCase):
+    def setUp(self):
+        for name, fake in (("get_flax_embedding", embed), ("get_flax_embeddings", embed_many)):
+            patcher = mock.patch.object(pinecone_memory, name, fake)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.clock = SimpleNamespace(now=1000.0)
+        patcher = mock.patch.object(pinecone_memory, "time", SimpleNamespace(monotonic=lambda: self.clock.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = StubIndex()
+        cfg = SimpleNamespace(
+            pinecone_upsert_chunk_size=100,
+            pinecone_flush_interval=60,
+            pinecone_stats_ttl=30,
+            memory_dedup=False,
+            memory_dedup_threshold=0.95,
+        )
+        Singleton._instances.pop(PineconeMemory, None)
+        self.memory = PineconeMemory(cfg, index=self.index)
+        self.addCleanup(Singleton._instances.pop, PineconeMemory, None)
+        self.addCleanup(self.memory.writer.close)
+
+    def test_adds_are_buffered(self):
+        self.memory.add_many(["apples", "pears"])
+        self.assertEqual(self.index.vectors, [])
+        self.assertEqual(len(self.memory.writer), 2)
+
+    def test_reads_see_buffered_adds(self):
+        self.memory.add("apples")
+        self.memory.add("pears")
+        self.assertEqual(self.memory.get_relevant("pears", 1), ["pears"])
+        self.assertEqual(len(self.index.vectors), 2)
+        self.assertEqual(self.memory.get_relevant_many(["apples"], 1), [["apples"]])
+
+    def test_clear_drops_buffered_adds(self):
+        self.memory.add("apples")
+        self.memory.clear()
+        self.assertEqual(self.memory.get_relevant("apples", 1), [])
+
+    def test_stats_are_cached_for_the_ttl(self):
+        with mock.patch.object(self.index, "describe_index_stats",
+                               wraps=self.index.describe_index_stats) as describe:
+            self.assertEqual(self.memory.get_stats()["total_vector_count"], 0)
+            self.memory.add("apples")
+            self.memory.writer.flush()
+            self.clock.now += 29
+            self.assertEqual(self.memory.get_stats()["total_vector_count"], 0)
+            self.assertEqual(describe.call_count, 1)
+            self.clock.now += 1
+            self.assertEqual(self.memory.get_stats()["total_vector_count"], 1)
+            self.assertEqual(describe.call_count, 2)
+
+    def test_stats_report_the_buffer(self):
+        self.memory.add("apples")
+        self.assertEqual(self.memory.get_stats()["upsert_buffer"]["buffered"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
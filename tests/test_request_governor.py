@@ -0,0 +1,218 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import request_governor
+from request_governor import CircuitOpenError, RequestGovernor, TokenBucket
+
+# asyncio.sleep is patched by the tests, this one yields to other tasks
+yield_to_tasks = asyncio.sleep
+
+
+class FakeClock:
+    """Stands in for `time` and `asyncio.sleep`, sleeping without waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class GovernorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        for patcher in (
+            mock.patch.object(request_governor, "time", self.clock),
+            mock.patch.object(request_governor.asyncio, "sleep", self.clock.sleep),
+            # The longest backoff, so that delays are predictable
+            mock.patch.object(request_governor.random, "uniform", lambda low, high: high),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+
+class TestTokenBucket(GovernorTestCase):
+    def test_burst_then_rate(self):
+        async def scenario():
+            bucket = TokenBucket(rate=2.0, burst=3)
+            return [await bucket.acquire() for _ in range(5)]
+
+        waits = self.run_async(scenario())
+        self.assertEqual(waits[:3], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(waits[3], 0.5)
+        self.assertAlmostEqual(waits[4], 0.5)
+
+    def test_tokens_refill_while_idle(self):
+        async def scenario():
+            bucket = TokenBucket(rate=1.0, burst=2)
+            await bucket.acquire()
+            await bucket.acquire()
+            self.clock.now += 10
+            return [await bucket.acquire() for _ in range(3)]
+
+        self.assertEqual(self.run_async(scenario()), [0.0, 0.0, 1.0])
+
+    def test_no_rate_never_waits(self):
+        async def scenario():
+            bucket = TokenBucket(rate=0, burst=1)
+            return [await bucket.acquire() for _ in range(10)]
+
+        self.assertEqual(self.run_async(scenario()), [0.0] * 10)
+
+
+def failing(times, result="ok"):
+    """A request that raises on its first `times` attempts."""
+    attempts = []
+
+    async def request():
+        attempts.append(1)
+        if len(attempts) <= times:
+            raise RuntimeError("boom")
+        return result
+
+    return request, attempts
+
+
+class TestRetries(GovernorTestCase):
+    def governor(self, **kwargs):
+        options = {"rate": 0, "retries": 3, "base_delay": 1.0, "max_delay": 3.0, "failure_threshold": 0}
+        return RequestGovernor(**{**options, **kwargs})
+
+    def test_retries_with_capped_exponential_backoff(self):
+        governor = self.governor()
+        request, attempts = failing(3)
+        with mock.patch("builtins.print"):
+            self.assertEqual(self.run_async(governor.call(request)), "ok")
+        self.assertEqual(len(attempts), 4)
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0, 3.0])
+        self.assertEqual(governor.stats()["retries"], 3)
+        self.assertEqual(governor.stats()["failed"], 0)
+
+    def test_last_error_is_raised(self):
+        governor = self.governor(retries=1)
+        request, attempts = failing(5)
+        with mock.patch("builtins.print"), self.assertRaises(RuntimeError):
+            self.run_async(governor.call(request))
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(governor.stats()["failed"], 1)
+
+    def test_retries_of_one_request(self):
+        governor = self.governor()
+        request, attempts = failing(5)
+        with mock.patch("builtins.print"), self.assertRaises(RuntimeError):
+            self.run_async(governor.call(request, retries=0))
+        self.assertEqual(len(attempts), 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_failed_results_are_retried(self):
+        governor = self.governor(retries=2)
+        replies = iter(["No response", "No response", "hello"])
+
+        async def request():
+            return next(replies)
+
+        reply = self.run_async(governor.call(request, failed=lambda r: r == "No response"))
+        self.assertEqual(reply, "hello")
+
+    def test_last_failed_result_is_returned(self):
+        governor = self.governor(retries=1)
+
+        async def request():
+            return "No response"
+
+        reply = self.run_async(governor.call(request, failed=lambda r: r == "No response"))
+        self.assertEqual(reply, "No response")
+        self.assertEqual(governor.stats()["failed"], 1)
+
+
+class TestCircuitBreaker(GovernorTestCase):
+    def setUp(self):
+        super().setUp()
+        self.governor = RequestGovernor(rate=0, retries=0, failure_threshold=2, reset_timeout=60)
+        print_patcher = mock.patch("builtins.print")
+        print_patcher.start()
+        self.addCleanup(print_patcher.stop)
+
+    def call(self, request):
+        return self.run_async(self.governor.call(request))
+
+    def fail_twice(self):
+        for _ in range(2):
+            request, _ = failing(1)
+            with self.assertRaises(RuntimeError):
+                self.call(request)
+
+    def test_opens_after_threshold(self):
+        request, _ = failing(2)
+        with self.assertRaises(RuntimeError):
+            self.call(request)
+        self.assertEqual(self.governor.state, "closed")
+        with self.assertRaises(RuntimeError):
+            self.call(request)
+        self.assertEqual(self.governor.state, "open")
+        self.assertEqual(self.governor.retry_after, 60)
+
+    def test_open_circuit_rejects_without_sending(self):
+        self.fail_twice()
+        request, attempts = failing(0)
+        with self.assertRaises(CircuitOpenError):
+            self.call(request)
+        self.assertEqual(attempts, [])
+        self.assertEqual(self.governor.stats()["rejected"], 1)
+
+    def test_successful_probe_closes(self):
+        self.fail_twice()
+        self.clock.now += 60
+        self.assertEqual(self.governor.state, "half-open")
+        self.assertEqual(self.governor.retry_after, 0)
+        request, _ = failing(0)
+        self.assertEqual(self.call(request), "ok")
+        self.assertEqual(self.governor.state, "closed")
+        self.assertAlmostEqual(self.governor.stats()["open_seconds"], 60)
+
+    def test_failed_probe_reopens(self):
+        self.fail_twice()
+        self.clock.now += 60
+        request, _ = failing(1)
+        with self.assertRaises(RuntimeError):
+            self.call(request)
+        self.assertEqual(self.governor.state, "open")
+        self.assertEqual(self.governor.retry_after, 60)
+        self.assertEqual(self.governor.stats()["circuit_opened"], 1)
+
+    def test_one_probe_at_a_time(self):
+        self.fail_twice()
+        self.clock.now += 60
+
+        async def scenario():
+            release = asyncio.Event()
+
+            async def slow():
+                await release.wait()
+                return "ok"
+
+            probe = asyncio.ensure_future(self.governor.call(slow))
+            await yield_to_tasks(0)
+            with self.assertRaises(CircuitOpenError):
+                await self.governor.call(slow)
+            release.set()
+            return await probe
+
+        self.assertEqual(self.run_async(scenario()), "ok")
+        self.assertEqual(self.governor.state, "closed")
+
+
+if __name__ == "__main__":
+    unittest.main()
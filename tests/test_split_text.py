@@ -0,0 +1,48 @@
+import unittest
+
+from browse import split_text
+from token_counter import count_tokens
+
+SENTENCES = " ".join(f"Sentence number {i} talks about the weather today." for i in range(40))
+
+
+class TestSplitText(unittest.TestCase):
+    def assert_within(self, chunks, max_tokens):
+        for chunk in chunks:
+            self.assertLessEqual(count_tokens(chunk), max_tokens, chunk)
+
+    def test_short_text_is_one_chunk(self):
+        text = "First paragraph.\nSecond paragraph."
+        self.assertEqual(list(split_text(text, max_tokens=100)), [text])
+
+    def test_paragraphs_are_packed_whole(self):
+        paragraphs = [f"Paragraph {i} has a few words in it." for i in range(20)]
+        chunks = list(split_text("\n".join(paragraphs), max_tokens=30))
+        self.assertGreater(len(chunks), 1)
+        self.assert_within(chunks, 30)
+        self.assertEqual([p for chunk in chunks for p in chunk.split("\n")], paragraphs)
+
+    def test_long_paragraph_is_split_at_sentences(self):
+        chunks = list(split_text(SENTENCES, max_tokens=40))
+        self.assertGreater(len(chunks), 1)
+        self.assert_within(chunks, 40)
+        for chunk in chunks:
+            self.assertTrue(chunk.endswith("today."), chunk)
+        self.assertEqual(" ".join(chunks), SENTENCES)
+
+    def test_long_sentence_is_split_at_words(self):
+        sentence = " ".join(f"word{i}" for i in range(200))
+        chunks = list(split_text(sentence, max_tokens=20))
+        self.assert_within(chunks, 20)
+        self.assertEqual(" ".join(chunks).split(), sentence.split())
+
+    def test_long_word_is_split_anywhere(self):
+        blob = "x" * 1000
+        chunks = list(split_text(blob, max_tokens=10))
+        self.assertGreater(len(chunks), 1)
+        self.assert_within(chunks, 10)
+        self.assertEqual("".join(chunks).replace("\n", ""), blob)
+
+
+if __name__ == "__main__":
+    unittest.main()
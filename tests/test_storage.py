@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+from memory.storage import OFFSET_DTYPE, AppendOnlyStorage
+
+DIM = 4
+
+
+class TestStorageRepair(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.prefix = os.path.join(self.dir.name, "memory")
+        self.rows = np.arange(3 * DIM, dtype=np.float32).reshape(3, DIM)
+        storage = AppendOnlyStorage(self.prefix, DIM)
+        storage.append_many(["first", "second", "third"], self.rows)
+        storage.close()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def truncate(self, suffix, size):
+        with open(f"{self.prefix}.{suffix}", "r+b") as f:
+            f.truncate(size)
+
+    def reopen(self):
+        storage = AppendOnlyStorage(self.prefix, DIM)
+        self.addCleanup(storage.close)
+        return storage
+
+    def assertRows(self, storage, count):
+        texts, matrix = storage.load()
+        self.assertEqual(texts, ["first", "second", "third"][:count])
+        np.testing.assert_array_equal(matrix, self.rows[:count])
+        self.assertEqual(len(storage.timestamps()), count)
+        self.assertEqual(len(storage.tags()), count)
+
+    def test_intact_files_are_kept(self):
+        self.assertRows(self.reopen(), 3)
+
+    def test_truncated_vector_drops_the_row(self):
+        # Half of the last row was written
+        self.truncate("vec", 2 * DIM * 4 + 2)
+        storage = self.reopen()
+        self.assertEqual(len(storage), 2)
+        self.assertRows(storage, 2)
+        self.assertEqual(os.path.getsize(f"{self.prefix}.off"), 2 * OFFSET_DTYPE.itemsize)
+        self.assertEqual(os.path.getsize(f"{self.prefix}.txt"), len("firstsecond"))
+
+    def test_truncated_offsets_drop_the_row(self):
+        # The crash happened before the offset committed the last row
+        self.truncate("off", 2 * OFFSET_DTYPE.itemsize + 3)
+        storage = self.reopen()
+        self.assertEqual(len(storage), 2)
+        self.assertRows(storage, 2)
+        self.assertEqual(os.path.getsize(f"{self.prefix}.vec"), 2 * DIM * 4)
+
+    def test_truncated_text_drops_the_row(self):
+        self.truncate("txt", len("firstsecondth"))
+        self.assertRows(self.reopen(), 2)
+
+    def test_appends_after_repair(self):
+        self.truncate("vec", 2 * DIM * 4 + 2)
+        storage = self.reopen()
+        storage.append("fourth", np.full(DIM, 7, dtype=np.float32))
+        storage.close()
+        texts, matrix = self.reopen().load()
+        self.assertEqual(texts, ["first", "second", "fourth"])
+        np.testing.assert_array_equal(matrix[2], np.full(DIM, 7))
+
+
+if __name__ == "__main__":
+    unittest.main()